@@ -1,23 +1,26 @@
+import argparse
 import base64
 import http.client
 import json
-import re
+import queue
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
-from ratelimiter import RateLimiter
+from rate_limiting import rate_limited, get_rate_limits
 from tqdm import tqdm
 import dateutil.parser
 import semanticscholar as sch
-from database_operations import query_by_field_exists, query_by_conference, update_collection_one
+from database_operations import BulkWriter, get_collection, iter_documents
+from doi_cache import doi_from_url
 from elsapy.elsclient import ElsClient
 from elsapy.elssearch import ElsSearch
+from pymongo import UpdateOne
 from serpapi import GoogleScholarSearch
-import sys
 
 scopus_client=ElsClient("API KEY")
 
-@RateLimiter(max_calls=4,period=3)
+@rate_limited("serpapi.com")
 def scrape_google_scholar(title,year):
     """
     SCRAPE CITATION DETAILS FROM GOOGLE SCHOLAR
@@ -39,11 +42,13 @@ def scrape_google_scholar(title,year):
 
     #initiate the client and get the results as a dictionary
     client = GoogleScholarSearch(params)
-    try:
-        results=client.get_dict()
-    except:
-        print("results not found")
-        results=[]
+    # a failed call raises, so that the paper is left for the next run instead of being stored without results
+    results=client.get_dict()
+
+    # a refused key or a used up plan comes back as an error, and so does a search without results
+    error=results.get("error")
+    if error and "hasn't returned any results" not in error:
+        raise OSError(error)
 
     # result contains a lot of redundant data so filtering it
     filter_keys=["title","result_id","link","publication_info","inline_links"]
@@ -65,7 +70,7 @@ def scrape_google_scholar(title,year):
 
 
 
-@RateLimiter(max_calls=9,period=1)
+@rate_limited("api.elsevier.com")
 def scrape_scopus(title,year):
     """
     RATE LIMITS OF 20,000/ 7 days
@@ -137,17 +142,17 @@ def scrape_semanticscholar(title,year,url):
     doi=""
     # go through links, since there's only going to be one doi link
     for link in url:
-        doi_link = re.search(r"doi.org/(.*)", link)
+        doi_link = doi_from_url(link)
 
         #if doi url is found
         if doi_link:
-            doi=doi_link.group(1)
+            doi=doi_link
 
     #Semantic scholar api only valid for links, so only return if any valid link was found
     if doi:
         return semantic_api(doi,year)
 
-@RateLimiter(max_calls=1, period=3)
+@rate_limited("api.semanticscholar.org")
 def semantic_api(doi,year):
     """
     MAKE CALLS TO THE SEMANTIC SCHOLAR API AND THROTTLE THE API CALLS TO 100 PER 5 MINUTES
@@ -176,7 +181,7 @@ def semantic_api(doi,year):
                 return []
 
 
-@RateLimiter(max_calls=1,period=2)
+@rate_limited("api.labs.cognitive.microsoft.com")
 def scrape_microsoft(title,year):
     """
     SCRAPE CITAITON COUNT FROM MICROSOFT ACADEMIC
@@ -209,6 +214,8 @@ def scrape_microsoft(title,year):
         conn = http.client.HTTPSConnection('api.labs.cognitive.microsoft.com')
         conn.request("GET", "/academic/v1.0/evaluate?%s" % params, "{body}", headers)
         response = conn.getresponse()
+        #adapt the rate limit to the status and headers of the response
+        get_rate_limits().observe("api.labs.cognitive.microsoft.com",response.status,dict(response.getheaders()))
         #making a json file of the returned bytes
         data = json.loads(response.read())
         if data.get('error'):
@@ -226,11 +233,10 @@ def scrape_microsoft(title,year):
 
         return return_entities
 
+    # a refused key or a service that is gone raises, so that the paper is left for the next run instead of being stored without results
     except Exception as e:
-        if isinstance(e,OSError):
-            if e.strerror=="403 error":
-                raise
-            print("[Errno {0}] {1}".format(e.errno, e.strerror))
+        print(f"microsoft: {e!r}")
+        raise
 
 
 def encode_title_microsoft(title):
@@ -252,56 +258,161 @@ def encode_title_microsoft(title):
 
 
 
-if __name__=="__main__":
+# every provider: the field of the paper it fills, the field of the paper it needs, how a paper is looked up, the number of threads of its lane (enough
+# to keep up with its rate limit) and the most papers it looks up in a run (the searches of the serpapi plan), None for no limit
+PROVIDERS={
+    "scholar":{"field":"Scholar_cites","needs":"title","workers":2,"limit":29000,
+               "lookup":lambda doc:scrape_google_scholar(doc["title"][0],doc["year"][0])},
+    "semantic":{"field":"SemanticScholar_cites","needs":"ee","workers":1,"limit":None,
+                "lookup":lambda doc:scrape_semanticscholar((doc.get("title") or [None])[0],doc["year"][0],doc["ee"])},
+    "scopus":{"field":"Scopus_cites","needs":"title","workers":4,"limit":None,
+              "lookup":lambda doc:scrape_scopus(doc["title"][0],doc["year"][0])},
+    "microsoft":{"field":"MSAcademic_cites","needs":"title","workers":1,"limit":None,
+                 "lookup":lambda doc:scrape_microsoft(doc["title"][0],doc["year"][0])},
+}
 
+# providers of a run without arguments, scopus only on request for its weekly quota. Microsoft Academic has been shut down and is left out
+DEFAULT_PROVIDERS=["scholar","semantic"]
 
-    c,count=query_by_field_exists("PDF",return_count=True)
+# papers that can wait for every lane, and results per write
+QUEUE_SIZE=100
+WRITE_BATCH=50
 
-    if sys.argv[1]=="2":
 
-        print("Microsoft")
-        microsoft_list=list(c)
-        for i, doc in tqdm(enumerate(microsoft_list),total=count):
-            if doc.get("MSAcademic_cites",9)==9:
-                if doc.get("title"):
-                    update_dict={}
-                    update_dict["id"] = doc["_id"]
-                    res=scrape_microsoft(doc.get('title')[0],doc.get("year")[0])
-                    update_dict['MSAcademic_cites']=res
-                    update_collection_one(update_dict)
+class Lane:
+    """
+    THE LOOKUPS OF ONE PROVIDER: A QUEUE OF PAPERS AND A FEW THREADS THAT LOOK THEM UP AT THE RATE OF THE PROVIDER (EVERY PROVIDER HAS ITS OWN BUCKET
+    IN rate_limiting.py), SO THAT A FAST PROVIDER NEVER WAITS FOR A SLOW ONE
+    """
 
+    def __init__(self,name,provider,writes,queue_size=QUEUE_SIZE):
+        """
+        :param name: name of the provider, a key of PROVIDERS
+        :type name: string
+        :param provider: entry of PROVIDERS
+        :type provider: Dict
+        :param writes: where the results are written, shared by the lanes
+        :type writes: database_operations.BulkWriter object
+        :param queue_size: Number of papers that can wait for the lane
+        :type queue_size: int
+        """
+        self.name=name
+        self.provider=provider
+        self.writes=writes
+        self.papers=queue.Queue(queue_size)
+        self.offered=0
+        self.done=0
+        self.failed=None
+        self.lock=threading.Lock()
+        self.threads=[threading.Thread(target=self.run,daemon=True) for _ in range(provider["workers"])]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def open(self):
+        """
+        THE LANE STILL TAKES PAPERS: IT DID NOT FAIL AND DID NOT REACH THE LIMIT OF ITS PROVIDER
+        """
+        return self.failed is None and (self.provider["limit"] is None or self.offered<self.provider["limit"])
+
+    def wants(self,doc):
+        """
+        CHECK IF A PAPER STILL HAS TO BE LOOKED UP BY THE PROVIDER
+        """
+        return self.provider["field"] not in doc and bool(doc.get(self.provider["needs"])) and bool(doc.get("year"))
+
+    def offer(self,doc):
+        """
+        QUEUE A PAPER IF THE LANE WANTS IT, WAITING WHILE THE QUEUE IS FULL
+        :param doc: paper with _id, title, year, ee and the fields of the providers it has
+        :type doc: Dict
+        """
+        if not self.open or not self.wants(doc):
+            return
+        self.offered+=1
+        while self.failed is None:
+            try:
+                self.papers.put(doc,timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self):
+        """
+        LOOP OF A THREAD OF THE LANE, UNTILL IT GETS None
+        """
+        while True:
+            doc=self.papers.get()
+            if doc is None or self.failed is not None:
+                return
+            try:
+                result=self.provider["lookup"](doc)
+            # the key is refused or out of quota, the other lanes carry on and the papers left are looked up on the next run
+            except Exception as e:
+                self.failed=e
+                print(f"{self.name} stopped: {e!r}")
+                return
+            self.writes.add(UpdateOne({"_id":doc["_id"]},{"$set":{self.provider["field"]:result}}))
+            with self.lock:
+                self.done+=1
+
+    def close(self):
+        """
+        WAIT FOR THE PAPERS IN THE QUEUE TO BE LOOKED UP
+        """
+        # a lane that failed drops the papers it did not get to, they are looked up on the next run
+        if self.failed is not None:
+            while not self.papers.empty():
+                self.papers.get_nowait()
+        for _ in self.threads:
+            self.papers.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def collect_citations(names,collection=None):
     """
-    print("Scopus")
-    for i, doc in tqdm(enumerate(c),total=count):
-        if doc.get("title"):
-            update_dict={}
-            update_dict["id"] = doc["_id"]
-            res=scrape_scopus(doc.get('title')[0],doc.get("year")[0])
-            update_dict['Scopus_cites']=res
-            update_collection_one(update_dict)
+    LOOK UP THE PAPERS WITH A PDF THAT ARE MISSING THE FIELDS OF THE GIVEN PROVIDERS, WITH A LANE PER PROVIDER. THE PAPERS ARE READ IN ONE PASS, A BATCH
+    AT A TIME, AND EVERY PAPER IS HANDED TO THE LANES THAT STILL NEED IT; THE RESULTS OF ALL THE LANES ARE WRITTEN TOGETHER IN BULK
+    :param names: keys of PROVIDERS
+    :type names: list of strings
+    :param collection: papers collection
+    :type collection: MongoClient.Collection object
+    :return: Dictionary of provider to the number of papers looked up
     """
+    if collection is None:
+        collection=get_collection()
+
+    writes=BulkWriter(collection,batch_size=WRITE_BATCH)
+    lanes=[Lane(name,PROVIDERS[name],writes) for name in names]
+
+    fields=[PROVIDERS[name]["field"] for name in names]
+    query={"PDF":{"$exists":True},"$or":[{field:{"$exists":False}} for field in fields]}
+    projection=dict.fromkeys(["title","year","ee"]+fields,1)
+
+    try:
+        for doc in tqdm(iter_documents(query,projection,collection=collection),total=collection.count_documents(query)):
+            if not any(lane.open for lane in lanes):
+                break
+            for lane in lanes:
+                lane.offer(doc)
+    finally:
+        for lane in lanes:
+            lane.close()
+        writes.flush()
+
+    return {lane.name:lane.done for lane in lanes}
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Collect the citations of the papers from several providers at the same time")
+    # the names are checked here, argparse checks an empty list (and a list default) against choices as a whole and rejects it
+    arg_parser.add_argument("providers",nargs="*",help=f"providers to look the papers up with, out of {' '.join(sorted(PROVIDERS))}. "
+                                                       f"{' '.join(DEFAULT_PROVIDERS)} by default")
+    args=arg_parser.parse_args()
+
+    unknown=[name for name in args.providers if name not in PROVIDERS]
+    if unknown:
+        arg_parser.error(f"unknown providers {' '.join(unknown)}, choose from {' '.join(sorted(PROVIDERS))}")
 
-    if sys.argv[1]=="3":
-        semantic_list=list(c)
-        print("Semantic")
-        for i, doc in tqdm(enumerate(semantic_list),total=count):
-            if doc.get("SemanticScholar_cites",9)==9:
-                if doc.get("ee"):
-                    update_dict = {}
-                    update_dict["id"] = doc["_id"]
-                    res = scrape_semanticscholar("title", doc.get("year")[0],doc.get('ee'))
-                    update_dict['SemanticScholar_cites'] = res
-                    update_collection_one(update_dict)
-
-    if sys.argv[1]=="1":
-        print("google")
-        for i, doc in enumerate(c):
-            if doc.get("Scholar_cites",9)==9:
-                if doc.get("title"):
-                    update_dict = {}
-                    update_dict["id"] = doc["_id"]
-                    res = scrape_google_scholar(doc.get('title')[0], doc.get("year")[0])
-                    update_dict['Scholar_cites'] = res
-                    update_collection_one(update_dict)
-                if i>29000:
-                    break
\ No newline at end of file
+    print(collect_citations(args.providers or DEFAULT_PROVIDERS))
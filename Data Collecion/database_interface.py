@@ -165,7 +165,10 @@ def parse_detailed_commits(repository,time_scale,mean_date,variable="count", cum
     """
 
 
-    commits = repository.get("Detailed_commits",[])
+    commits = repository.get("Detailed_commits")
+    # repositories collected with detailed_sourcecode.py --daily only have the number of commits (and the sum of Total) of every day
+    if commits is None:
+        commits=[dict(day,Date=day["day"]) for day in repository.get("Commits_daily",[])]
 
     comm_dict={}
     for commit in commits:
@@ -173,7 +176,7 @@ def parse_detailed_commits(repository,time_scale,mean_date,variable="count", cum
 
         val=comm_dict.get(days_diff,0)
         if variable=="count":
-            val+=1
+            val+=commit.get("count",1)
         else:
             val+=commit[variable]
 
@@ -211,7 +214,10 @@ def parse_detailed_stars(repository,time_scale,mean_date,variable="count", cum=F
     """
 
 
-    commits = repository.get("Stars_events",[])
+    commits = repository.get("Stars_events")
+    # repositories collected with detailed_sourcecode.py --daily only have the number of stars of every day
+    if commits is None:
+        commits=[dict(day,time=day["day"]) for day in repository.get("Stars_daily",[])]
 
     comm_dict={}
     for commit in commits:
@@ -222,7 +228,7 @@ def parse_detailed_stars(repository,time_scale,mean_date,variable="count", cum=F
             raise
         val=comm_dict.get(days_diff,0)
         if variable=="count":
-            val+=1
+            val+=commit.get("count",1)
         else:
             val+=commit[variable]
 
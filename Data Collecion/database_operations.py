@@ -1,7 +1,10 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from pymongo.collation import Collation
 import json
+import threading
+from collections import Counter
 from bson.objectid import ObjectId
-from pymongo.errors import  WriteConcernError,WriteError
+from pymongo.errors import  BulkWriteError,WriteConcernError,WriteError
 
 def get_collection(connection_url="MONGODB DATABSE URL",database_name="papers",collection_name="papers"):
     """
@@ -164,6 +167,219 @@ def query_by_field_exists(field_name,exist_bool=True,return_count=False,no_timeo
         return return_list[0]
 
 
+def push_to_document(object_id,field,values,collection=None,position=None,set_fields=None):
+    """
+    APPEND VALUES TO AN ARRAY FIELD OF A DOCUMENT WITH $push/$each, SO THAT LONG LISTS CAN BE STORED PIECE BY PIECE AS THEY ARE SCRAPED
+    :param object_id: MongoDB id of the document
+    :type object_id: string for bson.objectid object
+    :param field: name of the array field
+    :type field: String
+    :param values: values to append
+    :type values: list
+    :param collection: MongoDB collection object, to reduce repeatedly getting connections
+    :type collection: MongoClient.Collection object
+    :param position: index the values are inserted at, e.g. 0 for lists that are kept newest first. At the end if not given
+    :type position: int
+    :param set_fields: other fields to set in the same write, e.g. how far the list has been scraped
+    :type set_fields: dict
+    """
+    if type(object_id)==str:
+        object_id=ObjectId(object_id)
+
+    if collection is None:
+        collection=get_collection()
+
+    try:
+        push={"$each":values}
+        if position is not None:
+            push["$position"]=position
+
+        update={"$push":{field:push}}
+        if set_fields:
+            update["$set"]=set_fields
+
+        collection.update_one({"_id":object_id},update)
+    except (WriteError,WriteConcernError) as e:
+        print("Writerror")
+
+
+# number of elements written at a time by ChunkWriter
+CHUNK_SIZE=1000
+
+
+class ChunkWriter:
+    """
+    STORE A LONG LIST INTO AN ARRAY FIELD OF A DOCUMENT IN CHUNKS OF CHUNK_SIZE AS IT IS SCRAPED, TOGETHER WITH A CURSOR SAYING HOW FAR THE SCRAPING
+    GOT (A PAGE NUMBER, A TIMESTAMP...). A SCRAPE THAT STOPS HALF WAY KEEPS WHAT WAS WRITTEN, AND CAN BE CONTINUED FROM THE CURSOR. THE CURSOR IS SET
+    TO NONE ONCE THE LIST IS COMPLETE
+    """
+
+    def __init__(self,object_id,field,cursor_field,collection=None,chunk_size=CHUNK_SIZE):
+        """
+        :param object_id: MongoDB id of the document
+        :type object_id: bson.objectid object
+        :param field: name of the array field
+        :type field: String
+        :param cursor_field: name of the field the cursor is kept in
+        :type cursor_field: String
+        :param collection: MongoDB collection object
+        :type collection: MongoClient.Collection object
+        :param chunk_size: Number of elements per write
+        :type chunk_size: int
+        """
+        self.object_id=object_id
+        self.field=field
+        self.cursor_field=cursor_field
+        self.collection=collection if collection is not None else get_collection()
+        self.chunk_size=chunk_size
+
+        self.buffer=[]
+        self.cursor=None
+        self.written=0
+
+    def add(self,values,cursor):
+        """
+        ADD THE ELEMENTS OF A PAGE, WRITING THEM IF A CHUNK IS FULL
+        :param values: elements to append
+        :type values: list
+        :param cursor: where the scraping continues after these elements
+        """
+        self.buffer.extend(values)
+        self.cursor=cursor
+        if len(self.buffer)>=self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        WRITE THE BUFFERED ELEMENTS AND THE CURSOR
+        """
+        if self.buffer or self.cursor is not None:
+            push_to_document(self.object_id,self.field,self.buffer,collection=self.collection,set_fields={self.cursor_field:self.cursor})
+            self.written+=len(self.buffer)
+            self.buffer=[]
+
+    def close(self):
+        """
+        WRITE WHAT IS LEFT AND MARK THE LIST AS COMPLETE
+        """
+        self.cursor=None
+        push_to_document(self.object_id,self.field,self.buffer,collection=self.collection,set_fields={self.cursor_field:None})
+        self.written+=len(self.buffer)
+        self.buffer=[]
+
+    def close_operation(self):
+        """
+        WHAT close WRITES, AS AN OPERATION FOR bulk_write INSTEAD, SO THAT THE LAST CHUNKS OF MANY LISTS (ALL OF MOST SHORT LISTS) GO IN ONE WRITE
+        :return: pymongo UpdateOne object
+        """
+        operation=UpdateOne({"_id":self.object_id},{"$push":{self.field:{"$each":self.buffer}},"$set":{self.cursor_field:None}})
+        self.cursor=None
+        self.written+=len(self.buffer)
+        self.buffer=[]
+        return operation
+
+
+# number of documents read per query by iter_documents, and of operations per write by BulkWriter
+BATCH_SIZE=500
+
+
+def iter_documents(query,projection,collection=None,batch_size=BATCH_SIZE):
+    """
+    GO THROUGH THE DOCUMENTS MATCHING A QUERY IN _id ORDER, WITH A NEW QUERY FOR EVERY BATCH THAT STARTS AFTER THE LAST _id OF THE ONE BEFORE. ONLY
+    ONE BATCH IS EVER IN MEMORY, AND UNLIKE A SINGLE CURSOR NOTHING TIMES OUT WHILE THE DOCUMENTS ARE WORKED ON FOR HOURS
+    :param query: filter of the documents
+    :type query: dict
+    :param projection: fields to read, keep it to the few that are needed
+    :type projection: dict
+    :param collection: MongoDB collection object
+    :type collection: MongoClient.Collection object
+    :param batch_size: Number of documents per query
+    :type batch_size: int
+    :return: generator of documents
+    """
+    if collection is None:
+        collection=get_collection()
+
+    last=None
+    while True:
+        batch_query=query if last is None else {"$and":[query,{"_id":{"$gt":last}}]}
+        batch=list(collection.find(batch_query,projection).sort("_id",1).limit(batch_size))
+        if not batch:
+            return
+        yield from batch
+        last=batch[-1]["_id"]
+
+
+class BulkWriter:
+    """
+    COLLECT WRITE OPERATIONS (UpdateOne...) OF MANY DOCUMENTS AND SEND THEM WITH ONE bulk_write PER BATCH_SIZE OF THEM. CAN BE SHARED BY THREADS
+    """
+
+    def __init__(self,collection=None,batch_size=BATCH_SIZE):
+        """
+        :param collection: MongoDB collection object
+        :type collection: MongoClient.Collection object
+        :param batch_size: Number of operations per write
+        :type batch_size: int
+        """
+        self.collection=collection if collection is not None else get_collection()
+        self.batch_size=batch_size
+        self.operations=[]
+        self.lock=threading.Lock()
+
+    def add(self,operation):
+        """
+        ADD AN OPERATION, WRITING THE BATCH IF IT IS FULL
+        :param operation: pymongo write operation
+        """
+        with self.lock:
+            self.operations.append(operation)
+            if len(self.operations)<self.batch_size:
+                return
+            operations,self.operations=self.operations,[]
+        self.write(operations)
+
+    def flush(self):
+        """
+        WRITE THE COLLECTED OPERATIONS
+        """
+        with self.lock:
+            operations,self.operations=self.operations,[]
+        self.write(operations)
+
+    def write(self,operations):
+        """
+        SEND A BATCH OF OPERATIONS, OUTSIDE OF THE LOCK SO THAT THE OTHER THREADS CAN KEEP ADDING
+        """
+        if operations:
+            try:
+                self.collection.bulk_write(operations,ordered=False)
+            except (BulkWriteError,WriteConcernError) as e:
+                print("Writerror")
+
+
+# keys of the repositories are compared without case: the keys stored before repo_keys.py keep the case of the link they were scraped from, the
+# canonical keys have the case of the site
+KEY_COLLATION=Collation(locale="en",strength=2)
+
+# collections the index on the keys with KEY_COLLATION is known to exist in
+_key_indexed=set()
+
+
+def ensure_key_index(collection):
+    """
+    CREATE THE INDEX ON THE KEYS WITH KEY_COLLATION, ONCE PER COLLECTION. QUERIES WITH THE COLLATION CAN'T USE AN INDEX WITH THE DEFAULT ONE AND WOULD SCAN THE COLLECTION.
+    IT HAS ITS OWN NAME SO IT CAN BE NEXT TO AN INDEX ON THE KEYS THAT ALREADY EXISTS
+    :param collection: MongoDB collection object of the repositories
+    :type collection: MongoClient.Collection object
+    """
+    if collection.full_name in _key_indexed:
+        return
+
+    collection.create_index("key",name="key_case_insensitive",collation=KEY_COLLATION)
+    _key_indexed.add(collection.full_name)
+
+
 def check_repo_exists(repo_key,repo_id=None):
     """
     CHECK IF A PARTICULAR REPO WITH A KEY EXISTS IN THE REPOSITORY COLLECTION. IF SO RETURN THE OBJECTID, IF NOT RETURN 0. UPDATES THE COUNT OF THE REPOSITORY.
@@ -177,12 +393,12 @@ def check_repo_exists(repo_key,repo_id=None):
     # get the collection
     collection=get_collection(collection_name="repository")
 
-    repo_id=ObjectId(repo_id)
-
+    # ObjectId(None) would make up a new id, and the key would never be looked up
     if repo_id:
         c=collection.find({"_id":ObjectId(repo_id)})
     else:
-        c=collection.find({"key":repo_key})
+        ensure_key_index(collection)
+        c=collection.find({"key":repo_key},collation=KEY_COLLATION).limit(1)
 
     # if the key exists this loop will not happen so we just return zero. If not, we return the objectid
     for document in c:
@@ -198,6 +414,37 @@ def check_repo_exists(repo_key,repo_id=None):
     return  object_id
 
 
+def check_repos_exist(repo_keys,collection=None):
+    """
+    check_repo_exists FOR MANY REPOS AT ONCE: ONE QUERY FOR ALL THE KEYS AND ONE BULK WRITE TO UPDATE THE COUNTS
+    :param repo_keys: keys of the repos in the format {SITE}/author_id/repo_id. A key that appears several times adds that many to the count
+    :type repo_keys: list of Strings
+    :param collection: MongoDB collection object of the repositories, to reduce repeatedly getting connections
+    :type collection: MongoClient.Collection object
+    :return: Dictionary of key (as given) to OBJECTID for the keys that exist, in any case
+    """
+    if collection is None:
+        collection=get_collection(collection_name="repository")
+
+    counts=Counter(repo_keys)
+    ensure_key_index(collection)
+
+    # the document of every key with its case folded, the first one if case variants of a key were stored before
+    stored={}
+    for document in collection.find({"key":{"$in":list(counts)}},{"key":1},collation=KEY_COLLATION):
+        stored.setdefault(document["key"].lower(),document["_id"])
+
+    found={key:stored[key.lower()] for key in counts if key.lower() in stored}
+
+    increments=Counter()
+    for key,object_id in found.items():
+        increments[object_id]+=counts[key]
+    if increments:
+        collection.bulk_write([UpdateOne({"_id":object_id},{"$inc":{"count":count}}) for object_id,count in increments.items()],ordered=False)
+
+    return found
+
+
 def query_repo(repo_id,count=100,collection=None):
     """GET AN MONGODB CURSOR FOR A REPOSITORY DOCUMENT. ONLY RETURNS REPOSTIORIES THAT HAVE COUNT LESS THAN A PRE-DEFNIED AMOUNT.
     :param repo_id: ObjectId of the Repository
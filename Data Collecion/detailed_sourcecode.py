@@ -1,13 +1,45 @@
 """Scraping week-by-week commit data from Github repositories including commit stats and countributor stats. Potentiallly add stars/forks/subscribers"""
-from github import Github
-from database_operations import  check_repo_exists, get_collection, insert_document,query_by_field_exists,update_collection_one
-import time
+import math
+import argparse
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from itertools import islice
+from database_operations import  BulkWriter, ChunkWriter, check_repo_exists, get_collection, insert_document, iter_documents, push_to_document,query_by_field_exists,update_collection_one
+from github_pool import pool
+from github_refresh import refresh_repositories, DETAILED_ENDPOINTS
+from github_graphql import collect_histories, fetch_history
+from github_stargazers import collect_stargazers, daily_stars, new_stargazers
+from histograms import DailyHistogram
+from pymongo import UpdateOne
 from tqdm import tqdm
 from opnieuw import retry
 from requests.exceptions import  ReadTimeout
-github=Github("API_KEY")
+
+# --incremental asks for the commits from this long before the high-water mark, for commits that were pushed a while after they were made, and drops
+# the ones that are among the newest COMMITS_OVERLAP_SLICE stored already
+COMMITS_OVERLAP=timedelta(days=7)
+COMMITS_OVERLAP_SLICE=1000
+
+# repositories whose star events are still missing, and the ones whose scrape was interrupted (Stars_cursor is the last page stored, None once the
+# events are complete)
+STARS_TODO={"$or":[{"Stars_events":{"$exists":False},"Stars_daily":{"$exists":False}},{"Stars_cursor":{"$ne":None}}]}
+
+# repositories scraped at the same time for every token of the pool
+WORKERS_PER_TOKEN=2
+
 
 @retry(retry_on_exceptions=ReadTimeout,max_calls_total=10,retry_window_after_first_call_in_seconds=60)
+def fetch_commit(client,key,sha):
+    """ GET AN INDIVIDUAL COMMIT WITH ITS STATS, IN ONE CALL
+    :param client: Pygithub client of the token to use
+    :param key: Github key of the repository in the form author_id/repo_id
+    :param sha: sha of the commit
+    :return : Pygithub commit object
+    """
+    return client.get_repo(key,lazy=True).get_commit(sha)
+
+
 def get_commit(comm):
     """ GET DETAILS ABOUT AN INDIVIDUAL COMMIT
     :param commit_object: Pygithub commit object
@@ -28,10 +60,15 @@ def get_commit(comm):
     return commit_dict
 
 
-def scraper(repo_key):
+def scraper(repo_key,store=None,start_page=0):
     """GET A LIST OF COMMITS FOR A PARTICULAR REPOSITORY
     :param repo_key : Github key of the repository
     :type repo_key: String
+    :param store: Called with the commits of every page of the listing and the number of the next page, in order, to store them as they come in
+    :type store: function
+    :param start_page: page of the listing to start from (from 0), to continue an interrupted scrape
+    :type start_page: int
+    :return: list of commit Dictionaries, empty if store is given
     """
 
     # get the repostiory id used by the github package from the database
@@ -39,90 +76,321 @@ def scraper(repo_key):
     key=splits[1]+"/"+splits[2]
 
 
-    repo=github.get_repo(key)
+    # the listing is paginated with the token that starts it, getting the repo and the count takes two calls
+    lister=pool.acquire(cost=2)
+    repo=lister.client.get_repo(key)
     commits=repo.get_commits()
 
     return_list=[]
     # start scraping only if commits is less than 10000 (for the initial commit phase)
     if commits.totalCount<10000:
-        # loop through all the commits
-        for comm in tqdm(commits,total=commits.totalCount,position=1):
-            commit_dict=get_commit(comm)
+        pages=math.ceil(commits.totalCount/lister.client.per_page)
+        # loop through the pages of the commits, every page of the listing is a call
+        for page in tqdm(range(start_page,pages),position=1):
+            pool.charge(lister)
+            listing=commits.get_page(page)
+            pool.observe(lister)
 
-            return_list.append(commit_dict)
+            page_list=[]
+            for comm in listing:
+                # every commit costs a call for its stats, made with the token that has the most budget left
+                member=pool.acquire()
+                page_list.append(get_commit(fetch_commit(member.client,key,comm.sha)))
 
-            # check rate limits and sleep untill this resets
-            while github.get_rate_limit().core.remaining<2:
-                time.sleep(20)
+                # adapt the budget of the token to the rate limit read from the last response, without an extra call
+                pool.observe(member)
 
-    return return_list
-
-def stargazer_to_dict(stargazer):
-    """
-    CONVERT A STARGAZER OBJECT
-    :param stargazer: pygithub stargazer object
-    :return: Dict representing a starring event
-    """
-
-    #Dictionary to return
-    star_dict={}
-
-    star_dict["user"]=stargazer.user
-    star_dict["time"]=stargazer.starred_at
+            if store:
+                store(page_list,page+1)
+            else:
+                return_list.extend(page_list)
 
-    return star_dict
+    return return_list
 
-def stars_scraper(repo_key):
+def stars_scraper(repo_key,store=None,start_page=1):
     """
-    GET A LIST OF STARGAZE EVENTS FOR A PARTICULAR REPOSITORY
+    GET A LIST OF STARGAZE EVENTS FOR A PARTICULAR REPOSITORY. THE PAGES ARE FETCHED A FEW AT A TIME, SEE github_stargazers.py
     :param repo_key: Github key for the repository
     :type repo_key: String
-    :return:
+    :param store: Called with the star events of every page and the number of the page, in order, to store them as they come in
+    :type store: function
+    :param start_page: page to start from (from 1), to continue an interrupted scrape
+    :type start_page: int
+    :return: list of {"user", "time"} Dictionaries, empty if store is given
     """
     # get the repostiory id used by the github package from the database
     splits=repo_key.split("/")
     key=splits[1]+"/"+splits[2]
 
-    repo=github.get_repo(key)
+    # the number of stars gives the number of pages up front. It is asked from github every time, the count stored with the repository is from when it
+    # was scraped and the pages of the stars given since would never be fetched
+    with pool.client() as client:
+        count=client.get_repo(key).stargazers_count
+
     stars=[]
+    collect_stargazers(key,count,pool,store or (lambda page_stars,page:stars.extend(page_stars)),start_page=start_page)
+
+    return stars
 
-    if repo.stargazers_count<100000:
-        stars_list=repo.get_stargazers_with_dates()
-        for star_event in stars_list:
-            star_dict=stargazer_to_dict(star_event)
-            stars.append(star_dict)
+def append_commits(doc,repo_db,now):
+    """
+    ADD THE COMMITS MADE SINCE THE HIGH-WATER MARK OF A REPOSITORY (Commits_mark, THE TIME OF ITS LAST UPDATE) TO THE FRONT OF ITS Detailed_commits
+    :param doc: document of the repository with key, Commits_mark and the newest Detailed_commits
+    :type doc: Dict
+    :param repo_db: repository collection
+    :type repo_db: MongoClient.Collection object
+    :param now: time the update started, the next high-water mark
+    :type now: datetime (naive utc)
+    :return: Number of commits added, None if the repository is gone
+    """
+    # repositories scraped before the marks were kept start from their newest commit
+    mark=doc.get("Commits_mark") or (doc["Detailed_commits"][0]["Date"] if doc["Detailed_commits"] else datetime(1970,1,1))
 
-            while github.get_rate_limit().core.remaining<10:
-                time.sleep(60)
+    # commits pushed a while after they were made are caught by going back a little, the ones already there are dropped
+    commits=fetch_history(doc["key"].split("/",1)[1],pool.tokens[0].token,since=mark-COMMITS_OVERLAP)
+    if commits is None:
+        return None
 
-    return stars
+    known={commit["sha"] for commit in doc["Detailed_commits"]}
+    commits=[commit for commit in commits if commit["sha"] not in known]
 
-if __name__=="__main__":
-    repo_db=get_collection(collection_name="repository")
-    cursor=list(repo_db.find())
+    push_to_document(doc["_id"],"Detailed_commits",commits,collection=repo_db,position=0,set_fields={"Commits_mark":now})
+    return len(commits)
 
+
+def append_stars(doc,repo_db,count=None):
     """
-    for doc in tqdm(cursor,position=0):
-        if doc.get("Detailed_commits",9)==9:
-            update_dict={}
-            if doc['key'].split("/")[0]=="github":
-                commits=scraper(doc['key'])
-            else:
-                commits=[]
+    ADD THE STARS GIVEN AFTER THE HIGH-WATER MARK OF A REPOSITORY (Stars_mark, THE TIME OF ITS NEWEST STAR) TO THE END OF ITS Stars_events
+    :param doc: document of the repository with key, Stars_mark and the newest Stars_events
+    :type doc: Dict
+    :param repo_db: repository collection
+    :type repo_db: MongoClient.Collection object
+    :param count: Number of stars of the repository now, asked from github if not given
+    :type count: int
+    :return: Number of stars added, None if the listing can not be read that far
+    """
+    mark=doc.get("Stars_mark") or (doc["Stars_events"][-1]["time"] if doc["Stars_events"] else datetime(1970,1,1))
+
+    if count is None:
+        with pool.client() as client:
+            count=client.get_repo(doc["key"].split("/",1)[1]).stargazers_count
+
+    stars=new_stargazers(doc["key"].split("/",1)[1],count,pool,mark)
+    if stars is None:
+        return None
+
+    if stars:
+        push_to_document(doc["_id"],"Stars_events",stars,collection=repo_db,set_fields={"Stars_mark":stars[-1]["time"],"stars":count})
+    return len(stars)
+
 
-            update_dict["Detailed_commits"]=commits
-            update_dict["id"]=doc.get("_id")
-            update_collection_one(update_dict,collection=repo_db)
+def refresh_detailed(doc,update,repo_db):
     """
+    ADD THE NEW COMMITS AND STAR EVENTS OF A REPOSITORY IF THE REFRESH FOUND THEM OUT OF DATE, SEE github_refresh.py. LIKE --incremental ONLY WHAT IS
+    NEWER THAN WHAT IS STORED IS ADDED, SO NOTHING IS LOST TO THE CAPS OF THE SCRAPERS. REPOSITORIES WHOSE SCRAPE IS STILL UNDER WAY (THEIR CURSOR IS
+    SET) ARE LEFT TO IT
+    :param doc: document of the repository, with Detailed_commits sliced to the newest commit and Stars_events to the newest star
+    :type doc: Dict
+    :param update: fields that changed. If adding fails, the fields that would tell the next refresh that nothing changed are taken out of it
+    :type update: Dict
+    :param repo_db: repository collection
+    :type repo_db: MongoClient.Collection object
+    """
+    commits=doc.get("Detailed_commits")
+    if "head" in update and commits is not None and doc.get("Detailed_commits_cursor") is None and (not commits or commits[0]["sha"]!=update["head"]):
+        try:
+            # the newest commits, to drop the ones fetched again
+            recent=repo_db.find_one({"_id":doc["_id"]},{"key":1,"Commits_mark":1,"Detailed_commits":{"$slice":COMMITS_OVERLAP_SLICE}})
+            append_commits(recent,repo_db,datetime.utcnow())
+        except Exception as e:
+            print(f"{doc['key']}: {e!r}")
+            update.pop("head",None)
+            update.pop("etags.head",None)
+
+    if "stars" in update and doc.get("Stars_events") is not None and doc.get("Stars_cursor") is None:
+        try:
+            append_stars(doc,repo_db,update["stars"])
+        except Exception as e:
+            print(f"{doc['key']}: {e!r}")
+            update.pop("stars",None)
+            update.pop("etags.repo",None)
+
+
+def scrape_stars(doc,repo_db):
+    """
+    SCRAPE THE STAR EVENTS OF ONE REPOSITORY, CONTINUING AFTER Stars_cursor IF AN EARLIER SCRAPE WAS INTERRUPTED. THE EVENTS ARE WRITTEN IN CHUNKS AS
+    THEY COME IN, EXCEPT FOR THE LAST ONE
+    :param doc: document of the repository with _id, key and Stars_cursor
+    :type doc: Dict
+    :param repo_db: repository collection
+    :type repo_db: MongoClient.Collection object
+    :return: pymongo UpdateOne object that completes the events, for a BulkWriter
+    """
+    if doc["key"].split("/")[0]!="github":
+        return UpdateOne({"_id":doc["_id"]},{"$set":{"Stars_events":[]}})
+
+    writer=ChunkWriter(doc["_id"],"Stars_events","Stars_cursor",repo_db)
+    stars_scraper(doc["key"],writer.add,start_page=(doc.get("Stars_cursor") or 0)+1)
+    return writer.close_operation()
+
+
+def scrape_missing_stars(repo_db,workers=None):
+    """
+    SCRAPE THE STAR EVENTS OF EVERY REPOSITORY THAT DOES NOT HAVE THEM YET WITH A POOL OF WORKERS THAT SHARE THE TOKENS. THE REPOSITORIES ARE READ A
+    BATCH AT A TIME AND ONLY TWO PER WORKER ARE WAITING, SO MEMORY DOES NOT GROW WITH THE SIZE OF THE COLLECTION
+    :param repo_db: repository collection
+    :type repo_db: MongoClient.Collection object
+    :param workers: Number of repositories scraped at the same time, WORKERS_PER_TOKEN for every token of the pool if not given
+    :type workers: int
+    :return: Counter of the repositories scraped and failed
+    """
+    workers=workers or WORKERS_PER_TOKEN*len(pool.tokens)
+    docs=iter_documents(STARS_TODO,{"key":1,"Stars_cursor":1},collection=repo_db)
+    writes=BulkWriter(repo_db)
+    summary=Counter()
+    progress=tqdm(total=repo_db.count_documents(STARS_TODO))
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures={}
+        while True:
+            # keep the workers busy without submitting the whole collection at once
+            for doc in islice(docs,2*workers-len(futures)):
+                futures[executor.submit(scrape_stars,doc,repo_db)]=doc["key"]
+            if not futures:
+                break
+
+            done,_=wait(futures,return_when=FIRST_COMPLETED)
+            for future in done:
+                key=futures.pop(future)
+                try:
+                    writes.add(future.result())
+                    summary["scraped"]+=1
+                # the chunks written so far stay, the next run continues after Stars_cursor
+                except Exception as e:
+                    print(f"{key}: {e!r}")
+                    summary["failed"]+=1
+                progress.update(1)
+
+    writes.flush()
+    progress.close()
+    return summary
+
 
-    for doc in tqdm(cursor,position=0):
-        if doc.get('Stars_events',9)==9:
-            update_dict={}
-            if doc['key'].split("/")[0]=="github":
-                stars=stars_scraper(doc['key'])
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Scrape the detailed commits and the star events of the github repositories")
+    arg_parser.add_argument("--refresh",action="store_true",help="only scrape them again for the repositories that got new commits or stars, found with conditional requests")
+    arg_parser.add_argument("--daily",action="store_true",help="only keep the number of commits and stars of every day (Commits_daily, Stars_daily), with no cap on their number")
+    arg_parser.add_argument("--incremental",action="store_true",help="only add the commits and stars that are newer than what is stored")
+    arg_parser.add_argument("--graphql",action="store_true",help="scrape the missing Detailed_commits over graphql, 100 commits with their stats per call")
+    arg_parser.add_argument("--workers",type=int,help=f"repositories whose star events are scraped at the same time, {WORKERS_PER_TOKEN} per token by default")
+    args=arg_parser.parse_args()
+
+    repo_db=get_collection(collection_name="repository")
+
+    if args.refresh:
+        query={"key":{"$regex":"^github/"}}
+        # the newest commit is enough to tell if the commits are up to date, and the newest star gives the mark of the repositories that don't have one
+        projection={"key":1,"etags":1,"stars":1,"head":1,"Stars_mark":1,"Detailed_commits_cursor":1,"Stars_cursor":1,"Detailed_commits":{"$slice":1},
+                    "Stars_events":{"$slice":-1}}
+        summary=refresh_repositories(repo_db.find(query,projection),pool,repo_db,endpoints=DETAILED_ENDPOINTS,
+                                     on_update=lambda doc,update:refresh_detailed(doc,update,repo_db),
+                                     total=repo_db.count_documents(query))
+        print(dict(summary))
+
+    elif args.incremental:
+        now=datetime.utcnow()
+        query={"key":{"$regex":"^github/"}}
+        # the newest commits are enough to drop the ones fetched again, and the newest star gives the mark of the repositories that don't have one
+        projection={"key":1,"Commits_mark":1,"Stars_mark":1,"Detailed_commits_cursor":1,"Stars_cursor":1,"Detailed_commits":{"$slice":COMMITS_OVERLAP_SLICE},
+                    "Stars_events":{"$slice":-1}}
+
+        added=Counter()
+        for doc in tqdm(repo_db.find(query,projection),total=repo_db.count_documents(query)):
+            try:
+                # lists whose scrape was interrupted (the cursor is set) are completed by resuming it, not here
+                if "Detailed_commits" in doc and doc.get("Detailed_commits_cursor") is None:
+                    added["commits"]+=append_commits(doc,repo_db,now) or 0
+                if "Stars_events" in doc and doc.get("Stars_cursor") is None:
+                    added["stars"]+=append_stars(doc,repo_db) or 0
+            except Exception as e:
+                print(f"{doc['key']}: {e!r}")
+        print(dict(added))
+
+    elif args.graphql:
+        # the repositories without commits, and the ones whose scrape was interrupted (the cursor is None once it is complete)
+        query={"key":{"$regex":"^github/"},"$or":[{"Detailed_commits":{"$exists":False}},{"Detailed_commits_cursor":{"$ne":None}}]}
+        docs=list(repo_db.find(query,{"key":1,"Detailed_commits_cursor":1,"Detailed_commits":{"$slice":0}}))
+
+        writers={}
+        cursors={}
+        for doc in docs:
+            id=doc["key"].split("/",1)[1]
+            # the cursor is set before the first page so that a scrape that stops before its first chunk is continued too
+            if "Detailed_commits" not in doc:
+                update_collection_one({"Detailed_commits":[],"Detailed_commits_cursor":""},object_id=doc["_id"],collection=repo_db)
+            cursors[id]=doc.get("Detailed_commits_cursor") or None
+            writers[id]=ChunkWriter(doc["_id"],"Detailed_commits","Detailed_commits_cursor",repo_db)
+
+        for id,count,error in tqdm(collect_histories(list(writers),[member.token for member in pool.tokens],lambda id,commits,cursor:writers[id].add(commits,cursor),
+                                                     cursors=cursors),total=len(writers)):
+            if error:
+                # what was scraped stays, the next run continues from the cursor
+                writers[id].flush()
+                print(f"{id}: {error}")
             else:
-                stars=[]
+                writers[id].close()
+            del writers[id]
+
+    elif args.daily:
+        # the github repositories that have neither the events nor the counts of every day
+        query={"key":{"$regex":"^github/"},"Detailed_commits":{"$exists":False},"Commits_daily":{"$exists":False}}
+        docs={doc["key"].split("/",1)[1]:doc for doc in repo_db.find(query,{"key":1})}
+
+        # the commits are counted as the pages of the history come in and never kept
+        histograms={id:DailyHistogram(("Total",)) for id in docs}
+        def count_commits(id,commits,cursor):
+            for commit in commits:
+                histograms[id].add(commit["Date"],Total=commit["Total"])
+
+        for id,count,error in tqdm(collect_histories(list(docs),[member.token for member in pool.tokens],count_commits),total=len(docs)):
+            commits=histograms.pop(id)
+            if error:
+                # nothing is stored, the repository is picked again on the next run
+                print(f"{id}: {error}")
+                continue
+
+            update_dict={"Commits_daily":commits.to_list(),"Commits_totals":commits.totals()}
+            if count is not None:
+                # both counts are written together or not at all, the selection skips the
+                # repositories that have the commits so stars missing then would stay missing
+                try:
+                    # the live count, the stored one is as old as the scrape and would cut the pages short
+                    with pool.client() as client:
+                        live=client.get_repo(id).stargazers_count
+                    stars=daily_stars(id,live,pool)
+                except Exception as e:
+                    print(f"{id}: {e!r}")
+                    continue
+                update_dict["Stars_daily"]=stars.to_list()
+                update_dict["Stars_totals"]=stars.totals()
+            update_collection_one(update_dict,object_id=docs[id]["_id"],collection=repo_db)
+
+    else:
+        """
+        for doc in tqdm(cursor,position=0):
+            if doc.get("Detailed_commits",9)==9 or doc.get("Detailed_commits_cursor") is not None:
+                update_dict={}
+                update_dict["id"]=doc.get("_id")
+                if doc['key'].split("/")[0]=="github":
+                    if doc.get("Detailed_commits",9)==9:
+                        update_collection_one({"Detailed_commits":[],"Detailed_commits_cursor":0},object_id=doc["_id"],collection=repo_db)
+                    writer=ChunkWriter(doc["_id"],"Detailed_commits","Detailed_commits_cursor",repo_db)
+                    scraper(doc['key'],writer.add,start_page=doc.get("Detailed_commits_cursor") or 0)
+                    writer.close()
+                else:
+                    update_dict["Detailed_commits"]=[]
+                    update_collection_one(update_dict,collection=repo_db)
+        """
 
-            update_dict["Stars_events"]=stars
-            update_dict["id"]=doc.get("_id")
-            update_collection_one(update_dict,collection=repo_db)
\ No newline at end of file
+        # the star events of the repositories that don't have them yet, a few repositories at a time
+        print(dict(scrape_missing_stars(repo_db,args.workers)))
@@ -0,0 +1,182 @@
+"""PERSISTENT CACHE OF DOI -> FINAL URL (AND PUBLISHER) SO THAT THE doi.org REDIRECT CHAIN IS FOLLOWED ONCE PER DOI INSTEAD OF ON EVERY SCRAPE.
+THE CACHE IS STORED IN THE "doi" COLLECTION AND FILLED IN BULK WITH CONCURRENT HEAD REQUESTS, SEE fill_cache"""
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import UpdateOne
+from tqdm import tqdm
+from database_operations import get_collection, query_by_field_exists
+from rate_limiting import request_throttled
+
+doi_pattern=re.compile(r"doi.org/(.*)")
+
+# same user agent as the scrapers, some publishers refuse the default one of requests
+requests_headers= {'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"}
+
+# in memory copy of the collection, loaded on first use
+_cache=None
+
+
+def doi_from_url(url):
+    """
+    EXTRACT THE DOI FROM A doi.org URL
+    :param url: link, usually an ee value from DBLP
+    :type url: string
+    :return: the DOI in string or None if the url is not a doi link
+    """
+    match=re.search(doi_pattern,url)
+    if match:
+        return match.group(1)
+    return None
+
+
+def get_cache():
+    """
+    GET THE IN MEMORY COPY OF THE DOI CACHE, LOADING IT FROM THE DATABASE THE FIRST TIME
+    :return: Dictionary of DOI to {"url":..., "publisher":...}
+    """
+    global _cache
+
+    if _cache is None:
+        collection=get_collection(collection_name="doi")
+        _cache={doc["_id"]:doc for doc in collection.find()}
+
+    return _cache
+
+
+def set_cache(cache):
+    """
+    USE THE GIVEN DICTIONARY AS THE DOI CACHE INSTEAD OF LOADING THE DATABASE, E.G. FOR OFFLINE RUNS
+    :param cache: Dictionary of DOI to {"url":..., "publisher":...}
+    :type cache: Dict
+    """
+    global _cache
+    _cache=cache
+
+
+def publisher_of(url):
+    """
+    PUBLISHER (HOST NAME WITHOUT www.) OF A URL
+    :param url: resolved url
+    :type url: string
+    :return: host name in string
+    """
+    host=urlparse(url).netloc.lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def resolve_url(url):
+    """
+    REPLACE A doi.org LINK WITH THE URL IT REDIRECTS TO, IF THE DOI IS CACHED. ANY OTHER LINK IS RETURNED UNCHANGED
+    :param url: link, usually an ee value from DBLP
+    :type url: string
+    :return: url in string
+    """
+    doi=doi_from_url(url)
+    if doi:
+        cached=get_cache().get(doi.lower())
+        if cached:
+            return cached["url"]
+    return url
+
+
+def publisher(url):
+    """
+    PUBLISHER OF A LINK AFTER RESOLVING DOI REDIRECTS FROM THE CACHE. USED TO DISPATCH A LINK TO THE RIGHT SCRAPER
+    :param url: link, usually an ee value from DBLP
+    :type url: string
+    :return: host name in string. doi.org if the doi is not cached
+    """
+    return publisher_of(resolve_url(url))
+
+
+def resolve_doi(doi,session):
+    """
+    FOLLOW THE REDIRECT CHAIN OF A DOI WITHOUT DOWNLOADING ANY BODY
+    :param doi: the DOI
+    :type doi: string
+    :param session: session used for the requests
+    :type session: requests.Session object
+    :return: final url in string, None if the chain could not be followed
+    """
+    url="https://doi.org/"+doi
+
+    try:
+        # every hop of the chain (doi.org, the publisher...) is throttled with the bucket of its host
+        response=request_throttled(session,"HEAD",url,headers=requests_headers,timeout=30)
+
+        # some publishers do not support HEAD, stream a GET instead and close it before reading the body
+        if response.status_code in (405,501):
+            with request_throttled(session,"GET",url,stream=True,headers=requests_headers,timeout=30) as response:
+                pass
+    except RequestException:
+        return None
+
+    # the chain did not leave doi.org, most likely an unknown DOI
+    if publisher_of(response.url)=="doi.org":
+        return None
+
+    return response.url
+
+
+def fill_cache(dois,max_workers=16,batch_size=500):
+    """
+    RESOLVE ALL THE DOIS THAT ARE NOT CACHED YET WITH CONCURRENT HEAD REQUESTS AND STORE THEM
+    :param dois: DOIs to resolve
+    :type dois: iterable of strings
+    :param max_workers: Number of requests in flight
+    :type max_workers: int
+    :param batch_size: Number of resolved DOIs per database write
+    :type batch_size: int
+    :return: Number of newly resolved DOIs
+    """
+    cache=get_cache()
+    collection=get_collection(collection_name="doi")
+
+    todo={doi.lower() for doi in dois}-set(cache)
+
+    session=requests.Session()
+    adapter=HTTPAdapter(pool_maxsize=max_workers)
+    session.mount("http://",adapter)
+    session.mount("https://",adapter)
+
+    writes=[]
+    resolved=0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures={executor.submit(resolve_doi,doi,session):doi for doi in todo}
+        for future in tqdm(as_completed(futures),total=len(futures)):
+            url=future.result()
+            if not url:
+                continue
+
+            doi=futures[future]
+            cache[doi]={"_id":doi,"url":url,"publisher":publisher_of(url)}
+            writes.append(UpdateOne({"_id":doi},{"$set":{"url":url,"publisher":publisher_of(url)}},upsert=True))
+            resolved+=1
+
+            if len(writes)>=batch_size:
+                collection.bulk_write(writes,ordered=False)
+                writes=[]
+
+    if writes:
+        collection.bulk_write(writes,ordered=False)
+
+    return resolved
+
+
+if __name__=="__main__":
+
+    # resolve every doi link of every paper
+    c,count=query_by_field_exists("ee",return_count=True)
+
+    dois=[]
+    for doc in tqdm(c,total=count):
+        for link in doc.get("ee",[]):
+            doi=doi_from_url(link)
+            if doi:
+                dois.append(doi)
+
+    print(fill_cache(dois))
@@ -0,0 +1,259 @@
+"""COMMIT AND CONTRIBUTOR METRICS FROM A LOCAL CLONE OF THE REPOSITORY INSTEAD OF THE API.
+
+Every repository is cloned once (bare, default branch only, no tags) into the clone cache and fetched again on later runs. `git log --numstat` then
+gives the additions/deletions of every commit without any API calls, so there is no cap on the number of commits. From it come the same fields the
+API scrapers store:
+    github: Detailed_commits (sha, Date, Total, Author), commits (weekly additions/deletions) and contributors (commits per author)
+    gitlab: commits (created_at and stats of every commit) and commits_complete
+
+Authors are only known by name and email locally, so Author and the contributor id are "name email", as detailed_sourcecode.get_commit does for
+authors without a github login.
+
+Usage:
+    python git_history.py [--cache repo_cache] [--workers 4] [--site github]
+    python git_history.py --local /path/to/repo     (metrics of a local repository or mirror, printed instead of stored)
+"""
+import os
+import argparse
+import subprocess
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+from database_operations import get_collection, update_collection_one
+from gitlab_commits import GITLAB_URL
+
+# directory of the bare clones, reused between runs
+CLONE_CACHE=os.environ.get("GIT_CACHE","repo_cache")
+
+# repositories cloned and read at the same time, clones are bound by the network and the disk so a few is plenty
+WORKERS=4
+
+# seconds a clone or fetch may take
+GIT_TIMEOUT=3600
+
+# base url of the repositories of every site
+SITE_URLS={"github":"https://github.com","gitlab":GITLAB_URL}
+
+# separators of the fields in the header line of every commit in the git log output
+RECORD="\x1e"
+FIELD="\x1f"
+LOG_FORMAT=f"{RECORD}%H{FIELD}%aI{FIELD}%an{FIELD}%ae"
+
+# never ask for credentials, a private or deleted repository has to fail instead of hanging
+GIT_ENV=dict(os.environ,GIT_TERMINAL_PROMPT="0")
+
+
+def run_git(args,timeout=GIT_TIMEOUT):
+    """
+    RUN A GIT COMMAND
+    :param args: arguments after git
+    :type args: list of strings
+    :param timeout: Seconds the command may take
+    :type timeout: float
+    :return: standard output in string
+    """
+    result=subprocess.run(["git"]+args,capture_output=True,text=True,timeout=timeout,env=GIT_ENV)
+    if result.returncode!=0:
+        raise RuntimeError(f"git {args[0]} failed: {result.stderr.strip()}")
+    return result.stdout
+
+
+def clone_path(key,cache_dir=CLONE_CACHE):
+    """
+    PATH OF THE CLONE OF A REPOSITORY IN THE CACHE
+    :param key: key of the repository in the form {SITE}/author_id/repo_id
+    :type key: string
+    :param cache_dir: directory of the clones
+    :type cache_dir: string
+    :return: path in string
+    """
+    return os.path.join(cache_dir,*key.split("/"))+".git"
+
+
+def sync(key,cache_dir=CLONE_CACHE,url=None):
+    """
+    CLONE A REPOSITORY INTO THE CACHE, OR FETCH THE NEW COMMITS OF ITS DEFAULT BRANCH IF IT IS ALREADY THERE.
+    git log --numstat NEEDS THE CONTENTS OF THE FILES, SO THE CLONE IS NOT BLOB-LESS (IT WOULD FETCH THE BLOBS OF EVERY COMMIT ONE BY ONE); IT IS KEPT
+    SMALL BY TAKING ONLY THE DEFAULT BRANCH, WITHOUT TAGS AND WITHOUT A WORKING TREE
+    :param key: key of the repository in the form {SITE}/author_id/repo_id
+    :type key: string
+    :param cache_dir: directory of the clones
+    :type cache_dir: string
+    :param url: url to clone from, the repository on its site if not given. Can be a local path, e.g. an existing mirror
+    :type url: string
+    :return: path of the clone in string
+    """
+    path=clone_path(key,cache_dir)
+
+    if os.path.isdir(path):
+        branch=run_git(["-C",path,"symbolic-ref","--short","HEAD"]).strip()
+        run_git(["-C",path,"fetch","--no-tags","origin",f"+refs/heads/{branch}:refs/heads/{branch}"])
+    else:
+        site,id=key.split("/",1)
+        if url is None:
+            url=f"{SITE_URLS[site]}/{id}.git"
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        run_git(["clone","--bare","--single-branch","--no-tags",url,path])
+
+    return path
+
+
+def parse_date(value):
+    """
+    PARSE A STRICT ISO DATE OF GIT INTO A NAIVE UTC DATETIME, LIKE THE DATES PYGITHUB RETURNS
+    """
+    return datetime.fromisoformat(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def read_log(path):
+    """
+    EVERY COMMIT OF THE DEFAULT BRANCH WITH ITS ADDITIONS AND DELETIONS, NEWEST FIRST. MERGES ARE COMPARED WITH THEIR FIRST PARENT, LIKE THE STATS OF
+    THE API. BINARY FILES HAVE NO LINES AND COUNT AS NOTHING
+    :param path: path of a clone, bare or not
+    :type path: string
+    :return: generator of {"sha", "date", "name", "email", "additions", "deletions"} Dictionaries
+    """
+    process=subprocess.Popen(["git","-C",path,"log","--numstat","--diff-merges=first-parent",f"--format={LOG_FORMAT}"],
+                             stdout=subprocess.PIPE,stderr=subprocess.PIPE,text=True,errors="replace",env=GIT_ENV)
+
+    commit=None
+    for line in process.stdout:
+        if line.startswith(RECORD):
+            if commit:
+                yield commit
+            sha,date,name,email=line[1:].rstrip("\n").split(FIELD)
+            commit={"sha":sha,"date":parse_date(date),"name":name,"email":email,"additions":0,"deletions":0}
+        elif line.strip() and commit:
+            additions,deletions,_=line.split("\t",2)
+            if additions!="-":
+                commit["additions"]+=int(additions)
+                commit["deletions"]+=int(deletions)
+    if commit:
+        yield commit
+
+    process.stdout.close()
+    if process.wait()!=0:
+        raise RuntimeError(f"git log failed: {process.stderr.read().strip()}")
+
+
+def week_start(date):
+    """
+    START OF THE WEEK OF A DATE, SUNDAY 00:00 UTC LIKE THE WEEKS OF THE CODE FREQUENCY STATISTICS OF GITHUB
+    """
+    day=datetime(date.year,date.month,date.day)
+    return day-timedelta(days=(day.weekday()+1)%7)
+
+
+def github_fields(commits):
+    """
+    THE COMMIT FIELDS OF A GITHUB REPOSITORY DOCUMENT
+    :param commits: commits as given by read_log
+    :type commits: list of Dictionaries
+    :return: Dictionary with Detailed_commits, commits and contributors
+    """
+    detailed=[]
+    weeks={}
+    authors=Counter()
+
+    for commit in commits:
+        author=commit["name"]+" "+commit["email"]
+        detailed.append({"sha":commit["sha"],"Date":commit["date"],"Total":commit["additions"]+commit["deletions"],"Author":author})
+
+        week=weeks.setdefault(week_start(commit["date"]),{"additions":0,"deletions":0})
+        week["additions"]+=commit["additions"]
+        week["deletions"]+=commit["deletions"]
+
+        authors[author]+=1
+
+    # only the weeks with activity, oldest first like parse_code_frequency
+    weekly=[{"week":week,"additions":counts["additions"],"deletions":-counts["deletions"]} for week,counts in sorted(weeks.items())
+            if counts["additions"] or counts["deletions"]]
+    contributors=[{"id":author,"contributions":count} for author,count in authors.most_common()]
+
+    return {"Detailed_commits":detailed,"commits":weekly,"contributors":contributors}
+
+
+def gitlab_fields(commits):
+    """
+    THE COMMIT FIELDS OF A GITLAB REPOSITORY DOCUMENT, IN THE FORMAT OF gitlab_commits.commit_dict
+    :param commits: commits as given by read_log
+    :type commits: list of Dictionaries
+    :return: Dictionary with commits and commits_complete
+    """
+    return {"commits":[{"created_at":commit["date"].isoformat()+"Z","stats":{"additions":commit["additions"],"deletions":commit["deletions"],
+                                                                           "total":commit["additions"]+commit["deletions"]}} for commit in commits],
+            "commits_complete":True}
+
+
+FIELDS={"github":github_fields,"gitlab":gitlab_fields}
+
+
+def repository_fields(key,cache_dir=CLONE_CACHE,url=None):
+    """
+    CLONE OR FETCH A REPOSITORY AND COMPUTE ITS COMMIT FIELDS
+    :param key: key of the repository in the form {SITE}/author_id/repo_id
+    :type key: string
+    :param cache_dir: directory of the clones
+    :type cache_dir: string
+    :param url: url to clone from, the repository on its site if not given
+    :type url: string
+    :return: Dictionary of the fields of the repository document
+    """
+    path=sync(key,cache_dir,url)
+    return FIELDS[key.split("/")[0]](list(read_log(path)))
+
+
+def collect_history(keys,cache_dir=CLONE_CACHE,workers=WORKERS):
+    """
+    COMMIT FIELDS OF MANY REPOSITORIES, A FEW CLONES AT A TIME
+    :param keys: keys of the repositories in the form {SITE}/author_id/repo_id
+    :type keys: iterable of strings
+    :param cache_dir: directory of the clones
+    :type cache_dir: string
+    :param workers: Number of repositories cloned and read at the same time
+    :type workers: int
+    :return: generator of (key, Dictionary of the fields or None, error in string or None), in the order they finish
+    """
+    with ThreadPoolExecutor(workers) as executor:
+        futures={executor.submit(repository_fields,key,cache_dir):key for key in keys}
+        for future in as_completed(futures):
+            try:
+                fields,error=future.result(),None
+            except (RuntimeError,subprocess.TimeoutExpired) as e:
+                fields,error=None,str(e)
+            # anything else that goes wrong with one repository (a broken clone, an unreadable log) fails only that one
+            except Exception as e:
+                fields,error=None,repr(e)
+            yield futures[future],fields,error
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Commit and contributor metrics of the repositories from local clones")
+    arg_parser.add_argument("--cache",default=CLONE_CACHE,help="directory of the clones, reused between runs")
+    arg_parser.add_argument("--workers",type=int,default=WORKERS)
+    arg_parser.add_argument("--site",choices=sorted(FIELDS),help="only the repositories of this site")
+    arg_parser.add_argument("--local",help="print the metrics of a local repository or mirror instead")
+    args=arg_parser.parse_args()
+
+    if args.local:
+        commits=list(read_log(args.local))
+        fields=github_fields(commits)
+        print(f"{len(commits)} commits, {len(fields['commits'])} active weeks, {len(fields['contributors'])} contributors")
+        for contributor in fields["contributors"][:10]:
+            print(contributor["contributions"],contributor["id"])
+
+    else:
+        repo_db=get_collection(collection_name="repository")
+        query={"key":{"$regex":f"^{args.site}/" if args.site else "^(github|gitlab)/"}}
+        keys={doc["key"]:doc["_id"] for doc in repo_db.find(query,{"key":1})}
+
+        failed=0
+        for key,fields,error in tqdm(collect_history(keys,args.cache,args.workers),total=len(keys)):
+            if fields is None:
+                failed+=1
+                print(f"{key}: {error}")
+                continue
+            update_collection_one(fields,object_id=keys[key],collection=repo_db)
+
+        print(f"{len(keys)-failed} repositories, {failed} failed")
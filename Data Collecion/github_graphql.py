@@ -0,0 +1,394 @@
+"""BATCHED GITHUB REPOSITORY METADATA OVER THE GRAPHQL API. ONE QUERY ALIASES UP TO 100 REPOSITORIES, SO THE STARS, FORKS, WATCHERS, SIZE, LANGUAGES,
+OPEN ISSUES AND DEFAULT BRANCH OF 100 REPOSITORIES COST ONE CALL INSTEAD OF THE FOUR OR SO REST CALLS EACH THAT github_scraper MAKES.
+
+The statistics endpoints (code frequency, contributors) have no GraphQL equivalent and are still fetched over REST by sourcecode.github_batch_scraper.
+
+The commit history of a repository (fetch_history) comes with the additions and deletions of every commit inline, 100 commits per query, for the
+Detailed_commits of detailed_sourcecode.py.
+"""
+import requests
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.exceptions import ConnectionError
+from opnieuw import RetryException, retry
+from rate_limiting import throttle, observe_response
+
+GRAPHQL_URL="https://api.github.com/graphql"
+
+# GraphQL has its own budget of points, separate from the REST calls
+GRAPHQL_KEY="api.github.com/graphql"
+
+# most repositories a single query may alias
+BATCH_SIZE=100
+
+# commits of the default branch, newest first, with their line stats. The stats of a page of large commits take github a while to compute, so a page
+# that keeps timing out is asked for again in smaller pieces, down to MIN_HISTORY_PAGE
+HISTORY_QUERY="""
+query($owner: String!, $name: String!, $first: Int!, $after: String, $since: GitTimestamp) {
+    repository(owner: $owner, name: $name) {
+        defaultBranchRef { target { ... on Commit {
+            history(first: $first, after: $after, since: $since) {
+                pageInfo { hasNextPage endCursor }
+                nodes { oid authoredDate additions deletions author { name email user { login } } }
+            }
+        } } }
+    }
+}
+"""
+HISTORY_PAGE=100
+MIN_HISTORY_PAGE=10
+
+# times at which a repository was starred, oldest first
+STARS_QUERY="""
+query($owner: String!, $name: String!, $after: String) {
+    repository(owner: $owner, name: $name) {
+        stargazers(first: 100, after: $after, orderBy: {field: STARRED_AT, direction: ASC}) {
+            pageInfo { hasNextPage endCursor }
+            edges { starredAt }
+        }
+    }
+}
+"""
+
+# repositories whose history is read at the same time
+HISTORY_WORKERS=4
+
+# fields of every repository, mapped to the repository document by repository_document
+REPOSITORY_FIELDS="""
+    stargazerCount
+    forkCount
+    diskUsage
+    hasIssuesEnabled
+    watchers { totalCount }
+    issues(states: OPEN) { totalCount }
+    pullRequests(states: OPEN) { totalCount }
+    defaultBranchRef { name }
+    languages(first: 100) { edges { size node { name } } }
+"""
+
+session=requests.Session()
+
+
+def build_query(ids,fields=REPOSITORY_FIELDS):
+    """
+    BUILD ONE QUERY FOR A BATCH OF REPOSITORIES, EACH UNDER ITS OWN ALIAS. OWNERS AND NAMES ARE PASSED AS VARIABLES SO THEY NEVER NEED ESCAPING
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: list of strings
+    :param fields: fields asked for every repository
+    :type fields: string
+    :return: Tuple of (query in string, Dictionary of variables)
+    """
+    declarations=[]
+    selections=[]
+    variables={}
+
+    for i,id in enumerate(ids):
+        owner,name=id.split("/",1)
+        variables[f"o{i}"]=owner
+        variables[f"n{i}"]=name
+        declarations.append(f"$o{i}: String!, $n{i}: String!")
+        selections.append(f"r{i}: repository(owner: $o{i}, name: $n{i}) {{{fields}}}")
+
+    query="query({}) {{\n{}\nrateLimit {{ cost remaining }}\n}}".format(", ".join(declarations),"\n".join(selections))
+    return query,variables
+
+
+def repository_document(id,node):
+    """
+    MAP A REPOSITORY NODE OF THE QUERY TO THE FIELDS OF THE REPOSITORY DOCUMENT, THE SAME ONES github_scraper GETS FROM THE REST API
+    :param id: repository in the form author_id/repo_id, as it was asked for
+    :type id: string
+    :param node: repository in the response
+    :type node: Dict
+    :return: Dictionary of the repository document, without commits and contributors
+    """
+    repo_dict={}
+    repo_dict["key"]=f"github/{id}"
+    repo_dict["subscribers"]=node["watchers"]["totalCount"]
+    repo_dict["stars"]=node["stargazerCount"]
+    repo_dict["forks"]=node["forkCount"]
+    repo_dict["languages"]={edge["node"]["name"]:edge["size"] for edge in node["languages"]["edges"]}
+    repo_dict["size"]=node["diskUsage"]
+
+    # the REST open_issues_count includes the open pull requests
+    if node["hasIssuesEnabled"]:
+        repo_dict["OpenIssues"]=node["issues"]["totalCount"]+node["pullRequests"]["totalCount"]
+    else:
+        repo_dict["OpenIssues"]=0
+
+    repo_dict["default_branch"]=node["defaultBranchRef"]["name"] if node["defaultBranchRef"] else None
+
+    return repo_dict
+
+
+@retry(retry_on_exceptions=(RetryException,ConnectionError),max_calls_total=5,retry_window_after_first_call_in_seconds=120)
+def run_query(query,variables,token,key=GRAPHQL_KEY):
+    """
+    RUN A GRAPHQL QUERY
+    :param query: the query
+    :type query: string
+    :param variables: values of the variables of the query
+    :type variables: Dict
+    :param token: GitHub token
+    :type token: string
+    :param key: key of the bucket of the token in rate_limiting.py
+    :type key: string
+    :return: data of the response. A field of it is None if github gave an error for it (NOT_FOUND, FORBIDDEN for a blocked or disabled repository...),
+             the other fields are kept. RATE_LIMITED, or an error of the whole query that left no data (a timeout...), raises RetryException instead,
+             so that it is never taken for a missing repository
+    """
+    throttle(key)
+    response=session.post(GRAPHQL_URL,json={"query":query,"variables":variables},headers={"Authorization":f"bearer {token}"},timeout=60)
+    observe_response(key,response)
+
+    # large queries occasionally time out on the github side
+    if response.status_code==429 or response.status_code>=500:
+        raise RetryException
+    response.raise_for_status()
+
+    # errors come with a 200, and data null or with the fields they are about set to null
+    body=response.json()
+    data=body.get("data")
+    errors=body.get("errors") or []
+    if not data or any(error.get("type")=="RATE_LIMITED" for error in errors):
+        raise RetryException
+
+    # an error with a path is about one repository of the query, which is missing; the rest of the query is still good
+    for error in errors:
+        if error.get("path"):
+            data[error["path"][0]]=None
+
+    return data
+
+
+def run_batch(ids,token,fields):
+    """
+    RUN ONE QUERY FOR UP TO BATCH_SIZE REPOSITORIES
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: list of strings
+    :param token: GitHub token
+    :type token: string
+    :param fields: fields asked for every repository
+    :type fields: string
+    :return: list with the node of every repository in the order of ids, None for the repositories that don't exist or can't be seen with the token
+    """
+    # missing and blocked repositories come back as null with an error, the rest of the batch is still there
+    data=run_query(*build_query(ids,fields),token)
+
+    return [data.get(f"r{i}") for i in range(len(ids))]
+
+
+def query_batch(ids,token):
+    """
+    FETCH THE METADATA OF UP TO BATCH_SIZE REPOSITORIES WITH ONE QUERY
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: list of strings
+    :param token: GitHub token
+    :type token: string
+    :return: Dictionary of id to the repository document, or None for the repositories that don't exist or can't be seen with the token
+    """
+    return {id:repository_document(id,node) if node else None for id,node in zip(ids,run_batch(ids,token,REPOSITORY_FIELDS))}
+
+
+def fetch_repositories(ids,token,batch_size=BATCH_SIZE):
+    """
+    FETCH THE METADATA OF ANY NUMBER OF REPOSITORIES IN BATCHES
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: iterable of strings
+    :param token: GitHub token
+    :type token: string
+    :param batch_size: Number of repositories per query, at most BATCH_SIZE
+    :type batch_size: int
+    :return: Dictionary of id to the repository document, or None for the repositories that don't exist. The repositories of a batch that kept failing
+             (rate limited, timed out...) are left out, they are neither scraped nor missing
+    """
+    ids=list(dict.fromkeys(ids))
+
+    results={}
+    for i in range(0,len(ids),batch_size):
+        try:
+            results.update(query_batch(ids[i:i+batch_size],token))
+        except RetryException:
+            continue
+    return results
+
+
+def resolve_names(ids,token,batch_size=BATCH_SIZE):
+    """
+    CURRENT owner/name OF REPOSITORIES. GITHUB FOLLOWS RENAMES AND TRANSFERS WHEN LOOKING A REPOSITORY UP, AND nameWithOwner IS ITS NAME TODAY WITH THE
+    CASE AS ON GITHUB, SO ALL THE WAYS A REPOSITORY IS WRITTEN DOWN END UP AT THE SAME NAME. ONE QUERY PER BATCH_SIZE REPOSITORIES
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: iterable of strings
+    :param token: GitHub token
+    :type token: string
+    :param batch_size: Number of repositories per query, at most BATCH_SIZE
+    :type batch_size: int
+    :return: Dictionary of id to the current author_id/repo_id, or None for the repositories github gave an error for. The repositories of a
+             batch that kept failing are left out
+    """
+    ids=list(dict.fromkeys(ids))
+
+    results={}
+    for i in range(0,len(ids),batch_size):
+        batch=ids[i:i+batch_size]
+        try:
+            nodes=run_batch(batch,token,"nameWithOwner")
+        except RetryException:
+            continue
+        results.update({id:node["nameWithOwner"] if node else None for id,node in zip(batch,nodes)})
+    return results
+
+
+def parse_time(value):
+    """
+    PARSE A TIMESTAMP OF THE API INTO A NAIVE UTC DATETIME, LIKE THE DATES PYGITHUB RETURNS
+    """
+    return datetime.fromisoformat(value.replace("Z","+00:00")).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def history_commit(node):
+    """
+    MAP A COMMIT OF THE HISTORY TO THE FORMAT OF Detailed_commits, THE SAME AS detailed_sourcecode.get_commit
+    :param node: commit in the response
+    :type node: Dict
+    :return: Dictionary of the commit
+    """
+    author=node.get("author") or {}
+    date=parse_time(node["authoredDate"])
+
+    # authors without a github login are known by their display name,email combination
+    login=(author.get("user") or {}).get("login")
+    if not login:
+        login=f"{author.get('name')} {author.get('email')}"
+
+    return {"sha":node["oid"],"Date":date,"Total":node["additions"]+node["deletions"],"Author":login}
+
+
+class RepositoryNotFound(Exception):
+    """
+    THE REPOSITORY DOES NOT EXIST OR CAN'T BE SEEN WITH THE TOKEN
+    """
+
+
+def iter_history(id,token,key=GRAPHQL_KEY,per_page=HISTORY_PAGE,since=None,after=None):
+    """
+    THE COMMITS OF THE DEFAULT BRANCH OF A REPOSITORY WITH THEIR LINE STATS, PAGE BY PAGE, 100 PER QUERY INSTEAD OF A REST CALL PER COMMIT
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param token: GitHub token
+    :type token: string
+    :param key: key of the bucket of the token in rate_limiting.py
+    :type key: string
+    :param per_page: Number of commits per query
+    :type per_page: int
+    :param since: Only the commits committed at or after this time
+    :type since: datetime (naive utc)
+    :param after: cursor of the page to continue after, as yielded for an earlier page, to resume an interrupted walk
+    :type after: string
+    :return: generator of (list of Detailed_commits Dictionaries newest first, cursor of the page). Raises RepositoryNotFound if github gives an
+             error for the repository (NOT_FOUND, FORBIDDEN...), and RetryException if the query keeps failing
+    """
+    owner,name=id.split("/",1)
+    first=per_page
+
+    while True:
+        try:
+            data=run_query(HISTORY_QUERY,{"owner":owner,"name":name,"first":first,"after":after,"since":since.isoformat()+"Z" if since else None},token,key)
+        except RetryException:
+            if first<=MIN_HISTORY_PAGE:
+                raise
+            first=max(MIN_HISTORY_PAGE,first//2)
+            continue
+
+        # null only when github gave an error for the repository (NOT_FOUND, FORBIDDEN...), see run_query
+        repository=data["repository"]
+        if repository is None:
+            raise RepositoryNotFound(id)
+        # an empty repository has no default branch
+        if not repository["defaultBranchRef"]:
+            return
+
+        history=repository["defaultBranchRef"]["target"]["history"]
+        after=history["pageInfo"]["endCursor"]
+        yield [history_commit(node) for node in history["nodes"]],after
+
+        if not history["pageInfo"]["hasNextPage"]:
+            return
+        first=per_page
+
+
+def iter_star_times(id,token,key=GRAPHQL_KEY):
+    """
+    THE TIMES AT WHICH A REPOSITORY WAS STARRED, 100 PER QUERY. UNLIKE THE REST LISTING THIS IS NOT LIMITED TO 40,000 STARS
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param token: GitHub token
+    :type token: string
+    :param key: key of the bucket of the token in rate_limiting.py
+    :type key: string
+    :return: generator of lists of datetimes (naive utc), oldest first. Raises RepositoryNotFound if github gives an error
+             for the repository, and RetryException if the query keeps failing
+    """
+    owner,name=id.split("/",1)
+    after=None
+
+    while True:
+        repository=run_query(STARS_QUERY,{"owner":owner,"name":name,"after":after},token,key)["repository"]
+        if repository is None:
+            raise RepositoryNotFound(id)
+
+        stargazers=repository["stargazers"]
+        yield [parse_time(edge["starredAt"]) for edge in stargazers["edges"]]
+
+        if not stargazers["pageInfo"]["hasNextPage"]:
+            return
+        after=stargazers["pageInfo"]["endCursor"]
+
+
+def fetch_history(id,token,key=GRAPHQL_KEY,per_page=HISTORY_PAGE,since=None):
+    """
+    EVERY COMMIT OF THE DEFAULT BRANCH OF A REPOSITORY WITH ITS LINE STATS, SEE iter_history
+    :return: list of Detailed_commits Dictionaries newest first, None if the repository does not exist
+    """
+    try:
+        return [commit for commits,_ in iter_history(id,token,key,per_page,since) for commit in commits]
+    except RepositoryNotFound:
+        return None
+
+
+def collect_histories(ids,tokens,store,workers=HISTORY_WORKERS,cursors=None):
+    """
+    THE COMMIT HISTORIES OF MANY REPOSITORIES, A FEW AT A TIME. EVERY REPOSITORY IS READ WITH ONE OF THE TOKENS IN TURN, AND EVERY TOKEN HAS ITS OWN
+    BUCKET OF GRAPHQL POINTS. THE PAGES ARE HANDED OVER AS THEY COME IN, SO NO HISTORY IS EVER HELD IN MEMORY AS A WHOLE
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: iterable of strings
+    :param tokens: GitHub tokens
+    :type tokens: list of strings
+    :param store: Called with the id, the commits of a page (newest first) and the cursor after the page, for every page in order. Called from the
+                  worker threads, but never for two pages of the same repository at once
+    :type store: function
+    :param workers: Number of repositories read at the same time
+    :type workers: int
+    :param cursors: Dictionary of id to the cursor to continue after, for the repositories whose walk was interrupted
+    :type cursors: Dict
+    :return: generator of (id, Number of commits stored or None if the repository does not exist, error or None), as they finish
+    """
+    cursors=cursors or {}
+
+    def walk(id,token,key):
+        count=0
+        try:
+            for commits,cursor in iter_history(id,token,key,after=cursors.get(id)):
+                store(id,commits,cursor)
+                count+=len(commits)
+        except RepositoryNotFound:
+            return None
+        return count
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures={executor.submit(walk,id,tokens[i%len(tokens)],f"{GRAPHQL_KEY}#{i%len(tokens)}"):id for i,id in enumerate(ids)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future],future.result(),None
+            except Exception as e:
+                yield futures[future],None,repr(e)
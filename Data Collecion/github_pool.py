@@ -0,0 +1,155 @@
+"""POOL OF GITHUB TOKENS SHARED BY sourcecode.py, detailed_sourcecode.py AND github_stats.py.
+
+Every token has its own PyGithub client and its own bucket in rate_limiting.py ("api.github.com#<n>"). The budget left on every token is taken from the
+X-RateLimit-* headers of its last response (PyGithub keeps them, and so do plain requests responses), so no calls are spent asking for the rate limit.
+Work goes to the token with the most budget left, so the throughput grows with the number of tokens.
+
+The tokens are read from the GITHUB_TOKENS environment variable, separated by commas.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from github import Github
+from rate_limiting import throttle, observe_response, observe_github
+
+GITHUB_TOKENS=[token.strip() for token in os.environ.get("GITHUB_TOKENS","API_KEY").split(",") if token.strip()]
+
+# hourly REST budget of a token, assumed untill the first response of the token says otherwise
+TOKEN_LIMIT=5000
+
+# items per page of the listings (commits, stargazers), the most github allows. Every page is one call
+PER_PAGE=100
+
+
+class GithubToken:
+    """
+    A TOKEN OF THE POOL WITH ITS CLIENT, THE KEY OF ITS BUCKET AND WHAT IS KNOWN ABOUT ITS BUDGET
+    """
+
+    def __init__(self,token,key):
+        """
+        :param token: GitHub token
+        :type token: string
+        :param key: key of the bucket of the token in rate_limiting.py
+        :type key: string
+        """
+        self.token=token
+        self.key=key
+        self.client=Github(token,per_page=PER_PAGE)
+
+        # calls left and the epoch time at which the budget resets, 0 if not known
+        self.remaining=TOKEN_LIMIT
+        self.reset=0
+        self.last_used=0
+
+    def budget(self,now):
+        """
+        CALLS LEFT ON THE TOKEN AT THE GIVEN EPOCH TIME
+        """
+        if self.reset and now>=self.reset:
+            return TOKEN_LIMIT
+        return self.remaining
+
+    def update(self,remaining,reset):
+        """
+        TAKE THE BUDGET FROM THE RATE LIMIT HEADERS OF A RESPONSE
+        """
+        if remaining is not None and int(remaining)>=0:
+            self.remaining=int(remaining)
+        if reset is not None and float(reset)>0:
+            self.reset=float(reset)
+
+
+class GithubPool:
+    """
+    ROUTES GITHUB CALLS TO THE TOKEN WITH THE MOST BUDGET LEFT
+    """
+
+    def __init__(self,tokens=None):
+        """
+        :param tokens: GitHub tokens, GITHUB_TOKENS if not given
+        :type tokens: list of strings
+        """
+        self.tokens=[GithubToken(token,f"api.github.com#{i}") for i,token in enumerate(tokens or GITHUB_TOKENS)]
+        self.lock=threading.Lock()
+
+    def _charge(self,member,cost):
+        # the window has reset since the last response of the token
+        if member.reset and time.time()>=member.reset:
+            member.remaining=TOKEN_LIMIT
+            member.reset=0
+        member.remaining-=cost
+        member.last_used=time.monotonic()
+
+    def acquire(self,cost=1):
+        """
+        PICK THE TOKEN WITH THE MOST BUDGET LEFT (THE LEAST RECENTLY USED ONE ON A TIE, AND THE ONE THAT RESETS FIRST IF ALL OF THEM ARE EXHAUSTED)
+        AND WAIT FOR ITS BUCKET
+        :param cost: Number of calls that are about to be made with the token
+        :type cost: int
+        :return: GithubToken object, use its client (or token) for the calls and pass it to observe afterwards
+        """
+        with self.lock:
+            now=time.time()
+
+            def preference(member):
+                budget=member.budget(now)
+                return (budget>0,budget if budget>0 else -member.reset,-member.last_used)
+
+            member=max(self.tokens,key=preference)
+            self._charge(member,cost)
+
+        throttle(member.key,cost)
+        return member
+
+    def charge(self,member,cost=1):
+        """
+        ACCOUNT FOR CALLS THAT HAVE TO BE MADE WITH A PARTICULAR TOKEN, E.G. THE NEXT PAGES OF A LISTING IT STARTED, AND WAIT FOR ITS BUCKET
+        :param member: token of the pool
+        :type member: GithubToken object
+        :param cost: Number of calls
+        :type cost: int
+        """
+        with self.lock:
+            self._charge(member,cost)
+        throttle(member.key,cost)
+
+    def observe(self,member):
+        """
+        UPDATE THE BUDGET OF A TOKEN FROM THE HEADERS PYGITHUB READ FROM ITS LAST RESPONSE. THIS DOES NOT MAKE ANY EXTRA CALLS
+        :param member: token of the pool whose client made the last calls
+        :type member: GithubToken object
+        """
+        remaining,_=member.client.rate_limiting
+        with self.lock:
+            member.update(remaining,member.client.rate_limiting_resettime)
+        observe_github(member.client,member.key)
+
+    def observe_response(self,member,response):
+        """
+        UPDATE THE BUDGET OF A TOKEN FROM A RESPONSE TO A CALL MADE WITH requests
+        :param member: token of the pool that was used for the call
+        :type member: GithubToken object
+        :param response: response of github
+        :type response: requests.Response object
+        """
+        with self.lock:
+            member.update(response.headers.get("x-ratelimit-remaining"),response.headers.get("x-ratelimit-reset"))
+        observe_response(member.key,response)
+
+    @contextmanager
+    def client(self,cost=1):
+        """
+        CONTEXT MANAGER GIVING THE PyGithub CLIENT OF THE TOKEN WITH THE MOST BUDGET LEFT, AND OBSERVING ITS BUDGET WHEN THE CALLS ARE DONE
+        :param cost: Number of calls that are about to be made with the client
+        :type cost: int
+        """
+        member=self.acquire(cost)
+        try:
+            yield member.client
+        finally:
+            self.observe(member)
+
+
+pool=GithubPool()
@@ -0,0 +1,189 @@
+"""REFRESH OF THE GITHUB REPOSITORIES IN THE REPOSITORY COLLECTION WITH CONDITIONAL REQUESTS.
+
+The ETag of every endpoint that is called for a repository is kept in its document (the "etags" field). A refresh sends it back in If-None-Match, and
+github answers 304 Not Modified, which does not count against the rate limit, for everything that did not change. Only the fields that did change are
+written, so a refresh of tens of thousands of repositories costs calls only for the repositories that moved.
+
+Used by `python sourcecode.py --refresh` (stars, forks, issues, languages, weekly commits and contributors) and `python detailed_sourcecode.py --refresh`
+(Detailed_commits and Stars_events, to which the new commits and stars are added when the newest commit or the number of stars changed).
+"""
+import requests
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError
+from opnieuw import RetryException, retry
+from pymongo import UpdateOne
+from tqdm import tqdm
+from github_stats import API_URL, PARSERS
+
+# path of every endpoint, relative to API_URL
+ENDPOINTS={
+    "repo":"/repos/{id}",
+    "languages":"/repos/{id}/languages",
+    "code_frequency":"/repos/{id}/stats/code_frequency",
+    "contributors":"/repos/{id}/stats/contributors",
+    # the newest commit on the default branch, it changes whenever something is pushed
+    "head":"/repos/{id}/commits?per_page=1",
+}
+
+# endpoints of the fields scraped by sourcecode.py and by detailed_sourcecode.py
+METADATA_ENDPOINTS=("repo","languages","code_frequency","contributors")
+DETAILED_ENDPOINTS=("repo","head")
+
+# fields of the repository documents read for a refresh, the compared ones and the etags
+METADATA_PROJECTION={field:1 for field in ("key","etags","subscribers","stars","forks","size","OpenIssues","default_branch","languages","commits","contributors")}
+
+# repositories refreshed at the same time, and repositories per database write
+WORKERS=8
+BATCH_SIZE=500
+
+session=requests.Session()
+
+
+def repo_fields(data):
+    """
+    THE FIELDS OF THE REPOSITORY DOCUMENT THAT COME FROM THE REPOSITORY ENDPOINT, THE SAME ONES github_scraper STORES
+    :param data: response of the repository endpoint
+    :type data: Dict
+    :return: Dictionary of the fields
+    """
+    return {"subscribers":data.get("subscribers_count"),"stars":data.get("stargazers_count"),"forks":data.get("forks_count"),"size":data.get("size"),
+            "OpenIssues":data.get("open_issues_count") if data.get("has_issues") else 0,"default_branch":data.get("default_branch")}
+
+
+# fields of the repository document that every endpoint fills in, from its response
+FIELDS={
+    "repo":repo_fields,
+    "languages":lambda data:{"languages":data},
+    "code_frequency":lambda data:{"commits":PARSERS["commits"](data or [])},
+    "contributors":lambda data:{"contributors":PARSERS["contributors"](data or [])},
+    "head":lambda data:{"head":data[0]["sha"] if data else None},
+}
+
+
+@retry(retry_on_exceptions=(RetryException,ConnectionError),max_calls_total=5,retry_window_after_first_call_in_seconds=60)
+def conditional_get(id,endpoint,etag,pool):
+    """
+    CALL AN ENDPOINT FOR A REPOSITORY, SENDING THE ETAG OF THE LAST RESPONSE SO THAT GITHUB CAN ANSWER 304 IF NOTHING CHANGED
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param endpoint: a key of ENDPOINTS
+    :type endpoint: string
+    :param etag: ETag of the last response of the endpoint, None if it was never called
+    :type etag: string
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :return: Tuple of (status, parsed json or None, ETag of the response or None)
+    """
+    headers={}
+    if etag:
+        headers["If-None-Match"]=etag
+
+    member=pool.acquire()
+    headers["Authorization"]=f"token {member.token}"
+    response=session.get(API_URL+ENDPOINTS[endpoint].format(id=id),headers=headers,timeout=30)
+    # a 304 leaves x-ratelimit-remaining where it was, so the budget of the token is given back here
+    pool.observe_response(member,response)
+
+    if response.status_code==429 or response.status_code>=500:
+        raise RetryException
+
+    if response.status_code==200:
+        return 200,response.json(),response.headers.get("etag")
+    return response.status_code,None,None
+
+
+def refresh_repository(doc,pool,endpoints=METADATA_ENDPOINTS):
+    """
+    CONDITIONAL REQUESTS TO THE ENDPOINTS OF ONE REPOSITORY, AND WHAT CHANGED SINCE THE LAST TIME
+    :param doc: document of the repository, with at least key and etags
+    :type doc: Dict
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param endpoints: keys of ENDPOINTS to call
+    :type endpoints: iterable of strings
+    :return: Tuple of (Dictionary of the fields to $set, Dictionary of endpoint to status). The fields include the new ETags, and are empty if
+             nothing changed
+    """
+    id=doc["key"].split("/",1)[1]
+    etags=doc.get("etags",{})
+
+    update={}
+    statuses={}
+    for endpoint in endpoints:
+        status,data,etag=conditional_get(id,endpoint,etags.get(endpoint),pool)
+        statuses[endpoint]=status
+
+        # 304 is unchanged, 202 is a statistic github is still computing (the old one is kept untill the next refresh), anything else is an error
+        if status!=200:
+            continue
+
+        for field,value in FIELDS[endpoint](data).items():
+            if doc.get(field)!=value:
+                update[field]=value
+        if etag and etag!=etags.get(endpoint):
+            update[f"etags.{endpoint}"]=etag
+
+    return update,statuses
+
+
+def refresh_repositories(docs,pool,collection,endpoints=METADATA_ENDPOINTS,workers=WORKERS,batch_size=BATCH_SIZE,on_update=None,total=None):
+    """
+    REFRESH MANY REPOSITORIES, A FEW AT A TIME, WRITING ONLY THE FIELDS THAT CHANGED IN BULK
+    :param docs: documents of the github repositories, with at least _id, key, etags and the fields that are compared
+    :type docs: iterable of Dicts
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param collection: repository collection
+    :type collection: MongoClient.Collection object
+    :param endpoints: keys of ENDPOINTS to call for every repository
+    :type endpoints: iterable of strings
+    :param workers: Number of repositories refreshed at the same time
+    :type workers: int
+    :param batch_size: Number of repositories per database write
+    :type batch_size: int
+    :param on_update: Called with the document and its update for every repository that changed, and may add fields to the update
+    :type on_update: function
+    :param total: Number of documents, for the progress bar
+    :type total: int
+    :return: Counter of the responses by endpoint and status, and of the repositories and fields written
+    """
+    summary=Counter()
+
+    def refresh(doc):
+        try:
+            update,statuses=refresh_repository(doc,pool,endpoints)
+        # the repository is left as it is untill the next refresh
+        except Exception as e:
+            return doc,{},{"error":type(e).__name__}
+        if update and on_update:
+            on_update(doc,update)
+        return doc,update,statuses
+
+    docs=iter(docs)
+    progress=tqdm(total=total)
+
+    with ThreadPoolExecutor(workers) as executor:
+        # a batch of documents at a time, so that the cursor is not read into memory all at once
+        while True:
+            batch=list(islice(docs,batch_size))
+            if not batch:
+                break
+
+            writes=[]
+            for doc,update,statuses in executor.map(refresh,batch):
+                for endpoint,status in statuses.items():
+                    summary[f"{endpoint} {status}"]+=1
+
+                if update:
+                    writes.append(UpdateOne({"_id":doc["_id"]},{"$set":update}))
+                    summary["repositories written"]+=1
+                    summary["fields written"]+=sum(1 for field in update if not field.startswith("etags."))
+
+            if writes:
+                collection.bulk_write(writes,ordered=False)
+            progress.update(len(batch))
+
+    progress.close()
+    return summary
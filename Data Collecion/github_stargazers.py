@@ -0,0 +1,212 @@
+"""STARGAZERS OF GITHUB REPOSITORIES, WITH THE PAGES FETCHED CONCURRENTLY.
+
+The number of pages of the listing is known up front from the number of stars, so instead of walking it one page at a time like
+get_stargazers_with_dates, collect_stargazers fetches a few pages at a time (with the tokens of the pool) and hands them over in order.
+
+For the per-day counts of detailed_sourcecode.py --daily, star_histogram only gives the number of stars of every day. The stargazers are listed oldest
+first, so if the first star of a page and the first star of a later page fall on the same day, every star in between does too and those pages are
+never fetched. Only the pages around the day boundaries are, which for a popular repository is a fraction of them.
+
+Github only lets the listing be paged up to MAX_PAGE (40,000 stars). daily_stars counts the stars of larger repositories over GraphQL instead.
+"""
+import math
+from collections import deque
+from itertools import islice
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import ConnectionError
+from opnieuw import RetryException, retry
+from github_stats import API_URL
+from github_pool import PER_PAGE
+from github_graphql import iter_star_times, parse_time
+from histograms import DailyHistogram, day_start
+
+# pages fetched at the same time
+WORKERS=8
+
+# last page github serves for the listing
+MAX_PAGE=400
+
+session=requests.Session()
+
+
+@retry(retry_on_exceptions=(RetryException,ConnectionError),max_calls_total=5,retry_window_after_first_call_in_seconds=60)
+def get_page(id,page,pool):
+    """
+    ONE PAGE OF THE STARGAZERS OF A REPOSITORY WITH THE TIME THEY STARRED IT
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param page: number of the page, from 1
+    :type page: int
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :return: list of {"user", "time"} Dictionaries, oldest first. Empty after the last page
+    """
+    member=pool.acquire()
+    response=session.get(f"{API_URL}/repos/{id}/stargazers",params={"per_page":PER_PAGE,"page":page},timeout=30,
+                         headers={"Authorization":f"token {member.token}","Accept":"application/vnd.github.v3.star+json"})
+    pool.observe_response(member,response)
+
+    if response.status_code==429 or response.status_code>=500:
+        raise RetryException
+    response.raise_for_status()
+
+    return [{"user":(star.get("user") or {}).get("login"),"time":parse_time(star["starred_at"])} for star in response.json()]
+
+
+def page_count(count):
+    """
+    NUMBER OF PAGES THAT CAN BE READ FOR A NUMBER OF STARS
+    """
+    return min(MAX_PAGE,math.ceil(count/PER_PAGE))
+
+
+def collect_stargazers(id,count,pool,store,workers=WORKERS,start_page=1):
+    """
+    GET THE STARGAZERS OF A REPOSITORY, A FEW PAGES AT A TIME
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param count: Number of stars of the repository, stargazers_count
+    :type count: int
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param store: Called with the stargazers of every page (a list of Dictionaries) and the number of the page, in the order of the pages
+    :type store: function
+    :param workers: Number of pages fetched at the same time
+    :type workers: int
+    :param start_page: first page to fetch, to continue an interrupted scrape after the pages it stored
+    :type start_page: int
+    :return: Number of stargazers stored
+    """
+    stored=0
+    # users of the last page, stars given while the listing is read shift the pages and the same stargazer can show up on two of them
+    previous=set()
+
+    pages=iter(range(start_page,page_count(count)+1))
+    with ThreadPoolExecutor(workers) as executor:
+        # at most two pages per worker are fetched ahead of the one being stored, so memory does not grow with the number of stars
+        in_flight=deque((page,executor.submit(get_page,id,page,pool)) for page in islice(pages,2*workers))
+        while in_flight:
+            page,future=in_flight.popleft()
+            for next_page in islice(pages,1):
+                in_flight.append((next_page,executor.submit(get_page,id,next_page,pool)))
+
+            stars=[star for star in future.result() if star["user"] not in previous]
+            store(stars,page)
+            stored+=len(stars)
+            previous={star["user"] for star in stars}
+
+    return stored
+
+
+def new_stargazers(id,count,pool,after,workers=WORKERS):
+    """
+    THE STARGAZERS OF A REPOSITORY THAT STARRED IT AFTER A GIVEN TIME. THE LISTING IS READ BACKWARDS FROM ITS LAST PAGE, A FEW PAGES AT A TIME, UNTILL
+    A PAGE STARTS AT OR BEFORE THAT TIME
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param count: Number of stars of the repository now, stargazers_count
+    :type count: int
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param after: time of the newest star that is already stored
+    :type after: datetime (naive utc)
+    :param workers: Number of pages fetched at the same time
+    :type workers: int
+    :return: list of {"user", "time"} Dictionaries, oldest first. None if the end of the listing is past MAX_PAGE
+    """
+    last=math.ceil(count/PER_PAGE)
+    if last>MAX_PAGE:
+        return None
+
+    pages=[]
+    with ThreadPoolExecutor(workers) as executor:
+        page=last
+        while page>=1:
+            numbers=list(range(page,max(0,page-workers),-1))
+            for stars in executor.map(lambda n:get_page(id,n,pool),numbers):
+                pages.append(stars)
+                if stars and stars[0]["time"]<=after:
+                    page=0
+                    break
+            else:
+                page-=workers
+
+    return [star for stars in reversed(pages) for star in stars if star["time"]>after]
+
+
+def star_histogram(id,count,pool,workers=WORKERS):
+    """
+    NUMBER OF STARS OF A REPOSITORY ON EVERY DAY, FETCHING ONLY THE PAGES THAT HAVE A DAY BOUNDARY BETWEEN THEM
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param count: Number of stars of the repository, stargazers_count
+    :type count: int
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param workers: Number of pages fetched at the same time
+    :type workers: int
+    :return: Tuple of (histograms.DailyHistogram object, Number of pages fetched)
+    """
+    histogram=DailyHistogram()
+    last=page_count(count)
+    if last==0:
+        return histogram,0
+
+    pages={}
+
+    with ThreadPoolExecutor(workers) as executor:
+        def fetch(numbers):
+            for number,stars in zip(numbers,executor.map(lambda n:get_page(id,n,pool),numbers)):
+                pages[number]=stars
+
+        fetch(sorted({1,last}))
+
+        # ranges of pages (first, last) whose first stars are known but that may have a day boundary inside them. Every round fetches the middle
+        # page of all of them at once
+        ranges=[(1,last)] if last>1 else []
+        while ranges:
+            split=[]
+            for first,end in ranges:
+                if end-first<2 or not pages[first] or not pages[end]:
+                    continue
+                if day_start(pages[first][0]["time"])!=day_start(pages[end][0]["time"]):
+                    split.append((first,(first+end)//2,end))
+
+            fetch([middle for _,middle,_ in split])
+            ranges=[r for first,middle,end in split for r in ((first,middle),(middle,end))]
+
+    numbers=sorted(pages)
+    for number,following in zip(numbers,numbers[1:]+[None]):
+        for star in pages[number]:
+            histogram.add(star["time"])
+
+        # the pages in between were skipped because they all fall on the day of the first star of the next fetched page
+        if following and following>number+1 and pages[following]:
+            histogram.add(pages[following][0]["time"],PER_PAGE*(following-number-1))
+
+    return histogram,len(pages)
+
+
+def daily_stars(id,count,pool,workers=WORKERS):
+    """
+    NUMBER OF STARS OF A REPOSITORY ON EVERY DAY, WITH star_histogram, OR FOR REPOSITORIES PAST MAX_PAGE BY COUNTING ALL THE STARS OVER GRAPHQL (WHICH
+    HAS NO SUCH LIMIT, BUT CAN ONLY BE READ FROM THE START)
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param count: Number of stars of the repository, stargazers_count
+    :type count: int
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param workers: Number of pages fetched at the same time
+    :type workers: int
+    :return: histograms.DailyHistogram object
+    """
+    if math.ceil(count/PER_PAGE)<=MAX_PAGE:
+        return star_histogram(id,count,pool,workers)[0]
+
+    histogram=DailyHistogram()
+    for times in iter_star_times(id,pool.tokens[0].token):
+        for time in times:
+            histogram.add(time)
+    return histogram
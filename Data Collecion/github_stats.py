@@ -0,0 +1,137 @@
+"""DEFERRED POLLING OF THE GITHUB STATISTICS ENDPOINTS (WEEKLY CODE FREQUENCY AND CONTRIBUTORS).
+
+GitHub computes these statistics in the background and answers 202 until they are ready. Instead of waiting on each repository in turn, collect_stats
+fires the requests for all the repositories up front, parks every endpoint that answered 202 in a queue ordered by when it is due again (with an
+increasing delay), and works through the other repositories in the meantime. A repository is only returned once both of its statistics are complete;
+the ones that never became ready are reported as incomplete instead of being stored with empty commits/contributors.
+"""
+import time
+import heapq
+import random
+import requests
+from datetime import datetime, timezone
+from requests.exceptions import RequestException
+
+API_URL="https://api.github.com"
+
+# field of the repository document -> statistics endpoint
+STATS_ENDPOINTS={"commits":"code_frequency","contributors":"contributors"}
+
+# delay before polling an endpoint that answered 202 again, doubled on every further 202 up to the maximum
+INITIAL_DELAY=3
+MAX_DELAY=120
+
+# seconds after which the repositories that are still not ready are given up on (until the next run)
+MAX_WAIT=900
+
+session=requests.Session()
+
+
+def parse_code_frequency(data):
+    """
+    WEEKLY ADDITIONS/DELETIONS IN THE FORMAT OF THE commits FIELD OF THE REPOSITORY DOCUMENT. FOR SPACE EFFICIENCY A WEEK IS ONLY ADDED IF THERE
+    WERE ADDITIONS OR DELETIONS, I.E. A WEEK NOT EXISTING IMPLIES NO COMMIT ACTIVITY HAPPENED IN THE REPO
+    :param data: response of the code_frequency endpoint, list of [week timestamp, additions, deletions]
+    :type data: list
+    :return: list of {"week", "additions", "deletions"} Dictionaries
+    """
+    commits_list=[]
+    for week,additions,deletions in data:
+        if additions or deletions:
+            # naive utc datetime, the same as the week of PyGithub's StatsCodeFrequency
+            commits_list.append({"week":datetime.fromtimestamp(week,timezone.utc).replace(tzinfo=None),"additions":additions,"deletions":deletions})
+    return commits_list
+
+
+def parse_contributors(data):
+    """
+    CONTRIBUTIONS BY USERS IN THE FORMAT OF THE contributors FIELD OF THE REPOSITORY DOCUMENT (GITHUB CAPS THIS TO 100 USERS)
+    :param data: response of the contributors endpoint
+    :type data: list
+    :return: list of {"id", "contributions"} Dictionaries. id is None for deleted users
+    """
+    return [{"id":(contrib.get("author") or {}).get("login"),"contributions":contrib["total"]} for contrib in data]
+
+
+PARSERS={"commits":parse_code_frequency,"contributors":parse_contributors}
+
+
+def request_stats(id,field,pool):
+    """
+    ONE REQUEST TO A STATISTICS ENDPOINT, WITH THE TOKEN OF THE POOL THAT HAS THE MOST BUDGET LEFT
+    :param id: repository in the form author_id/repo_id
+    :type id: string
+    :param field: field of the repository document, a key of STATS_ENDPOINTS
+    :type field: string
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :return: Tuple of (status, parsed statistics or None). The statistics of a 204 (empty repository) are an empty list
+    """
+    member=pool.acquire()
+    response=session.get(f"{API_URL}/repos/{id}/stats/{STATS_ENDPOINTS[field]}",headers={"Authorization":f"token {member.token}"},timeout=30)
+    pool.observe_response(member,response)
+
+    if response.status_code==200:
+        return 200,PARSERS[field](response.json() or [])
+    if response.status_code==204:
+        return 204,[]
+    return response.status_code,None
+
+
+def collect_stats(ids,pool,initial_delay=INITIAL_DELAY,max_delay=MAX_DELAY,max_wait=MAX_WAIT):
+    """
+    GET THE STATISTICS OF MANY REPOSITORIES, POLLING THE ONES GITHUB IS STILL COMPUTING IN THE BACKGROUND WHILE THE OTHERS ARE REQUESTED
+    :param ids: repositories in the form author_id/repo_id
+    :type ids: iterable of strings
+    :param pool: GitHub tokens
+    :type pool: github_pool.GithubPool object
+    :param initial_delay: Seconds before an endpoint that answered 202 is polled again
+    :type initial_delay: float
+    :param max_delay: Most seconds between two polls of the same endpoint
+    :type max_delay: float
+    :param max_wait: Seconds after which the repositories that are not ready are given up on
+    :type max_wait: float
+    :return: Tuple of (Dictionary of id to {"commits":..., "contributors":...} for the complete repositories, Dictionary of id to the reason for the others)
+    """
+    ids=list(dict.fromkeys(ids))
+    deadline=time.monotonic()+max_wait
+
+    partial={id:{} for id in ids}
+    incomplete={}
+
+    # (due time, order, id, field, attempt). Every endpoint starts out due now, so all of them are fired up front
+    due=[(0,i,id,field,0) for i,(id,field) in enumerate((id,field) for id in ids for field in STATS_ENDPOINTS)]
+    heapq.heapify(due)
+    order=len(due)
+
+    while due:
+        when,_,id,field,attempt=heapq.heappop(due)
+
+        # one of the endpoints of this repository already failed
+        if id in incomplete:
+            continue
+
+        now=time.monotonic()
+        if when>deadline:
+            incomplete[id]="not ready after {}s".format(max_wait)
+            continue
+        if when>now:
+            time.sleep(when-now)
+
+        try:
+            status,stats=request_stats(id,field,pool)
+        except RequestException as e:
+            status,stats=repr(e),None
+
+        if stats is not None:
+            partial[id][field]=stats
+        elif not isinstance(status,int) or status in (202,429) or status>=500:
+            # still being computed (or a network problem or a rate limit), come back later with some jitter so the retries don't all fire together
+            delay=min(max_delay,initial_delay*2**attempt)*random.uniform(0.8,1.2)
+            order+=1
+            heapq.heappush(due,(time.monotonic()+delay,order,id,field,attempt+1))
+        else:
+            incomplete[id]="{} answered {}".format(STATS_ENDPOINTS[field],status)
+
+    complete={id:stats for id,stats in partial.items() if id not in incomplete and len(stats)==len(STATS_ENDPOINTS)}
+    return complete,incomplete
@@ -0,0 +1,138 @@
+"""COMMITS OF A GITLAB PROJECT WITH THEIR ADDITIONS/DELETIONS, STRAIGHT FROM THE LIST PAGES.
+
+The list endpoint returns the stats of every commit when asked with `with_stats=true`, so there is no need for a request per commit. The pages are
+fetched concurrently (a few at a time) and handed over in order as they arrive, so the caller can store them as it goes. For GitLab versions that
+ignore with_stats, the stats of the commits missing them are fetched one by one as before.
+
+GITLAB_URL can point to a stand-in server for offline runs, see gitlab_standin.py.
+"""
+import os
+import requests
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError
+from opnieuw import RetryException, retry
+from rate_limiting import throttle, observe_response, host_key
+
+GITLAB_URL=os.environ.get("GITLAB_URL","https://gitlab.com")
+GITLAB_TOKEN="API_KEY"
+
+# commits per page (the most gitlab allows) and pages fetched at the same time
+PER_PAGE=100
+WORKERS=4
+
+session=requests.Session()
+session.mount("http://",HTTPAdapter(pool_maxsize=WORKERS))
+session.mount("https://",HTTPAdapter(pool_maxsize=WORKERS))
+
+
+def commits_url(id):
+    """
+    URL OF THE COMMITS OF A PROJECT
+    :param id: project in the form author_id/repo_id
+    :type id: string
+    :return: url in string
+    """
+    return f"{GITLAB_URL}/api/v4/projects/{quote(id,safe='')}/repository/commits"
+
+
+def commit_dict(commit):
+    """
+    THE FIELDS OF A COMMIT KEPT IN THE commits FIELD OF THE REPOSITORY DOCUMENT
+    """
+    return {"created_at":commit.get("created_at"),"stats":commit.get("stats")}
+
+
+@retry(retry_on_exceptions=(RetryException,ConnectionError),max_calls_total=5,retry_window_after_first_call_in_seconds=60)
+def get_json(url,token,params=None):
+    """
+    GET A GITLAB API URL
+    :return: Tuple of (parsed json, response headers)
+    """
+    key=host_key(url)
+
+    throttle(key)
+    response=session.get(url,params=params,headers={"PRIVATE-TOKEN":token},timeout=60)
+    observe_response(key,response)
+
+    if response.status_code==429 or response.status_code>=500:
+        raise RetryException
+    response.raise_for_status()
+
+    return response.json(),response.headers
+
+
+def get_page(id,page,token,per_page=PER_PAGE):
+    """
+    ONE PAGE OF THE COMMITS OF A PROJECT, WITH THE STATS OF EVERY COMMIT
+    :param id: project in the form author_id/repo_id
+    :type id: string
+    :param page: number of the page, from 1
+    :type page: int
+    :param token: GitLab token
+    :type token: string
+    :param per_page: Number of commits per page
+    :type per_page: int
+    :return: Tuple of (list of commit Dictionaries, total number of pages or None if gitlab did not say)
+    """
+    commits,headers=get_json(commits_url(id),token,{"with_stats":"true","per_page":per_page,"page":page})
+
+    for commit in commits:
+        # this gitlab does not support with_stats
+        if "stats" not in commit:
+            commit["stats"]=get_json(f"{commits_url(id)}/{commit['id']}",token)[0].get("stats")
+
+    total=headers.get("x-total-pages")
+    return [commit_dict(commit) for commit in commits],int(total) if total else None
+
+
+def collect_commits(id,token,store,workers=WORKERS,per_page=PER_PAGE):
+    """
+    GET ALL THE COMMITS OF A PROJECT, A FEW PAGES AT A TIME
+    :param id: project in the form author_id/repo_id
+    :type id: string
+    :param token: GitLab token
+    :type token: string
+    :param store: Called with the commits of every page (a list of Dictionaries), in the order of the pages
+    :type store: function
+    :param workers: Number of pages fetched at the same time
+    :type workers: int
+    :param per_page: Number of commits per page
+    :type per_page: int
+    :return: Number of commits
+    """
+    commits,total_pages=get_page(id,1,token,per_page)
+    if commits:
+        store(commits)
+    count=len(commits)
+
+    if len(commits)<per_page:
+        return count
+
+    with ThreadPoolExecutor(workers) as executor:
+        if total_pages:
+            # all the pages are known up front, the executor keeps only a few of them in flight
+            futures=[executor.submit(get_page,id,page,token,per_page) for page in range(2,total_pages+1)]
+            for future in futures:
+                commits,_=future.result()
+                if commits:
+                    store(commits)
+                count+=len(commits)
+        else:
+            # large projects don't get a total, fetch a window of pages at a time untill a page comes back short
+            page=2
+            done=False
+            while not done:
+                futures=[executor.submit(get_page,id,p,token,per_page) for p in range(page,page+workers)]
+                for future in futures:
+                    commits,_=future.result()
+                    if commits:
+                        store(commits)
+                    count+=len(commits)
+                    if len(commits)<per_page:
+                        done=True
+                        break
+                page+=workers
+
+    return count
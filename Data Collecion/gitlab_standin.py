@@ -0,0 +1,149 @@
+"""STAND-IN FOR THE PARTS OF THE GITLAB API THAT sourcecode.gitlab_scraper USES, SERVING MADE UP PROJECTS. FOR OFFLINE RUNS AND BENCHMARKS OF THE
+GITLAB COLLECTION.
+
+A project named like "group/name-2500" has 2500 commits, any other project has DEFAULT_COMMITS. Every request waits `--latency` seconds to play the
+part of the network, and the number of requests served is printed on exit.
+
+Usage:
+    python gitlab_standin.py [--port 8929] [--latency 0.05] [--no-totals]
+    GITLAB_URL=http://127.0.0.1:8929 python sourcecode.py
+"""
+import re
+import json
+import zlib
+import hashlib
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_COMMITS=250
+
+# commits are spread over the weeks before this date
+LAST_COMMIT=datetime(2020,6,1)
+
+
+def commit_count(project):
+    """
+    NUMBER OF COMMITS OF A MADE UP PROJECT, FROM THE NUMBER AT THE END OF ITS NAME
+    """
+    match=re.search(r"-(\d+)$",project)
+    return int(match.group(1)) if match else DEFAULT_COMMITS
+
+
+def make_commit(project,i,with_stats=True):
+    """
+    THE i-TH COMMIT OF A PROJECT, NEWEST FIRST LIKE GITLAB
+    """
+    commit={"id":hashlib.sha1(f"{project}/{i}".encode()).hexdigest(),"created_at":(LAST_COMMIT-timedelta(hours=7*i)).isoformat()+"Z","title":f"commit {i}"}
+    if with_stats:
+        additions,deletions=(i*7)%50,(i*3)%20
+        commit["stats"]={"additions":additions,"deletions":deletions,"total":additions+deletions}
+    return commit
+
+
+def make_handler(latency=0.0,totals=True,counter=None):
+    """
+    REQUEST HANDLER CLASS FOR THE STAND-IN
+    :param latency: Seconds every request takes
+    :type latency: float
+    :param totals: Send the X-Total/X-Total-Pages headers, gitlab leaves them out for large projects
+    :type totals: Boolean
+    :param counter: Dictionary the number of requests by endpoint is counted in
+    :type counter: Dict
+    :return: BaseHTTPRequestHandler subclass
+    """
+    counter=counter if counter is not None else {}
+    lock=threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self,data,headers=None):
+            body=json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type","application/json")
+            self.send_header("Content-Length",str(len(body)))
+            for name,value in (headers or {}).items():
+                self.send_header(name,str(value))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            url=urlparse(self.path)
+            query={k:v[0] for k,v in parse_qs(url.query).items()}
+
+            # the project id is url encoded, so split the path before decoding it
+            parts=url.path.split("/")
+            if parts[1:4]!=["api","v4","projects"] or len(parts)<5:
+                self.send_error(404)
+                return
+            project=unquote(parts[4])
+            endpoint="/".join(parts[5:])
+
+            with lock:
+                counter[endpoint or "project"]=counter.get(endpoint or "project",0)+1
+
+            n=commit_count(project)
+            if endpoint=="":
+                self.send_json({"id":zlib.crc32(project.encode()),"path_with_namespace":project,"forks_count":n//100,"star_count":n//10,"created_at":(LAST_COMMIT-timedelta(hours=7*n)).isoformat()+"Z",
+                                "last_activity_at":LAST_COMMIT.isoformat()+"Z","open_issues_count":n//50})
+            elif endpoint=="issues_statistics":
+                self.send_json({"statistics":{"counts":{"all":n//20,"closed":n//20-n//50,"opened":n//50}}})
+            elif endpoint=="languages":
+                self.send_json({"Python":80.0,"Shell":20.0})
+            elif endpoint=="repository/contributors":
+                self.send_json([{"name":f"dev{i}","email":f"dev{i}@example.com","commits":n//3,"additions":0,"deletions":0} for i in range(3)])
+            elif endpoint=="repository/commits":
+                per_page=min(int(query.get("per_page",20)),100)
+                page=int(query.get("page",1))
+                with_stats=query.get("with_stats")=="true"
+                commits=[make_commit(project,i,with_stats) for i in range((page-1)*per_page,min(page*per_page,n))]
+
+                pages=(n+per_page-1)//per_page
+                headers={"X-Page":page,"X-Per-Page":per_page,"X-Next-Page":page+1 if page<pages else ""}
+                if totals:
+                    headers.update({"X-Total":n,"X-Total-Pages":pages})
+                self.send_json(commits,headers)
+            elif endpoint.startswith("repository/commits/"):
+                sha=endpoint.split("/")[-1]
+                for i in range(n):
+                    commit=make_commit(project,i)
+                    if commit["id"]==sha:
+                        self.send_json(commit)
+                        return
+                self.send_error(404)
+            else:
+                self.send_error(404)
+
+        def log_message(self,*args):
+            pass
+
+    return Handler
+
+
+def start_server(port=8929,latency=0.0,totals=True):
+    """
+    START THE STAND-IN IN A BACKGROUND THREAD
+    :return: Tuple of (server, Dictionary counting the requests by endpoint)
+    """
+    counter={}
+    server=ThreadingHTTPServer(("127.0.0.1",port),make_handler(latency,totals,counter))
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server,counter
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Stand-in gitlab api serving made up projects")
+    arg_parser.add_argument("--port",type=int,default=8929)
+    arg_parser.add_argument("--latency",type=float,default=0.05,help="seconds every request takes")
+    arg_parser.add_argument("--no-totals",action="store_true",help="leave out X-Total-Pages like gitlab does for large projects")
+    args=arg_parser.parse_args()
+
+    server,counter=start_server(args.port,args.latency,not args.no_totals)
+    print(f"Serving a stand-in gitlab api on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(counter)
@@ -0,0 +1,58 @@
+"""PER-DAY COUNTS OF REPOSITORY ACTIVITY (COMMITS, STARS), KEPT INSTEAD OF THE EVENTS THEMSELVES FOR THE REPOSITORIES COLLECTED WITH
+`python detailed_sourcecode.py --daily`.
+
+database_interface.parse_detailed_commits and parse_detailed_stars only ever look at days, weeks and months, which can all be made from the days, so a
+popular repository takes a few thousand small entries instead of hundreds of thousands of events.
+"""
+from datetime import datetime
+
+
+def day_start(time):
+    """
+    START OF THE DAY OF A TIME (THE TIMES OF THE SCRAPERS ARE NAIVE UTC)
+    """
+    return datetime(time.year,time.month,time.day)
+
+
+class DailyHistogram:
+    """
+    COUNTS (AND SUMS OF OTHER VALUES) OF EVENTS PER DAY, BUILT UP WHILE THE EVENTS ARE COLLECTED
+    """
+
+    def __init__(self,fields=()):
+        """
+        :param fields: names of the values that are summed per day besides the count, e.g. ("Total",) for the lines changed by the commits
+        :type fields: tuple of strings
+        """
+        self.fields=fields
+        self.days={}
+
+    def add(self,time,count=1,**values):
+        """
+        COUNT EVENTS
+        :param time: time of the events
+        :type time: datetime
+        :param count: Number of events
+        :type count: int
+        :param values: values of the fields of the events, summed
+        """
+        day=self.days.setdefault(day_start(time),dict.fromkeys(("count",)+self.fields,0))
+        day["count"]+=count
+        for field in self.fields:
+            day[field]+=values.get(field,0)
+
+    def to_list(self):
+        """
+        :return: list of {"day", "count", fields...} Dictionaries, oldest first
+        """
+        return [dict(day=day,**counts) for day,counts in sorted(self.days.items())]
+
+    def totals(self):
+        """
+        :return: Dictionary of the count and the fields summed over all the days
+        """
+        totals=dict.fromkeys(("count",)+self.fields,0)
+        for counts in self.days.values():
+            for field,value in counts.items():
+                totals[field]+=value
+        return totals
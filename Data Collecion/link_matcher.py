@@ -0,0 +1,148 @@
+"""FINDS GITHUB/GITLAB/BITBUCKET/SOURCEFORGE LINKS IN TEXT AND TURNS THEM INTO REPOSITORY KEYS. SHARED BY pdf_miner.py AND sourcecode.py.
+
+Instead of running one large regex over the whole text of a paper, the text is scanned for the rare host literals (`github.`, `gitlab.`, ...) with
+str.find, and the url grammar only runs in a small window around each hit. URLs that were broken over two lines in the pdf are joined back first."""
+import re
+from collections import namedtuple
+
+# the literals every link contains, and the hosts they belong to
+LITERALS=("github.","gitlab.","bitbucket.","sourceforge.")
+HOSTS={"github":"com","gitlab":"com","bitbucket":"org","sourceforge":"net"}
+
+# characters of text looked at before and after a literal hit
+WINDOW_BEFORE=64
+WINDOW_AFTER=256
+
+# full url grammar, only ever run inside a window
+url_pattern=re.compile(r"(?:https?://)?((?:[-a-z0-9]+\.)*)(github|gitlab|bitbucket|sourceforge)\.([a-z]{2,6})\b((?:/[-a-zA-Z0-9@:%_\+~#?&/\\=.]*)?)",re.IGNORECASE)
+
+# a line break right after a character that can't end a url, or right before a "/", is where the pdf broke the url
+line_break_pattern=re.compile(r"(?<=[/\-_~=&?#%])[ \t]*\r?\n[ \t]*(?=[-\w/])|[ \t]*\r?\n[ \t]*(?=/[-\w])")
+
+# punctuation from the surrounding sentence that sticks to the end of a link
+TRAILING=".,;:)]}'\"\\"
+
+# first path segments on the hosts that are not users/organizations
+RESERVED={"orgs","features","about","topics","sponsors","marketplace","settings","pulls","issues","explore","search","login","site","collections","trending","users","groups","dashboard","help"}
+
+Link=namedtuple("Link",["url","key"])
+
+
+def repair_line_breaks(text):
+    """
+    JOIN URLS THAT THE PDF BROKE OVER TWO LINES (AFTER A "/" OR "-" AND SIMILAR, OR BEFORE A "/")
+    :param text: text around a link
+    :type text: string
+    :return: text with those line breaks removed
+    """
+    return re.sub(line_break_pattern,"",text)
+
+
+def repo_key(url):
+    """
+    CANONICAL KEY OF THE REPOSITORY A LINK POINTS TO, IN THE FORM {SITE}/owner/repo AS USED BY THE REPOSITORY COLLECTION. ".git" SUFFIXES,
+    PATHS INSIDE THE REPOSITORY (tree/master/...), QUERIES AND TRAILING PUNCTUATION ARE DROPPED
+    :param url: link to a repository or a page inside it
+    :type url: string
+    :return: key in string, None if the link does not point into a repository
+    """
+    match=re.search(url_pattern,url)
+    if not match:
+        return None
+
+    host=match.group(2).lower()
+
+    # pages (owner.github.io), other subdomains and other top level domains are not repositories
+    if match.group(1).lower() not in ("","www.") or match.group(3).lower()!=HOSTS[host]:
+        return None
+
+    path=re.split(r"[?#]",match.group(4))[0]
+    parts=[p for p in path.replace("\\","/").split("/") if p]
+
+    # sourceforge projects live under /projects/<name> or /p/<name>
+    if host=="sourceforge":
+        if len(parts)>=2 and parts[0] in ("projects","p"):
+            parts=["projects",parts[1]]
+        else:
+            return None
+
+    if len(parts)<2 or parts[0].lower() in RESERVED:
+        return None
+
+    owner=parts[0]
+    repo=parts[1].rstrip(TRAILING)
+    if repo.lower().endswith(".git"):
+        repo=repo[:-4]
+
+    if not owner or not repo:
+        return None
+
+    return f"{host}/{owner}/{repo}"
+
+
+def original_end(text,position,tail):
+    """
+    END IN THE ORIGINAL TEXT OF A LINK FOUND IN A REPAIRED WINDOW, SKIPPING THE WHITESPACE THE REPAIR REMOVED
+    :param text: original text
+    :type text: string
+    :param position: position of the literal hit in the original text
+    :type position: int
+    :param tail: part of the link from the literal onwards
+    :type tail: string
+    :return: position in the original text right after the link
+    """
+    i=position
+    for character in tail:
+        while i<len(text) and text[i]!=character and text[i] in " \t\r\n":
+            i+=1
+        i+=1
+    return i
+
+
+def literal_hits(text):
+    """
+    POSITIONS OF ALL THE HOST LITERALS IN THE TEXT
+    :param text: text to scan
+    :type text: string
+    :return: sorted list of positions
+    """
+    lowered=text.lower()
+    hits=[]
+    for literal in LITERALS:
+        position=lowered.find(literal)
+        while position!=-1:
+            hits.append(position)
+            position=lowered.find(literal,position+len(literal))
+    return sorted(hits)
+
+
+def find_links(text):
+    """
+    FIND ALL THE GITHUB/GITLAB/BITBUCKET/SOURCEFORGE LINKS IN A TEXT
+    :param text: text of a paper (or anything else)
+    :type text: string
+    :return: list of Link(url, key) tuples without duplicate urls, in the order they appear. key is None for links that do not point into a repository
+    """
+    links={}
+    covered=0
+
+    for position in literal_hits(text):
+        # part of a link we already have
+        if position<covered:
+            continue
+
+        start=max(0,position-WINDOW_BEFORE,covered)
+        window=text[start:position+WINDOW_AFTER]
+
+        # the hit is the last line break free stretch before the literal, so only repair what comes after it
+        offset=position-start
+        window=window[:offset]+repair_line_breaks(window[offset:])
+
+        for match in re.finditer(url_pattern,window):
+            if match.start()<=offset<match.end():
+                url=match.group(0).rstrip(TRAILING)
+                links.setdefault(url,repo_key(url))
+                covered=original_end(text,position,match.group(0)[offset-match.start():])
+                break
+
+    return [Link(url,key) for url,key in links.items()]
@@ -0,0 +1,240 @@
+"""INTERCHANGEABLE BACKENDS FOR EXTRACTING THE TEXT OF A PDF, PAGE BY PAGE. pdfminer.six IS ALWAYS AVAILABLE AND USED AS THE FALLBACK;
+pypdfium2 AND PyMuPDF ARE USED WHEN THEY ARE INSTALLED, AND ARE MUCH FASTER.
+
+Usage (benchmark):
+    python pdf_backends.py <directory with pdfs> [--first 3] [--last 2]
+"""
+import io
+import os
+import time
+import argparse
+from importlib.metadata import version, PackageNotFoundError
+from pdfminer.converter import TextConverter
+from pdfminer.layout import LAParams
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdftypes import resolve1
+
+try:
+    import pypdfium2
+except ImportError:
+    pypdfium2=None
+
+try:
+    import pymupdf
+except ImportError:
+    # older releases only provide the fitz name
+    try:
+        import fitz as pymupdf
+    except ImportError:
+        pymupdf=None
+
+# backends in order of preference for the default
+PREFERENCE=["pypdfium2","pymupdf","pdfminer"]
+
+# pip package of each backend, used for the version
+PACKAGES={"pdfminer":"pdfminer.six","pypdfium2":"pypdfium2","pymupdf":"PyMuPDF"}
+
+
+def select_pages(page_count,first_pages=None,last_pages=None):
+    """
+    INDICES OF THE PAGES TO EXTRACT. CODE LINKS ARE USUALLY ON THE FIRST PAGES (ABSTRACT, FOOTNOTES) OR THE LAST ONES (REFERENCES, APPENDIX)
+    :param page_count: Number of pages in the pdf
+    :type page_count: int
+    :param first_pages: Number of pages to take from the start. All pages if both first_pages and last_pages are None
+    :type first_pages: int
+    :param last_pages: Number of pages to take from the end
+    :type last_pages: int
+    :return: sorted list of 0-based page indices
+    """
+    if first_pages is None and last_pages is None:
+        return list(range(page_count))
+
+    pages=set(range(min(first_pages or 0,page_count)))
+    pages.update(range(max(page_count-(last_pages or 0),0),page_count))
+
+    return sorted(pages)
+
+
+def pdfminer_pages(pdf,first_pages=None,last_pages=None):
+    """
+    EXTRACT THE TEXT OF EVERY SELECTED PAGE WITH PDFMINER
+    :param pdf: Content of the pdf in bytes or its path
+    :type pdf: bytes or string
+    :return: list of page texts in string
+    """
+    fp=io.BytesIO(pdf) if isinstance(pdf,bytes) else open(pdf,"rb")
+
+    with fp:
+        document=PDFDocument(PDFParser(fp))
+        page_count=resolve1(document.catalog["Pages"]).get("Count",0)
+        selected=set(select_pages(page_count,first_pages,last_pages))
+
+        resource_manager=PDFResourceManager()
+        texts=[]
+        for i,page in enumerate(PDFPage.create_pages(document)):
+            if i not in selected:
+                continue
+
+            # same layout analysis as pdfminer's extract_text, but one page at a time
+            output=io.StringIO()
+            converter=TextConverter(resource_manager,output,laparams=LAParams())
+            PDFPageInterpreter(resource_manager,converter).process_page(page)
+            converter.close()
+            texts.append(output.getvalue())
+
+    return texts
+
+
+def pypdfium2_pages(pdf,first_pages=None,last_pages=None):
+    """
+    EXTRACT THE TEXT OF EVERY SELECTED PAGE WITH PYPDFIUM2
+    :param pdf: Content of the pdf in bytes or its path
+    :type pdf: bytes or string
+    :return: list of page texts in string
+    """
+    document=pypdfium2.PdfDocument(pdf)
+    try:
+        texts=[]
+        for i in select_pages(len(document),first_pages,last_pages):
+            page=document[i]
+            textpage=page.get_textpage()
+            texts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return texts
+    finally:
+        document.close()
+
+
+def pymupdf_pages(pdf,first_pages=None,last_pages=None):
+    """
+    EXTRACT THE TEXT OF EVERY SELECTED PAGE WITH PYMUPDF
+    :param pdf: Content of the pdf in bytes or its path
+    :type pdf: bytes or string
+    :return: list of page texts in string
+    """
+    document=pymupdf.open(stream=pdf,filetype="pdf") if isinstance(pdf,bytes) else pymupdf.open(pdf)
+    with document:
+        return [document[i].get_text() for i in select_pages(document.page_count,first_pages,last_pages)]
+
+
+BACKENDS={"pdfminer":pdfminer_pages,"pypdfium2":pypdfium2_pages,"pymupdf":pymupdf_pages}
+
+
+def available_backends():
+    """
+    NAMES OF THE BACKENDS THAT ARE INSTALLED, IN ORDER OF PREFERENCE
+    :return: list of strings
+    """
+    installed={"pdfminer":True,"pypdfium2":pypdfium2 is not None,"pymupdf":pymupdf is not None}
+    return [name for name in PREFERENCE if installed[name]]
+
+
+def default_backend():
+    """
+    THE FASTEST INSTALLED BACKEND
+    :return: name of the backend in string
+    """
+    return available_backends()[0]
+
+
+def backend_version(name):
+    """
+    VERSION STRING OF A BACKEND, E.G. "pymupdf-1.24.10". TEXT EXTRACTED WITH DIFFERENT VERSIONS IS NOT INTERCHANGEABLE
+    :param name: name of the backend
+    :type name: string
+    :return: string
+    """
+    try:
+        return "{}-{}".format(name,version(PACKAGES[name]))
+    except PackageNotFoundError:
+        return "{}-unknown".format(name)
+
+
+def extract_pages(pdf,backend=None,first_pages=None,last_pages=None):
+    """
+    EXTRACT THE TEXT OF THE SELECTED PAGES OF A PDF. IF THE BACKEND FAILS ON THE PDF, PDFMINER IS TRIED BEFORE GIVING UP
+    :param pdf: Content of the pdf in bytes or its path
+    :type pdf: bytes or string
+    :param backend: name of the backend, the fastest installed one if None
+    :type backend: string
+    :param first_pages: Number of pages to take from the start. All pages if both first_pages and last_pages are None
+    :type first_pages: int
+    :param last_pages: Number of pages to take from the end
+    :type last_pages: int
+    :return: Tuple of (name of the backend that extracted the text, list of page texts)
+    """
+    backend=backend or default_backend()
+
+    try:
+        return backend,BACKENDS[backend](pdf,first_pages,last_pages)
+    except Exception:
+        if backend=="pdfminer":
+            raise
+
+    return "pdfminer",pdfminer_pages(pdf,first_pages,last_pages)
+
+
+def benchmark(directory,first_pages=None,last_pages=None):
+    """
+    COMPARE THE THROUGHPUT AND THE LINK RECALL OF ALL THE INSTALLED BACKENDS ON A DIRECTORY OF PDFS. RECALL IS MEASURED AGAINST THE LINKS THAT
+    PDFMINER FINDS IN THE FULL TEXT
+    :param directory: directory containing the pdfs
+    :type directory: string
+    :param first_pages: see select_pages
+    :type first_pages: int
+    :param last_pages: see select_pages
+    :type last_pages: int
+    :return: Dictionary of backend name to dict of results
+    """
+    from link_matcher import find_links
+
+    pdfs=[]
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(".pdf"):
+            with open(os.path.join(directory,name),"rb") as f:
+                pdfs.append(f.read())
+
+    # reference links, full text with pdfminer
+    reference=[]
+    for pdf in pdfs:
+        try:
+            reference.append({link.url for link in find_links("\n".join(pdfminer_pages(pdf)))})
+        except Exception:
+            reference.append(set())
+
+    results={}
+    for name in available_backends():
+        found=0
+        errors=0
+        pages=0
+        start=time.perf_counter()
+        for pdf,links in zip(pdfs,reference):
+            try:
+                texts=BACKENDS[name](pdf,first_pages,last_pages)
+            except Exception:
+                errors+=1
+                continue
+            pages+=len(texts)
+            found+=len(links & {link.url for link in find_links("\n".join(texts))})
+        elapsed=time.perf_counter()-start
+
+        total=sum(len(links) for links in reference)
+        results[name]={"docs_per_sec":len(pdfs)/elapsed,"pages_per_sec":pages/elapsed,"errors":errors,"recall":found/total if total else 1.0}
+
+    return results
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Compare the pdf text backends on a directory of pdfs")
+    arg_parser.add_argument("directory")
+    arg_parser.add_argument("--first",type=int,default=None,help="only extract the first N pages")
+    arg_parser.add_argument("--last",type=int,default=None,help="only extract the last N pages")
+    args=arg_parser.parse_args()
+
+    print("{:<24}{:>10}{:>11}{:>8}{:>8}".format("backend","docs/s","pages/s","errors","recall"))
+    for name,r in benchmark(args.directory,args.first,args.last).items():
+        print("{:<24}{:>10.2f}{:>11.1f}{:>8}{:>8.3f}".format(backend_version(name),r["docs_per_sec"],r["pages_per_sec"],r["errors"],r["recall"]))
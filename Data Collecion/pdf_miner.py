@@ -1,116 +1,483 @@
 from database_operations import query_by_field_exists, update_collection_one, update_collection_many,query_by_conference, get_collection
-from tqdm import tqdm, trange
-from pdfminer.high_level import extract_text
+from tqdm import tqdm
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdftypes import resolve1
+from pdf_backends import extract_pages, default_backend, backend_version
+from text_cache import pdf_hash, cache_key, load_pages, store_pages, append_index, INDEX_FILE
+from link_matcher import find_links
 import requests
-import re
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
 from requests.exceptions import ConnectionError,HTTPError
 from opnieuw import RetryException, retry
-from  concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from worker_pool import RecyclingPool, WorkerTimeout, WorkerMemoryExceeded, WorkerDied
 from functools import partial
-from miniutils import parallel_progbar
+from collections import Counter
+
+# pdfs larger than this are spilled to a temporary file instead of being kept in memory
+MAX_MEMORY_PDF=16*1024*1024
+
+# limits for a single pdf in the extraction processes, pdfs going over them are quarantined
+PDF_TIMEOUT=120
+PDF_MEMORY_LIMIT=2*1024*1024*1024
+
+# extraction processes are replaced after this many pdfs or once their peak memory goes over this
+WORKER_MAX_TASKS=200
+WORKER_MAX_RSS=1024*1024*1024
+
+# seconds a download may wait for the server, like the other scrapers
+DOWNLOAD_TIMEOUT=30
+
+# seconds the matching stage waits for the next pdf before it gives up on the ones still outstanding
+RESULT_TIMEOUT=30*60
+
+# failures that are caused by the pdf itself, retrying them in the next run would only stall it again
+QUARANTINE_ERRORS=(WorkerTimeout,WorkerMemoryExceeded,WorkerDied)
 
 
 @retry(retry_on_exceptions=(RetryException,ConnectionError,HTTPError),max_calls_total=5,retry_window_after_first_call_in_seconds=30)
-def get_pdf(url,filename="file.pdf"):
+def get_pdf(url,max_memory=MAX_MEMORY_PDF):
     """
-    SAVE PDF FILE FROM THE URL WITH REQUESTS AND SAVE IT AS
+    DOWNLOAD A PDF FILE INTO MEMORY. IF IT GROWS LARGER THAN max_memory, THE REST OF IT IS STREAMED INTO A TEMPORARY FILE INSTEAD
     :param url: URL of the pdf.
     :type url: String
-    :param filename: Name of the file being saved
-    :type filename: String
-    :return: path of the saved file in string
+    :param max_memory: Size in bytes above which the pdf is spilled to disk
+    :type max_memory: int
+    :return: Content of the pdf in bytes, or the path of the temporary file in string if it was spilled
     """
 
-    # load the file from requests
-    response=requests.get(url)
+    # stream the file from requests so large files never have to be in memory completely
+    with requests.get(url,stream=True,timeout=DOWNLOAD_TIMEOUT) as response:
+        buffer=io.BytesIO()
+        spilled=None
 
-    # save it by reading the content of the pdf file as a binary
-    with open(filename,"wb") as f:
-        f.write(response.content)
+        for chunk in response.iter_content(chunk_size=65536):
+            if spilled is None and buffer.tell()+len(chunk)>max_memory:
+                # too large, move what we have to a temporary file and keep writing there
+                spilled=tempfile.NamedTemporaryFile(suffix=".pdf",delete=False)
+                spilled.write(buffer.getbuffer())
+                buffer=None
 
+            if spilled is None:
+                buffer.write(chunk)
+            else:
+                spilled.write(chunk)
 
-    return filename
+    if spilled is None:
+        return buffer.getvalue()
 
+    spilled.close()
+    return spilled.name
 
-def read_pdf(document,pattern,collection):
+
+def save_pdf(pdf,filename):
     """
-    READ A PDF FILE SEARCH FOR LINKS USING REGEX, UPDATE MONGODB
-    :param document: The Document we are updating
-    :type document: Dictionary
-    :param pattern: Compiled regex pattern object for string searches
-    :type pattern: re.Pattern object
-    :param collection: MongoDB collection object
-    :type collection: MongoDB.Collection
+    PERSIST A DOWNLOADED PDF
+    :param pdf: Content of the pdf in bytes or the path of the temporary file it was spilled to, as returned by get_pdf
+    :type pdf: bytes or string
+    :param filename: Name of the file being saved
+    :type filename: String
     """
-    #print(document)
-    pdf_list=document.get("PDF", [])
-
-    if not type(pdf_list)==list:
-        pdf_list=[pdf_list]
+    if isinstance(pdf,bytes):
+        with open(filename,"wb") as f:
+            f.write(pdf)
+    else:
+        shutil.copyfile(pdf,filename)
 
 
-    # Can be multiple PDF links, if so go through all of them
-    for link in pdf_list:
-        # get the pdf file and extract text form the file using pdfminer
-        pdf_filename = get_pdf(link,filename="PDFs/{}.pdf".format(str(document['_id'])))
-        # pdfminer to get the pdf in string form
-        text = extract_text(pdf_filename)
+def open_pdf(pdf):
+    """
+    FILE OBJECT FOR A DOWNLOADED PDF
+    :param pdf: Content of the pdf in bytes or the path of the temporary file it was spilled to, as returned by get_pdf
+    :type pdf: bytes or string
+    :return: binary file object
+    """
+    if isinstance(pdf,bytes):
+        return io.BytesIO(pdf)
+    return open(pdf,"rb")
 
-        # get all link matches by using regex. Prevent duplication by converting to set
-        matches_list = list(set(re.findall(pattern, text)))
 
-        # Create an update dict
-        update_dict = {"PDF_SourceCode": matches_list}
-        update_dict["id"] = document["_id"]
+def annotation_links(fp):
+    """
+    GET THE URIS OF ALL THE LINK ANNOTATIONS IN A PDF. THESE ARE READ STRAIGHT FROM THE PAGE DICTIONARIES, SO NO LAYOUT ANALYSIS IS NEEDED
+    :param fp: binary file object of the pdf
+    :type fp: file object
+    :return: list of uris in string
+    """
+    uris=[]
 
-        # update the file
-        #update_collection_one(update_dict, collection=collection)
-        print(update_dict)
+    document=PDFDocument(PDFParser(fp))
+    for page in PDFPage.create_pages(document):
+        for annot in resolve1(page.annots) or []:
+            annot=resolve1(annot)
+            if not isinstance(annot,dict):
+                continue
 
-    # for updating progress bar
-    return 1
+            # links store their target in the action dictionary of the annotation
+            action=resolve1(annot.get("A"))
+            if isinstance(action,dict):
+                uri=resolve1(action.get("URI"))
+                if isinstance(uri,bytes):
+                    uri=uri.decode("utf-8",errors="ignore")
+                if uri:
+                    uris.append(uri)
 
+    return uris
 
 
-def extract_sourcecode(process_documents):
+def read_pdf(pdf,annotations_first=False,backend=None,first_pages=None,last_pages=None,cache_dir=None):
     """
-    MINE GITHUB/GITLAB/BITBUCKET/SOURCEFORGE LINKS FROM PDF FILES. GOES THROUGH DOCUMENTS THAT HAVE A PDF ATTRIBUTE AND IT CONTAINS AN ELEMENT
-    :param process_documents: documents to update with this function
-    :type process_documents: Tuple of form (proces_n,list of documents)
+    READ THE PART OF A PDF THAT IS SEARCHED FOR LINKS. RUNS IN THE EXTRACTION PROCESSES
+    :param pdf: Content of the pdf in bytes or the path of the temporary file it was spilled to, as returned by get_pdf
+    :type pdf: bytes or string
+    :param annotations_first: Only use the link annotations if any of them is a source code link, and fall back to the full text otherwise
+    :type annotations_first: Boolean
+    :param backend: Name of the text extraction backend in pdf_backends.py, the fastest installed one if None
+    :type backend: string
+    :param first_pages: Only extract the text of this many pages from the start (and last_pages from the end)
+    :type first_pages: int
+    :param last_pages: Only extract the text of this many pages from the end (and first_pages from the start)
+    :type last_pages: int
+    :param cache_dir: Directory of the text cache (see text_cache.py). Extractions are read from and stored in it if given
+    :type cache_dir: string
+    :return: Tuple of (where the links were found, "annotation" or the name of the text backend, the text to search in string, and the key of the text in the cache or None)
     """
+    digest=pdf_hash(pdf) if cache_dir else None
 
-    documents=process_documents[1]
+    if annotations_first:
+        key=cache_key(digest,"annotations-"+backend_version("pdfminer")) if cache_dir else None
+        uris=load_pages(key,cache_dir) if cache_dir else None
 
-    #connection update to make update faster
-    connection=get_collection()
+        if uris is None:
+            with open_pdf(pdf) as fp:
+                uris=annotation_links(fp)
+            # all the uris are cached, so a rescan with a different matcher still sees them
+            if cache_dir:
+                store_pages(key,uris,cache_dir)
+
+        uris=[uri for uri in uris if find_links(uri)]
+        if uris:
+            return "annotation","\n".join(uris),key
+
+    backend=backend or default_backend()
+    key=cache_key(digest,backend_version(backend),first_pages,last_pages) if cache_dir else None
+    pages=load_pages(key,cache_dir) if cache_dir else None
 
-    # regex pattern to check for open source links.
-    pattern = re.compile(r"((?:(?:http|https):\/\/)?(?:www.)?(?:github|gitlab|bitbucket|sourceforge)\.[a-z]{2,6}\b(?:[-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
+    if pages is None:
+        used,pages=extract_pages(pdf,backend,first_pages,last_pages)
+        # the backend failed and pdfminer extracted the text instead, store it under the key of pdfminer
+        if used!=backend:
+            backend=used
+            key=cache_key(digest,backend_version(backend),first_pages,last_pages) if cache_dir else None
+        if cache_dir:
+            store_pages(key,pages,cache_dir)
 
-    #since pattern and connection are the same for all threads
-    func=partial(read_pdf,pattern=pattern,collection=connection)
+    return backend,"\n".join(pages),key
 
-    with tqdm(total=len(documents),position=process_documents[0]) as pbar:
-        #create threads and map them with the available documents
-        with ThreadPoolExecutor(max_workers=8) as exectuor:
-            results={exectuor.submit(func,doc): doc for doc in documents}
-            ''''
-            for future in as_completed(results):
-                pbar.update(1)
-                '''
-    return 1
 
-def create_chunk(list,n):
+def download_stage(jobs,downloaded,results):
     """
-    CREATE A Iterator iterating n-sized chunk from the list
+    DOWNLOADER THREAD. TAKES (DOCUMENT ID, LINK, FILENAME) JOBS UNTILL NONE ARE LEFT AND PUTS THE DOWNLOADED PDFS ON THE DOWNLOADED QUEUE.
+    THE QUEUE IS BOUNDED, SO DOWNLOADS PAUSE WHEN THE EXTRACTION STAGE FALLS BEHIND
+    :param jobs: Queue of (document id, link, filename) tuples. The pdf is only saved to filename if it is not None
+    :type jobs: queue.Queue
+    :param downloaded: Bounded queue of (document id, link, pdf) tuples for the extraction stage
+    :type downloaded: queue.Queue
+    :param results: Queue of (document id, link, (source, text), error) tuples for the matching stage. Failed downloads go straight there
+    :type results: queue.Queue
+    """
+    while True:
+        try:
+            doc_id,link,filename=jobs.get_nowait()
+        except queue.Empty:
+            return
+
+        pdf=None
+        try:
+            pdf=get_pdf(link)
+            if filename:
+                save_pdf(pdf,filename)
+            downloaded.put((doc_id,link,pdf))
+        except Exception as e:
+            # don't leave the temporary file behind if saving failed
+            if isinstance(pdf,str):
+                os.remove(pdf)
+            results.put((doc_id,link,None,"download: {!r}".format(e)))
+
+
+def extraction_done(future,doc_id,link,pdf,results,in_flight,timings):
+    """
+    CALLBACK FOR A FINISHED TEXT EXTRACTION, PASSES THE (SOURCE, TEXT) TUPLE (OR THE ERROR) ON TO THE MATCHING STAGE AND RECORDS HOW LONG IT TOOK.
+    THE MATCHING STAGE WAITS FOR ONE RESULT PER PDF, SO ONE IS PUT EVEN IF THE CLEANUP HERE FAILS
+    """
+    read=None
+    error=None
+    try:
+        in_flight.release()
+
+        try:
+            read=future.result()
+        except QUARANTINE_ERRORS as e:
+            error="quarantine: {!r}".format(e)
+        except Exception as e:
+            error="extract: {!r}".format(e)
+
+        timings.append((future.runtime,doc_id,link))
+
+        # remove the temporary file of a spilled pdf
+        if not isinstance(pdf,bytes):
+            os.remove(pdf)
+    except Exception as e:
+        error=error or "extract: {!r}".format(e)
+    finally:
+        results.put((doc_id,link,None if error else read,error))
+
+
+def extraction_stage(downloaded,results,executor,in_flight,timings,reader=read_pdf):
+    """
+    FEEDER THREAD FOR THE EXTRACTION PROCESS POOL. STOPS WHEN IT GETS None FROM THE DOWNLOADED QUEUE
+    :param downloaded: Bounded queue of (document id, link, pdf) tuples from the download stage
+    :type downloaded: queue.Queue
+    :param results: Queue of (document id, link, (source, text), error) tuples for the matching stage
+    :type results: queue.Queue
+    :param executor: Process pool running the text extraction
+    :type executor: worker_pool.RecyclingPool
+    :param in_flight: Semaphore limiting the number of pdfs submitted to the process pool
+    :type in_flight: threading.Semaphore
+    :param timings: List the (seconds, document id, link) of every extraction is appended to
+    :type timings: list
+    :param reader: read_pdf, possibly with its options bound with functools.partial
+    :type reader: function
+    """
+    while True:
+        item=downloaded.get()
+        if item is None:
+            return
+
+        doc_id,link,pdf=item
+
+        # wait for a free slot so pdfs don't pile up inside the process pool
+        in_flight.acquire()
+        try:
+            future=executor.submit(reader,pdf)
+        except Exception as e:
+            # the pdf never reaches the callback, so its slot, temporary file and result are handled here
+            in_flight.release()
+            if not isinstance(pdf,bytes):
+                os.remove(pdf)
+            results.put((doc_id,link,None,"extract: {!r}".format(e)))
+            continue
+        future.add_done_callback(partial(extraction_done,doc_id=doc_id,link=link,pdf=pdf,results=results,in_flight=in_flight,timings=timings))
+
+
+def latency_report(timings,top=10):
+    """
+    PRINT THE TAIL LATENCY OF THE TEXT EXTRACTION AND THE PDFS THAT TOOK THE LONGEST
+    :param timings: (seconds, document id, link) of every extraction
+    :type timings: list of tuples
+    :param top: Number of slowest pdfs to list
+    :type top: int
+    :return: Dictionary of percentile name to seconds
+    """
+    if not timings:
+        return {}
+
+    timings=sorted(timings,key=lambda t:t[0])
+    seconds=[t[0] for t in timings]
+    total=sum(seconds)
+
+    report={name:seconds[min(len(seconds)-1,int(q*len(seconds)))] for name,q in (("p50",0.5),("p90",0.9),("p99",0.99))}
+    report["max"]=seconds[-1]
+
+    # how much of the extraction time went into the slowest 1% of the pdfs
+    slowest=seconds[-max(1,len(seconds)//100):]
+    print("extraction latency over {} pdfs: ".format(len(seconds))+", ".join("{} {:.2f}s".format(name,value) for name,value in report.items())+
+          ", slowest 1% took {:.0%} of the time".format(sum(slowest)/total if total else 0))
+    for runtime,doc_id,link in reversed(timings[-top:]):
+        print("{:>8.2f}s {} {}".format(runtime,doc_id,link))
 
-    :param list: List to chunk
-    :param n: Size of each chunk
-    :type n: Integer
+    return report
+
+
+def extract_sourcecode(documents,download_workers=8,extract_workers=4,queue_size=32,max_in_flight=None,save_dir=None,annotations_first=False,backend=None,first_pages=None,last_pages=None,cache_dir=None,
+                       timeout=PDF_TIMEOUT,memory_limit=PDF_MEMORY_LIMIT,max_tasks=WORKER_MAX_TASKS,max_rss=WORKER_MAX_RSS,result_timeout=RESULT_TIMEOUT,write=True):
+    """
+    MINE GITHUB/GITLAB/BITBUCKET/SOURCEFORGE LINKS FROM PDF FILES. GOES THROUGH DOCUMENTS THAT HAVE A PDF ATTRIBUTE AND IT CONTAINS AN ELEMENT.
+    RUNS AS A PIPELINE OF THREE STAGES: DOWNLOADER THREADS, A PROCESS POOL FOR THE TEXT EXTRACTION, AND THIS THREAD FOR THE MATCHING AND THE DATABASE WRITES.
+    A PDF THAT GOES OVER THE TIME OR MEMORY LIMIT, OR CRASHES ITS PROCESS, IS QUARANTINED: IT IS RECORDED IN PDF_Quarantine OF THE PAPER SO IT IS NOT TRIED AGAIN
+    :param documents: documents to update with this function, with the _id and PDF fields
+    :type documents: list of Dictionaries
+    :param download_workers: Number of downloader threads
+    :type download_workers: int
+    :param extract_workers: Number of text extraction processes
+    :type extract_workers: int
+    :param queue_size: Number of downloaded pdfs that can wait for extraction before the downloads pause
+    :type queue_size: int
+    :param max_in_flight: Number of pdfs submitted to the process pool at a time. Twice the number of processes if not given
+    :type max_in_flight: int
+    :param save_dir: Directory to keep the downloaded pdfs in (e.g. "PDFs"). The pdfs are only processed in memory if not given
+    :type save_dir: String
+    :param annotations_first: Look for the links in the link annotations first, and only run the full text extraction for pdfs without a matching annotation. Much faster, see read_pdf
+    :type annotations_first: Boolean
+    :param backend: Name of the text extraction backend in pdf_backends.py, the fastest installed one if None
+    :type backend: string
+    :param first_pages: Only extract the text of this many pages from the start (and last_pages from the end). All pages if both are None
+    :type first_pages: int
+    :param last_pages: Only extract the text of this many pages from the end
+    :type last_pages: int
+    :param cache_dir: Directory of the text cache. If given, the extracted text is stored there so the links can be searched again later with `python text_cache.py rescan`
+    :type cache_dir: string
+    :param timeout: Seconds the extraction of a single pdf may take, None for no limit
+    :type timeout: float
+    :param memory_limit: Memory in bytes an extraction process may use, None for no limit
+    :type memory_limit: int
+    :param max_tasks: Number of pdfs after which an extraction process is replaced, None to keep it
+    :type max_tasks: int
+    :param max_rss: Peak memory in bytes after which an extraction process is replaced, None to keep it
+    :type max_rss: int
+    :param result_timeout: Seconds to wait for the next pdf to come out of the pipeline. The pdfs still outstanding then are reported as failed
+    :type result_timeout: float
+    :param write: Whether to write the matches to the database or just print them
+    :type write: Boolean
+    :return: List of (document id, link, error) tuples for every pdf that failed. Documents with a failed pdf are not updated, so they are retried in the next run
     """
 
-    for i in range(0, len(list), n):
-        yield (i//n,list[i:i + n])
+    #connection update to make update faster
+    connection=get_collection()
+
+    jobs=queue.Queue()
+    downloaded=queue.Queue(maxsize=queue_size)
+    results=queue.Queue()
+
+    # number of pdfs left and links found for every document, with where they were found
+    pending={}
+    matches={}
+    outstanding=Counter()
+
+    for document in documents:
+        pdf_list=document.get("PDF", [])
+
+        if not type(pdf_list)==list:
+            pdf_list=[pdf_list]
+
+        if not pdf_list:
+            continue
+
+        # Can be multiple PDF links, if so go through all of them
+        for i,link in enumerate(pdf_list):
+            filename=None
+            if save_dir:
+                filename=os.path.join(save_dir,"{}.pdf".format(document['_id']) if i==0 else "{}_{}.pdf".format(document['_id'],i))
+            jobs.put((document["_id"],link,filename))
+            outstanding[document["_id"],link]+=1
+
+        pending[document["_id"]]=len(pdf_list)
+        matches[document["_id"]]={}
+
+    total=jobs.qsize()
+    errors=[]
+    failed=set()
+    quarantined={}
+    timings=[]
+
+    in_flight=threading.Semaphore(max_in_flight or 2*extract_workers)
+    reader=partial(read_pdf,annotations_first=annotations_first,backend=backend,first_pages=first_pages,last_pages=last_pages,cache_dir=cache_dir)
+
+    # index of the cached text of every pdf
+    if cache_dir:
+        os.makedirs(cache_dir,exist_ok=True)
+        index=open(os.path.join(cache_dir,INDEX_FILE),"a")
+
+    with RecyclingPool(extract_workers,timeout=timeout,memory_limit=memory_limit,max_rss=max_rss,max_tasks=max_tasks) as executor:
+        downloaders=[threading.Thread(target=download_stage,args=(jobs,downloaded,results),daemon=True) for _ in range(download_workers)]
+        feeder=threading.Thread(target=extraction_stage,args=(downloaded,results,executor,in_flight,timings,reader),daemon=True)
+
+        for thread in downloaders+[feeder]:
+            thread.start()
+
+        with tqdm(total=len(pending)) as pbar:
+            # every pdf ends up in the results queue exactly once, either with its text or with the error of the stage it failed in
+            for _ in range(total):
+                try:
+                    doc_id,link,read,error=results.get(timeout=result_timeout)
+                except queue.Empty:
+                    # a stage is stuck, the documents of the pdfs that never came out are left for the next run
+                    stalled=[(doc_id,link,"stalled: no result in {} seconds".format(result_timeout)) for (doc_id,link),count in outstanding.items() for _ in range(count)]
+                    errors.extend(stalled)
+                    break
+
+                outstanding[doc_id,link]-=1
+                if not outstanding[doc_id,link]:
+                    del outstanding[doc_id,link]
+
+                if not error:
+                    # get all source code links, see link_matcher.py. Prevent duplication by using a dict, a link found in an annotation of one pdf and the text of another counts as annotation
+                    try:
+                        source,text,key=read
+                        if cache_dir:
+                            append_index(index,doc_id,link,key,source)
+
+                        for match in find_links(text):
+                            if matches[doc_id].get(match.url,"text")!="annotation":
+                                matches[doc_id][match.url]=source
+                    except Exception as e:
+                        error="match: {!r}".format(e)
+
+                if error:
+                    errors.append((doc_id,link,error))
+                    failed.add(doc_id)
+                    if error.startswith("quarantine"):
+                        quarantined.setdefault(doc_id,[]).append({"link":link,"reason":error})
+                    pbar.set_postfix(errors=len(errors))
+
+                pending[doc_id]-=1
+
+                # all the pdfs of this document are done
+                if pending[doc_id]==0:
+                    if doc_id not in failed:
+                        update_dict = {"PDF_SourceCode": sorted(matches[doc_id])}
+                        update_dict["PDF_SourceCode_found_in"] = [{"link":match,"source":matches[doc_id][match]} for match in update_dict["PDF_SourceCode"]]
+                        update_dict["id"] = doc_id
+
+                        if write:
+                            update_collection_one(update_dict, collection=connection)
+                        else:
+                            print(update_dict)
+
+                    # the offending pdfs are recorded so that the next runs skip this document
+                    elif doc_id in quarantined:
+                        update_dict = {"PDF_Quarantine": quarantined.pop(doc_id), "id": doc_id}
+
+                        if write:
+                            update_collection_one(update_dict, collection=connection)
+                        else:
+                            print(update_dict)
+
+                    del matches[doc_id]
+                    pbar.update(1)
+
+        # all the downloads are done by now, stop the feeder. After a stall the threads may never finish, they are daemons and are left behind
+        if not outstanding:
+            for thread in downloaders:
+                thread.join()
+            downloaded.put(None)
+            feeder.join()
+        recycled=executor.recycled
+
+    if cache_dir:
+        index.close()
+
+    latency_report(timings)
+    print("extraction processes replaced: "+", ".join("{} {}".format(count,reason) for reason,count in recycled.items()))
+
+    return errors
+
 
 if __name__=="__main__":
 
@@ -118,8 +485,8 @@ if __name__=="__main__":
     #c=query_by_field_exists("PDF")
     c=query_by_conference("conf/chi")
     for doc in c:
-        # check if this document has been scraped before,  if so the dictionary has a PDF_SourceCode element
-        if doc.get("PDF_SourceCode",1)==1:
+        # check if this document has been scraped before,  if so the dictionary has a PDF_SourceCode element. Documents with a quarantined pdf are skipped
+        if doc.get("PDF_SourceCode",1)==1 and not doc.get("PDF_Quarantine"):
             if doc.get("PDF"):
                 document={}
                 document["_id"]=doc["_id"]
@@ -129,15 +496,8 @@ if __name__=="__main__":
 
     print(len(docs))
 
-    with ProcessPoolExecutor(8) as executor:
-        results=executor.map(extract_sourcecode,list(create_chunk(docs,1000)))
-
-    """
-    
-    print(len(docs))
-    conn=get_collection()
-    pattern = re.compile(
-        r"((?:(?:http|https):\/\/)?(?:www.)?(?:github|gitlab|bitbucket|sourceforge)\.[a-z]{2,6}\b(?:[-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
+    errors=extract_sourcecode(docs,annotations_first=True)
 
-    extract_sourcecode(docs)
-    """
\ No newline at end of file
+    for doc_id,link,error in errors:
+        print(doc_id,link,error)
+    print(f"{len(errors)} pdfs failed")
@@ -0,0 +1,382 @@
+"""SHARED RATE LIMITING FOR ALL THE SCRAPERS. EVERY HOST (OR API KEY) GETS A TOKEN BUCKET, AND THE BUCKETS LIVE IN A SINGLE LOCAL SERVER PROCESS SO THAT
+SEVERAL SCRAPING PROCESSES ON THE SAME MACHINE SHARE THE SAME LIMITS. START THE SERVER WITH `python rate_limiting.py`; IF IT IS NOT RUNNING, EACH PROCESS FALLS BACK TO ITS OWN BUCKETS."""
+import time
+import threading
+import functools
+from email.utils import parsedate_to_datetime
+from urllib.parse import urljoin, urlparse
+from multiprocessing.managers import BaseManager
+from requests.exceptions import TooManyRedirects
+
+# most redirects request_throttled follows, the same as requests
+MAX_REDIRECTS=30
+
+# address of the local rate limit server and the key used to authenticate with it
+RATE_LIMIT_ADDRESS=("127.0.0.1",50505)
+RATE_LIMIT_AUTHKEY=b"jcdl-rate-limits"
+
+# (max_calls, period in seconds) for every host or API key we know the limits of
+DEFAULT_LIMITS={
+    "serpapi.com":(4,3),
+    "api.elsevier.com":(9,1),
+    # 100 calls per 5 minutes
+    "api.semanticscholar.org":(1,3),
+    "api.labs.cognitive.microsoft.com":(1,2),
+    "api.github.com":(5000,3600),
+    # points of the GraphQL api, a query of 100 repositories costs about one
+    "api.github.com/graphql":(5000,3600),
+    "gitlab.com":(600,60),
+    "doi.org":(50,1),
+}
+
+# limit used for the publisher sites and every other host without a documented limit
+FALLBACK_LIMIT=(2,1)
+
+
+class TokenBucket:
+    """
+    TOKEN BUCKET IMPLEMENTED AS A GENERIC CELL RATE ALGORITHM: INSTEAD OF COUNTING TOKENS WE KEEP THE THEORETICAL TIME AT WHICH THE NEXT CALL IS ALLOWED.
+    THE RATE ADAPTS TO THE RESPONSES OF THE HOST: IT FOLLOWS THE RATE LIMIT HEADERS WHEN THEY ARE SENT, BACKS OFF ON 429 AND SLOWLY CLIMBS BACK TO THE CONFIGURED CEILING OTHERWISE
+    """
+
+    def __init__(self,max_calls,period):
+        """
+        :param max_calls: Number of calls allowed in a period, also the size of the allowed burst
+        :type max_calls: int
+        :param period: Length of the period in seconds
+        :type period: float
+        """
+        self.capacity=max_calls
+        self.ceiling=max_calls/period
+        self.rate=self.ceiling
+
+        # theoretical arrival time of the next call and the time before which no calls are allowed at all
+        self.tat=time.monotonic()
+        self.blocked_until=0
+
+    def reserve(self,cost=1):
+        """
+        RESERVE TOKENS FOR A CALL
+        :param cost: Number of tokens (API calls) to reserve
+        :type cost: int
+        :return: Seconds the caller has to wait before making the call
+        """
+        now=time.monotonic()
+
+        # how far ahead of the steady rate a burst is allowed to run
+        tolerance=(self.capacity-1)/self.rate
+
+        self.tat=max(self.tat,now,self.blocked_until+tolerance)
+        wait=max(0,self.tat-tolerance-now)
+        self.tat+=cost/self.rate
+
+        return wait
+
+    def block(self,seconds):
+        """
+        DO NOT ALLOW ANY CALLS FOR THE GIVEN AMOUNT OF TIME
+        :param seconds: Number of seconds to block
+        :type seconds: float
+        """
+        self.blocked_until=max(self.blocked_until,time.monotonic()+seconds)
+
+    def observe(self,status,headers):
+        """
+        ADAPT THE BUCKET TO A RESPONSE OF THE HOST
+        :param status: HTTP status code of the response
+        :type status: int
+        :param headers: Response headers with lowercase names
+        :type headers: Dict
+        """
+        retry_after=parse_retry_after(headers.get("retry-after"))
+        remaining=headers.get("x-ratelimit-remaining",headers.get("ratelimit-remaining"))
+        reset=parse_reset(headers.get("x-ratelimit-reset",headers.get("ratelimit-reset")))
+
+        if retry_after is not None:
+            self.block(retry_after)
+
+        if remaining is not None and reset is not None:
+            remaining=int(remaining)
+            if remaining<1:
+                # budget exhausted, nothing is allowed untill the window resets
+                self.block(reset)
+            else:
+                # spread whatever is left of the budget evenly over the rest of the window
+                self.rate=remaining/max(reset,1)
+        elif status==429:
+            # no headers to go by, halve the rate (but never below a call per minute) and wait a full interval
+            self.rate=max(self.rate/2,1/60)
+            if retry_after is None:
+                self.block(1/self.rate)
+        else:
+            # additive increase back towards the configured ceiling
+            self.rate=min(self.ceiling,self.rate+self.ceiling/16)
+
+
+def parse_retry_after(value):
+    """
+    PARSE A RETRY-AFTER HEADER, WHICH IS EITHER A NUMBER OF SECONDS OR A HTTP DATE
+    :param value: value of the header
+    :type value: string or None
+    :return: Number of seconds to wait or None
+    """
+    if value is None:
+        return None
+
+    try:
+        return max(0,float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0,parsedate_to_datetime(value).timestamp()-time.time())
+    except (TypeError,ValueError):
+        return None
+
+
+def parse_reset(value):
+    """
+    PARSE A RATE LIMIT RESET HEADER. GITHUB SENDS THE EPOCH TIME OF THE RESET, OTHER HOSTS SEND THE NUMBER OF SECONDS LEFT
+    :param value: value of the header
+    :type value: string or None
+    :return: Number of seconds untill the limit resets or None
+    """
+    if value is None:
+        return None
+
+    try:
+        value=float(value)
+    except ValueError:
+        return None
+
+    # anything this large can only be a timestamp
+    if value>1e9:
+        value-=time.time()
+
+    return max(0,value)
+
+
+class RateLimits:
+    """
+    ALL THE TOKEN BUCKETS, KEYED BY HOST OR API KEY. THIS IS THE OBJECT THAT IS SHARED THROUGH THE RATE LIMIT SERVER
+    """
+
+    def __init__(self,limits=None):
+        """
+        :param limits: (max_calls, period) for each key. DEFAULT_LIMITS if not given
+        :type limits: Dict
+        """
+        self.limits=dict(DEFAULT_LIMITS if limits is None else limits)
+        self.buckets={}
+        self.lock=threading.Lock()
+
+    def _bucket(self,key):
+        bucket=self.buckets.get(key)
+        if bucket is None:
+            # keys like "api.github.com#2" (one bucket per API token) get the limit of the host
+            bucket=TokenBucket(*self.limits.get(key,self.limits.get(key.split("#")[0],FALLBACK_LIMIT)))
+            self.buckets[key]=bucket
+        return bucket
+
+    def set_limit(self,key,max_calls,period):
+        """
+        SET (OR RESET) THE LIMIT OF A KEY
+        :param key: host or API key
+        :type key: string
+        :param max_calls: Number of calls allowed in a period
+        :type max_calls: int
+        :param period: Length of the period in seconds
+        :type period: float
+        """
+        with self.lock:
+            self.limits[key]=(max_calls,period)
+            self.buckets[key]=TokenBucket(max_calls,period)
+
+    def reserve(self,key,cost=1):
+        """
+        RESERVE TOKENS FROM THE BUCKET OF A KEY
+        :return: Seconds the caller has to wait before making the call
+        """
+        with self.lock:
+            return self._bucket(key).reserve(cost)
+
+    def observe(self,key,status=200,headers=None):
+        """
+        ADAPT THE BUCKET OF A KEY TO A RESPONSE
+        :param key: host or API key
+        :type key: string
+        :param status: HTTP status code of the response
+        :type status: int
+        :param headers: Response headers
+        :type headers: Dict
+        """
+        headers={k.lower():v for k,v in (headers or {}).items()}
+        with self.lock:
+            self._bucket(key).observe(status,headers)
+
+
+class RateLimitManager(BaseManager):
+    pass
+
+
+# the single instance served by the rate limit server
+_served_limits=RateLimits()
+RateLimitManager.register("rate_limits",callable=lambda:_served_limits)
+
+# the RateLimits object (or proxy to the one in the server) used by this process
+_rate_limits=None
+
+# switched off for offline runs, e.g. benchmarks against recorded pages
+_enabled=True
+
+
+def get_rate_limits():
+    """
+    GET THE RATE LIMITS SHARED BY ALL THE PROCESSES IF THE SERVER IS RUNNING, OR THE RATE LIMITS OF THIS PROCESS IF NOT
+    :return: RateLimits object or a proxy to it
+    """
+    global _rate_limits
+
+    if _rate_limits is None:
+        manager=RateLimitManager(address=RATE_LIMIT_ADDRESS,authkey=RATE_LIMIT_AUTHKEY)
+        try:
+            manager.connect()
+            _rate_limits=manager.rate_limits()
+        except OSError:
+            print("Rate limit server not running, limits only apply to this process")
+            _rate_limits=RateLimits()
+
+    return _rate_limits
+
+
+def disable():
+    """
+    SWITCH OFF ALL THE RATE LIMITING IN THIS PROCESS
+    """
+    global _enabled
+    _enabled=False
+
+
+def host_key(url):
+    """
+    KEY OF THE BUCKET FOR A URL, WHICH IS SIMPLY THE HOST NAME
+    :param url: url of the request
+    :type url: string
+    :return: host name in string
+    """
+    return urlparse(url).netloc.lower()
+
+
+def throttle(key,cost=1):
+    """
+    BLOCK UNTILL THE BUCKET OF THE KEY ALLOWS ANOTHER CALL
+    :param key: host or API key
+    :type key: string
+    :param cost: Number of API calls that are about to be made
+    :type cost: int
+    """
+    if not _enabled:
+        return
+
+    wait=get_rate_limits().reserve(key,cost)
+    if wait>0:
+        time.sleep(wait)
+
+
+def observe_response(key,response):
+    """
+    ADAPT THE BUCKET OF THE KEY TO A REQUESTS RESPONSE
+    :param key: host or API key
+    :type key: string
+    :param response: response of the host
+    :type response: requests.Response object
+    """
+    if _enabled:
+        get_rate_limits().observe(key,response.status_code,dict(response.headers))
+
+
+def request_throttled(session,method,url,max_redirects=MAX_REDIRECTS,**kwargs):
+    """
+    MAKE A REQUEST, FOLLOWING THE REDIRECTS ONE HOP AT A TIME SO THAT EVERY HOST OF THE CHAIN WAITS FOR ITS OWN BUCKET. REQUESTS FOLLOWS THEM ON ITS
+    OWN OTHERWISE, AND A doi.org LINK WOULD REACH THE PUBLISHER WITHOUT EVER BEING THROTTLED FOR IT
+    :param session: session used for the requests
+    :type session: requests.Session object
+    :param method: HTTP method, e.g. "GET" or "HEAD"
+    :type method: string
+    :param url: url of the request
+    :type url: string
+    :param max_redirects: Number of redirects followed before giving up with requests.TooManyRedirects
+    :type max_redirects: int
+    :param kwargs: Extra keyword arguments passed to session.request (headers, stream, timeout etc)
+    :return: requests.Response object of the last hop, its url is where the chain ended
+    """
+    for _ in range(max_redirects+1):
+        host=host_key(url)
+        throttle(host)
+        response=session.request(method,url,allow_redirects=False,**kwargs)
+        observe_response(host,response)
+
+        target=session.get_redirect_target(response)
+        if target is None:
+            return response
+
+        response.close()
+        url=urljoin(response.url,target)
+        # a 303 is followed with a GET, like requests does
+        if response.status_code==303 and method!="HEAD":
+            method="GET"
+
+    raise TooManyRedirects(f"more than {max_redirects} redirects")
+
+
+def observe_github(client,key="api.github.com"):
+    """
+    ADAPT THE GITHUB BUCKET TO THE RATE LIMIT PYGITHUB HAS READ FROM THE HEADERS OF ITS LAST RESPONSE. NOTHING IS DONE BEFORE THE CLIENT HAS HAD A RESPONSE,
+    THE PROPERTIES OF THE CLIENT WOULD CALL get_rate_limit() THEN, SO THE LIMIT IS READ FROM ITS REQUESTER INSTEAD
+    :param client: PyGithub client
+    :type client: github.Github object
+    :param key: key of the bucket used for the token of the client
+    :type key: string
+    """
+    if not _enabled:
+        return
+
+    # (-1, -1) and 0 until the first response
+    requester=client._Github__requester
+    remaining,limit=requester.rate_limiting
+    if limit<0 or not requester.rate_limiting_resettime:
+        return
+
+    headers={"x-ratelimit-remaining":remaining,"x-ratelimit-reset":requester.rate_limiting_resettime}
+    get_rate_limits().observe(key,200,headers)
+
+
+def rate_limited(key,cost=1):
+    """
+    DECORATOR THAT THROTTLES EVERY CALL OF THE FUNCTION WITH THE BUCKET OF THE KEY
+    :param key: host or API key
+    :type key: string
+    :param cost: Number of API calls that the function makes
+    :type cost: int
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            throttle(key,cost)
+            return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+def serve():
+    """
+    RUN THE RATE LIMIT SERVER IN THE FOREGROUND
+    """
+    manager=RateLimitManager(address=RATE_LIMIT_ADDRESS,authkey=RATE_LIMIT_AUTHKEY)
+    server=manager.get_server()
+    print("Serving rate limits on {}:{}".format(*RATE_LIMIT_ADDRESS))
+    server.serve_forever()
+
+
+if __name__=="__main__":
+    serve()
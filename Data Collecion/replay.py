@@ -0,0 +1,376 @@
+"""OFFLINE RECORD/REPLAY OF PUBLISHER PAGES TO BENCHMARK AND REGRESSION TEST THE SITE PARSERS IN scrapers.py WITHOUT HITTING THE LIVE SITES.
+
+A corpus is a directory with a `pages.jsonl` index and a `bodies` folder. Every line of the index is one recorded response:
+    {"url": ..., "status": 200, "headers": {...}, "body": "bodies/<sha1>", "parser": "scrape_cvf"}
+`parser` is only set for the pages the parser was called with, pages fetched on the way (redirects, frames) have it set to null.
+
+Usage:
+    python replay.py record <corpus> <parser> <url> [<url> ...]
+    python replay.py bench <corpus> [--parsers scrape_cvf scrape_ACM] [--repeat 5] [--concurrency 1 4 16]
+"""
+import os
+import io
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import tracemalloc
+from urllib.parse import urljoin, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+import rate_limiting
+import doi_cache
+import scrapers
+
+INDEX_FILE="pages.jsonl"
+BODIES_DIR="bodies"
+
+# headers that describe the transfer rather than the page, they are not valid for the stored (decoded) body
+TRANSFER_HEADERS={"content-encoding","transfer-encoding","content-length","connection","keep-alive"}
+
+
+def load_corpus(corpus):
+    """
+    LOAD THE INDEX AND THE BODIES OF A CORPUS INTO MEMORY
+    :param corpus: path of the corpus directory
+    :type corpus: string
+    :return: Dictionary of url to recorded response dict (with the body as bytes)
+    """
+    pages={}
+
+    with open(os.path.join(corpus,INDEX_FILE)) as f:
+        for line in f:
+            if line.strip():
+                page=json.loads(line)
+                with open(os.path.join(corpus,page["body"]),"rb") as body:
+                    page["content"]=body.read()
+                pages[page["url"]]=page
+
+    return pages
+
+
+def entry_points(pages,parsers=None):
+    """
+    GET THE (PARSER, URL) PAIRS THE CORPUS WAS RECORDED WITH
+    :param pages: corpus loaded with load_corpus
+    :type pages: Dict
+    :param parsers: only include these parsers, all if None
+    :type parsers: list of strings
+    :return: list of (parser name, url) tuples
+    """
+    return [(p["parser"],url) for url,p in pages.items() if p.get("parser") and (not parsers or p["parser"] in parsers)]
+
+
+def build_response(request,page):
+    """
+    CREATE A REQUESTS RESPONSE FROM A RECORDED PAGE
+    :param request: the request that is being answered
+    :type request: requests.PreparedRequest
+    :param page: recorded page, None if the url is not in the corpus
+    :type page: Dict
+    :return: requests.Response object
+    """
+    response=Response()
+    response.request=request
+    response.url=request.url
+
+    if page is None:
+        response.status_code=404
+        response.headers=CaseInsensitiveDict()
+        response.raw=io.BytesIO(b"")
+    else:
+        response.status_code=page["status"]
+        response.headers=CaseInsensitiveDict(page["headers"])
+        response.raw=io.BytesIO(page["content"])
+
+    response.encoding=get_encoding_from_headers(response.headers)
+    response.reason="Replayed"
+    return response
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    TRANSPORT ADAPTER THAT ANSWERS EVERY REQUEST FROM THE CORPUS IN MEMORY. NO SOCKETS ARE INVOLVED, SO TIMINGS ARE PURE PARSING TIME
+    """
+
+    def __init__(self,pages):
+        super().__init__()
+        self.pages=pages
+
+    def send(self,request,**kwargs):
+        response=build_response(request,self.pages.get(request.url))
+        response.connection=self
+        return response
+
+    def close(self):
+        pass
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    TRANSPORT ADAPTER THAT FETCHES FROM THE LIVE SITES AND KEEPS A COPY OF EVERY RESPONSE (INCLUDING REDIRECT HOPS)
+    """
+
+    def __init__(self,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.recorded=[]
+
+    def send(self,request,**kwargs):
+        response=super().send(request,**kwargs)
+
+        headers={k:v for k,v in response.headers.items() if k.lower() not in TRANSFER_HEADERS}
+        # relative redirects would point at the replay server instead of the original site
+        if "Location" in response.headers:
+            headers["Location"]=urljoin(request.url,response.headers["Location"])
+
+        # reading the content here keeps it available for the scraper
+        self.recorded.append({"url":request.url,"status":response.status_code,"headers":headers,"content":response.content})
+        return response
+
+
+def record(corpus,parser,urls):
+    """
+    RUN A PARSER AGAINST THE LIVE SITES AND ADD EVERY PAGE IT FETCHES TO THE CORPUS
+    :param corpus: path of the corpus directory, created if it does not exist
+    :type corpus: string
+    :param parser: name of the parser function in scrapers.py
+    :type parser: string
+    :param urls: urls to call the parser with
+    :type urls: list of strings
+    """
+    os.makedirs(os.path.join(corpus,BODIES_DIR),exist_ok=True)
+
+    adapter=RecordingAdapter()
+    scrapers.session.mount("http://",adapter)
+    scrapers.session.mount("https://",adapter)
+
+    with open(os.path.join(corpus,INDEX_FILE),"a") as index:
+        for url in urls:
+            adapter.recorded=[]
+            try:
+                print(url,getattr(scrapers,parser)(url))
+            except Exception as e:
+                print(url,"failed with",repr(e))
+                continue
+
+            for page in adapter.recorded:
+                content=page.pop("content")
+                page["body"]=os.path.join(BODIES_DIR,hashlib.sha1(content).hexdigest())
+                page["parser"]=parser if page["url"]==url else None
+
+                with open(os.path.join(corpus,page["body"]),"wb") as f:
+                    f.write(content)
+                index.write(json.dumps(page)+"\n")
+
+
+def make_handler(pages):
+    """
+    CREATE A REQUEST HANDLER CLASS FOR THE REPLAY SERVER. THE ORIGINAL URL IS ENCODED IN THE PATH AS /<scheme>/<host>/<path>
+    :param pages: corpus loaded with load_corpus
+    :type pages: Dict
+    """
+
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version="HTTP/1.1"
+
+        def do_GET(self):
+            scheme,_,rest=self.path.lstrip("/").partition("/")
+            page=pages.get(f"{scheme}://{rest}")
+
+            if page is None:
+                self.send_response(404)
+                self.send_header("Content-Length","0")
+                self.end_headers()
+                return
+
+            self.send_response(page["status"])
+            for k,v in page["headers"].items():
+                self.send_header(k,v)
+            self.send_header("Content-Length",str(len(page["content"])))
+            self.end_headers()
+            self.wfile.write(page["content"])
+
+        def log_message(self,*args):
+            pass
+
+    return ReplayHandler
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads=True
+
+    def handle_error(self,request,client_address):
+        # partial page fetches close the connection before reading the whole body, that is expected
+        if not isinstance(sys.exc_info()[1],ConnectionError):
+            super().handle_error(request,client_address)
+
+
+def start_server(pages,port=0):
+    """
+    START THE REPLAY HTTP SERVER IN A BACKGROUND THREAD
+    :param pages: corpus loaded with load_corpus
+    :type pages: Dict
+    :param port: port to listen on, any free port if 0
+    :type port: int
+    :return: the running ReplayServer
+    """
+    server=ReplayServer(("127.0.0.1",port),make_handler(pages))
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    return server
+
+
+class ForwardingAdapter(HTTPAdapter):
+    """
+    TRANSPORT ADAPTER THAT SENDS EVERY REQUEST TO THE REPLAY SERVER INSTEAD OF THE ORIGINAL SITE
+    """
+
+    def __init__(self,server_url,*args,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.server_url=server_url
+
+    def send(self,request,**kwargs):
+        parts=urlsplit(request.url)
+        request.url=f"{self.server_url}/{parts.scheme}/{parts.netloc}{parts.path}"+(f"?{parts.query}" if parts.query else "")
+        return super().send(request,**kwargs)
+
+
+def call_parser(parser,url):
+    """
+    CALL A PARSER WITHOUT ITS RETRY DECORATOR, SO A BROKEN FIXTURE FAILS IMMEDIATELY INSTEAD OF BEING RETRIED
+    :return: True if the parser ran without an exception
+    """
+    function=getattr(scrapers,parser)
+    function=getattr(function,"__wrapped__",function)
+    try:
+        function(url)
+        return True
+    except Exception:
+        return False
+
+
+def bench_parsers(pages,parsers=None,repeat=5):
+    """
+    MEASURE THE PARSING THROUGHPUT OF EVERY PARSER ON ITS RECORDED PAGES, SERVED FROM MEMORY
+    :param pages: corpus loaded with load_corpus
+    :type pages: Dict
+    :param parsers: only benchmark these parsers, all if None
+    :type parsers: list of strings
+    :param repeat: number of times every page is parsed
+    :type repeat: int
+    :return: Dictionary of parser name to dict of results
+    """
+    adapter=ReplayAdapter(pages)
+    scrapers.session.mount("http://",adapter)
+    scrapers.session.mount("https://",adapter)
+
+    by_parser={}
+    for parser,url in entry_points(pages,parsers):
+        by_parser.setdefault(parser,[]).append(url)
+
+    results={}
+    for parser,urls in by_parser.items():
+        times=[]
+        errors=0
+        for _ in range(repeat):
+            for url in urls:
+                start=time.perf_counter()
+                errors+=not call_parser(parser,url)
+                times.append(time.perf_counter()-start)
+
+        # allocations are measured in a separate pass since tracing slows everything down
+        peaks=[]
+        blocks=[]
+        tracemalloc.start()
+        for url in urls:
+            tracemalloc.reset_peak()
+            before=tracemalloc.take_snapshot()
+            call_parser(parser,url)
+            after=tracemalloc.take_snapshot()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            blocks.append(sum(stat.count_diff for stat in after.compare_to(before,"filename") if stat.count_diff>0))
+        tracemalloc.stop()
+
+        times=np.array(times)
+        results[parser]={
+            "pages":len(urls),
+            "errors":errors,
+            "pages_per_sec":len(times)/times.sum(),
+            "p50_ms":np.percentile(times,50)*1000,
+            "p90_ms":np.percentile(times,90)*1000,
+            "p99_ms":np.percentile(times,99)*1000,
+            "peak_kib":np.mean(peaks)/1024,
+            "new_blocks":np.mean(blocks),
+        }
+
+    return results
+
+
+def bench_end_to_end(pages,parsers=None,concurrency=(1,4,16)):
+    """
+    MEASURE THE SCRAPING THROUGHPUT OVER HTTP AGAINST THE REPLAY SERVER AT DIFFERENT LEVELS OF CONCURRENCY
+    :param pages: corpus loaded with load_corpus
+    :type pages: Dict
+    :param parsers: only include these parsers, all if None
+    :type parsers: list of strings
+    :param concurrency: numbers of threads to scrape with
+    :type concurrency: list of ints
+    :return: Dictionary of concurrency to pages per second
+    """
+    server=start_server(pages)
+    adapter=ForwardingAdapter("http://127.0.0.1:{}".format(server.server_address[1]),pool_maxsize=max(concurrency))
+    scrapers.session.mount("http://",adapter)
+    scrapers.session.mount("https://",adapter)
+
+    jobs=entry_points(pages,parsers)
+    results={}
+    for n in concurrency:
+        start=time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            list(executor.map(lambda job:call_parser(*job),jobs))
+        results[n]=len(jobs)/(time.perf_counter()-start)
+
+    server.shutdown()
+    return results
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    commands=arg_parser.add_subparsers(dest="command",required=True)
+
+    record_parser=commands.add_parser("record",help="record pages from the live sites")
+    record_parser.add_argument("corpus")
+    record_parser.add_argument("parser")
+    record_parser.add_argument("urls",nargs="+")
+
+    bench_parser=commands.add_parser("bench",help="benchmark the parsers against a recorded corpus")
+    bench_parser.add_argument("corpus")
+    bench_parser.add_argument("--parsers",nargs="*")
+    bench_parser.add_argument("--repeat",type=int,default=5)
+    bench_parser.add_argument("--concurrency",type=int,nargs="*",default=[1,4,16])
+
+    args=arg_parser.parse_args()
+
+    if args.command=="record":
+        record(args.corpus,args.parser,args.urls)
+        sys.exit()
+
+    # replayed pages must not be throttled like the real sites, and the recorded doi redirects are replayed instead of using the cache
+    rate_limiting.disable()
+    doi_cache.set_cache({})
+    pages=load_corpus(args.corpus)
+
+    print("{:<28}{:>7}{:>7}{:>11}{:>9}{:>9}{:>9}{:>11}{:>11}".format("parser","pages","errors","pages/s","p50 ms","p90 ms","p99 ms","peak KiB","new blocks"))
+    for parser,r in bench_parsers(pages,args.parsers,args.repeat).items():
+        print("{:<28}{:>7}{:>7}{:>11.1f}{:>9.2f}{:>9.2f}{:>9.2f}{:>11.1f}{:>11.0f}".format(parser,r["pages"],r["errors"],r["pages_per_sec"],r["p50_ms"],r["p90_ms"],r["p99_ms"],r["peak_kib"],r["new_blocks"]))
+
+    print()
+    print("{:<13}{:>11}".format("concurrency","pages/s"))
+    for n,throughput in bench_end_to_end(pages,args.parsers,args.concurrency).items():
+        print("{:<13}{:>11.1f}".format(n,throughput))
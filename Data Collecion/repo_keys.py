@@ -0,0 +1,207 @@
+"""CANONICAL KEYS OF THE REPOSITORIES THE PAPERS LINK TO, SO THAT EVERY REPOSITORY IS SCRAPED ONCE NO MATTER HOW IT IS WRITTEN DOWN.
+
+repo_key (link_matcher.py) already drops ".git", paths inside the repository and trailing punctuation. On top of that the keys are folded to lower
+case (github and gitlab ignore the case of owners and names) and looked up on the site, which follows renames and transfers and gives the name of the
+repository today. The lookups are stored in the "repository_alias" collection with the folded key as id, so every key is looked up once.
+"""
+import requests
+from datetime import datetime, timedelta
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pymongo import UpdateOne
+from tqdm import tqdm
+from database_operations import get_collection, query_by_field_exists
+from link_matcher import repo_key
+from github_graphql import resolve_names
+from github_pool import GITHUB_TOKENS
+from gitlab_commits import get_json, GITLAB_URL, GITLAB_TOKEN
+
+# fields of the papers with links to sourcecode
+LINK_FIELDS=("PDF_SourceCode","SourceCode")
+
+# keys that did not resolve are looked up again after this many days, the repository may have been made public since
+NOT_FOUND_DAYS=30
+
+# in memory copy of the collection, loaded on first use
+_cache=None
+
+
+def fold(key):
+    """
+    FOLD THE CASE OF A KEY, ALL THE WAYS OF WRITING A KEY THAT THE SITE SEES AS THE SAME REPOSITORY GIVE THE SAME FOLDED KEY
+    :param key: key in the form {SITE}/author_id/repo_id
+    :type key: string
+    :return: key in string
+    """
+    return key.lower()
+
+
+def get_cache():
+    """
+    GET THE IN MEMORY COPY OF THE ALIAS CACHE, LOADING IT FROM THE DATABASE THE FIRST TIME
+    :return: Dictionary of folded key to {"key":canonical key or None, "checked":datetime}
+    """
+    global _cache
+
+    if _cache is None:
+        collection=get_collection(collection_name="repository_alias")
+        _cache={doc["_id"]:doc for doc in collection.find()}
+
+    return _cache
+
+
+def set_cache(cache):
+    """
+    USE THE GIVEN DICTIONARY AS THE ALIAS CACHE INSTEAD OF LOADING THE DATABASE, E.G. FOR OFFLINE RUNS
+    :param cache: Dictionary of folded key to {"key":..., "checked":...}
+    :type cache: Dict
+    """
+    global _cache
+    _cache=cache
+
+
+def is_stale(entry,now):
+    """
+    CHECK IF A CACHED LOOKUP HAS TO BE DONE AGAIN
+    """
+    return entry["key"] is None and now-entry["checked"]>timedelta(days=NOT_FOUND_DAYS)
+
+
+def resolve_gitlab(id,token=GITLAB_TOKEN):
+    """
+    CURRENT PATH OF A GITLAB PROJECT, GITLAB REDIRECTS THE OLD PATHS OF RENAMED AND MOVED PROJECTS
+    :param id: project in the form author_id/repo_id
+    :type id: string
+    :param token: GitLab token
+    :type token: string
+    :return: author_id/repo_id in string, None if the project does not exist
+    """
+    try:
+        project,_=get_json(f"{GITLAB_URL}/api/v4/projects/{quote(id,safe='')}",token)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in (403,404):
+            return None
+        raise
+    return project.get("path_with_namespace")
+
+
+def lookup(keys,token=None,max_workers=8):
+    """
+    LOOK UP THE CURRENT NAMES OF FOLDED KEYS ON THE SITES: GITHUB IN BATCHES OF 100 OVER GRAPHQL, GITLAB WITH CONCURRENT REQUESTS. KEYS OF OTHER
+    SITES ARE KEPT AS THEY ARE
+    :param keys: folded keys in the form {SITE}/author_id/repo_id
+    :type keys: list of strings
+    :param token: GitHub token, the first of GITHUB_TOKENS if not given
+    :type token: string
+    :param max_workers: Number of gitlab requests in flight
+    :type max_workers: int
+    :return: Dictionary of folded key to canonical key, None for the repositories the site says don't exist. Keys whose lookup failed are left out,
+             so that they are not cached
+    """
+    found={}
+    github=[key.split("/",1)[1] for key in keys if key.startswith("github/")]
+    gitlab=[key.split("/",1)[1] for key in keys if key.startswith("gitlab/")]
+
+    if github:
+        try:
+            for id,name in resolve_names(github,token or GITHUB_TOKENS[0]).items():
+                found[f"github/{id}"]=f"github/{name}" if name else None
+        # the lookup failed for now, leave the keys out of the cache so that they are tried again next time
+        except Exception:
+            pass
+
+    if gitlab:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures={executor.submit(resolve_gitlab,id):id for id in gitlab}
+            for future in as_completed(futures):
+                try:
+                    path=future.result()
+                # the lookup failed for now, leave the key out of the cache so that it is tried again next time
+                except Exception:
+                    continue
+                found[f"gitlab/{futures[future]}"]=f"gitlab/{path}" if path else None
+
+    for key in keys:
+        if key.split("/",1)[0] not in ("github","gitlab"):
+            found[key]=key
+
+    return found
+
+
+def resolve_keys(keys,token=None,write=True):
+    """
+    CANONICAL KEYS OF MANY KEYS AT ONCE, LOOKING UP ONLY THE ONES THAT ARE NOT CACHED YET
+    :param keys: keys in the form {SITE}/author_id/repo_id, as given by repo_key
+    :type keys: iterable of strings
+    :param token: GitHub token, the first of GITHUB_TOKENS if not given
+    :type token: string
+    :param write: Store the new lookups in the database
+    :type write: Boolean
+    :return: Dictionary of key to canonical key, None for the repositories that don't exist. Keys whose lookup failed are mapped to themselves
+    """
+    cache=get_cache()
+    now=datetime.utcnow()
+
+    keys=set(keys)
+    todo=sorted({fold(key) for key in keys if fold(key) not in cache or is_stale(cache[fold(key)],now)})
+
+    if todo:
+        found=lookup(todo,token)
+
+        writes=[]
+        for folded,canonical in found.items():
+            cache[folded]={"_id":folded,"key":canonical,"checked":now}
+            writes.append(UpdateOne({"_id":folded},{"$set":{"key":canonical,"checked":now}},upsert=True))
+
+        if write and writes:
+            get_collection(collection_name="repository_alias").bulk_write(writes,ordered=False)
+
+    return {key:cache[fold(key)]["key"] if fold(key) in cache else key for key in keys}
+
+
+def canonical_keys(url_lists,token=None):
+    """
+    CANONICAL KEY OF EVERY LINK OF MANY PAPERS, WITH ONE BATCH OF LOOKUPS FOR ALL OF THEM
+    :param url_lists: sourcecode links of every paper
+    :type url_lists: list of lists of links
+    :param token: GitHub token, the first of GITHUB_TOKENS if not given
+    :type token: string
+    :return: list with the canonical key (or None) of every link for every paper
+    """
+    keys=[[repo_key(url) for url in urls] for urls in url_lists]
+    resolved=resolve_keys({key for paper_keys in keys for key in paper_keys if key},token)
+    return [[resolved[key] if key else None for key in paper_keys] for paper_keys in keys]
+
+
+def work_list(url_lists,token=None):
+    """
+    THE REPOSITORIES TO SCRAPE FOR THE LINKS OF MANY PAPERS, EVERY REPOSITORY ONCE
+    :param url_lists: sourcecode links of every paper
+    :type url_lists: list of lists of links
+    :param token: GitHub token, the first of GITHUB_TOKENS if not given
+    :type token: string
+    :return: Dictionary of canonical key to the number of papers linking to it
+    """
+    counts={}
+    for paper_keys in canonical_keys(url_lists,token):
+        for key in set(paper_keys)-{None}:
+            counts[key]=counts.get(key,0)+1
+    return counts
+
+
+if __name__=="__main__":
+
+    # canonical keys of the links of every paper in the dataset, from both fields together
+    papers={}
+    for field in LINK_FIELDS:
+        c,count=query_by_field_exists(field,return_count=True)
+        for doc in tqdm(c,total=count):
+            if doc.get(field):
+                papers.setdefault(doc["_id"],[]).extend(doc[field])
+    url_lists=list(papers.values())
+
+    links=[url for urls in url_lists for url in urls]
+    keys={repo_key(url) for url in links}-{None}
+    repositories=work_list(url_lists)
+
+    print(f"{len(links)} links, {len(keys)} keys, {len({fold(key) for key in keys})} after folding the case, {len(repositories)} repositories")
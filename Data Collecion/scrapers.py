@@ -6,10 +6,74 @@ from tqdm import tqdm
 from bs4 import BeautifulSoup
 import re
 import json
+import codecs
 from opnieuw import RetryException, retry
+from rate_limiting import request_throttled
+from doi_cache import resolve_url
+
+# all the scrapers share one session so connections to the same site are reused. Other transports (e.g. replay.py) can be mounted on it
+session=requests.Session()
 
 requests_headers= {'User-Agent': "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/70.0.3538.77 Safari/537.36"}
 
+# Stop conditions for partial page fetches. Everything the metadata scrapers read is located before these markers
+HEAD_END="</head>"
+IEEE_METADATA_END=re.compile(r"global\.document\.metadata=.*\n")
+# the heading of the abstract (h3 on papers.nips.cc, h4 on proceedings.neurips.cc) or its paragraph. The bare word also shows up in titles and meta tags
+NIPS_LINKS_END=re.compile(r'<h[34]>\s*Abstract\s*</h[34]>|class="abstract"')
+
+
+def get_page(url,stop=None,chunk_size=16384,**kwargs):
+    """
+    GET THE HTML OF A PAGE. IF A STOP CONDITION IS GIVEN, THE RESPONSE IS STREAMED AND THE CONNECTION IS RELEASED AS SOON AS THE STOP CONDITION IS FOUND, SO THE REST OF THE PAGE IS NEVER DOWNLOADED OR PARSED
+
+    :param url: URL of the page
+    :type url: string
+    :param stop: Marker string (e.g. "</head>") or compiled regex pattern. Reading stops once it is found in the downloaded text. None reads the whole page
+    :type stop: string or re.Pattern object
+    :param chunk_size: Number of bytes read from the socket at a time
+    :type chunk_size: int
+    :param kwargs: Extra keyword arguments passed to session.request (verify etc)
+    :return: html of the page (or of the page up to and including the stop condition) in string
+    """
+
+    kwargs.setdefault("headers",requests_headers)
+
+    # publisher sites share the rate limit of their host with every other scraping process, and so does every host the page redirects through
+    with request_throttled(session,"GET",url,stream=stop is not None,**kwargs) as response:
+
+        # rate limited by the host, the bucket has been adjusted so just try again
+        if response.status_code==429:
+            raise RetryException
+
+        # no stop condition, simply read the whole page
+        if stop is None:
+            return response.text
+
+        # fall back to utf-8 when the server does not specify the charset
+        try:
+            decoder=codecs.getincrementaldecoder(response.encoding or "utf-8")(errors="replace")
+        except LookupError:
+            decoder=codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        text=""
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            # decode only the new chunk, the decoder keeps multi-byte characters split across chunks
+            new_text=decoder.decode(chunk)
+            text+=new_text
+
+            if isinstance(stop,str):
+                # only search the part of the text that could contain a marker that was not complete in the previous chunk
+                found=stop in text[-(len(new_text)+len(stop)):]
+            else:
+                found=re.search(stop,text) is not None
+
+            # stop reading, leaving the with block closes the response and releases the connection
+            if found:
+                break
+
+    return text
+
 
 @retry(retry_on_exceptions=(RetryException,ConnectionError,HTTPError),max_calls_total=5,retry_window_after_first_call_in_seconds=30)
 def scrape_ieeexplore(url,keywords=True):
@@ -26,11 +90,11 @@ def scrape_ieeexplore(url,keywords=True):
 
     return_dict={}
 
-    # Get page html
-    page=requests.get(url,headers=requests_headers)
+    # Get page html, only upto the line with the metadata variable. Skip the doi redirects if the doi has been resolved before
+    page=get_page(resolve_url(url),stop=IEEE_METADATA_END)
 
     #Create a BS4 instance
-    soup=BeautifulSoup(page.text,features="lxml")
+    soup=BeautifulSoup(page,features="lxml")
 
     #-------------------------------------------------------------------------------------------------------------
     # IEEE xplore stores its metadata within the scripts tags, as a js variable called "global.document.metadata"
@@ -93,10 +157,10 @@ def scrape_cvf(url):
     return_dict={}
 
     # get page html
-    page=requests.get(url,headers=requests_headers)
+    page=get_page(url)
 
     # create parser object
-    tree=HTMLParser(page.text)
+    tree=HTMLParser(page)
 
     # for pdf link
     if tree.css("a:contains(pdf)"):
@@ -128,11 +192,11 @@ def scrape_nips(url):
     #Add the bitex link for the paper
     return_dict["bib"]=[url+"/bibtex"]
 
-    # Get the page html
-    page=requests.get(url,headers=requests_headers)
+    # Get the page html, the links to the paper resources are listed before the abstract
+    page=get_page(url,stop=NIPS_LINKS_END)
 
     #Create a htmlparser object
-    tree=HTMLParser(page.text)
+    tree=HTMLParser(page)
 
     #Search for a sourcecode text in the page; it exists, add it to the return dict, if not ignore
     if tree.css("a:contains([Sourcecode])"):
@@ -160,8 +224,8 @@ def scrape_icml(url):
         return_dict["PDF"]=url
     else:
         # get page and create a parse
-        page=requests.get(url,headers=requests_headers)
-        tree=HTMLParser(page.text)
+        page=get_page(url)
+        tree=HTMLParser(page)
 
         #select pdf link by searching for download pdf text within an a tag
         if tree.css("a:contains(Download PDF)"):
@@ -184,8 +248,8 @@ def scrape_ACLWeb(url):
     return_dict={}
 
     # get page and create a parse
-    page = requests.get(url,headers=requests_headers)
-    tree = HTMLParser(page.text)
+    page = get_page(url)
+    tree = HTMLParser(page)
 
     #-------------------------------
     # Extracting PDF Link
@@ -260,8 +324,9 @@ def scrape_AAAI_extract_meta(url):
     """
 
     # was throwing sslerror, because sometimes doi redirects to the ip address of the host instead of aaai.org. Some pdf links will also have this IP address but it is accessible, but ssl is a problem.
-    page=requests.get(url,verify=False,headers=requests_headers)
-    tree=HTMLParser(page.text)
+    # all the metadata we need is in the meta tags, so we don't need anything after the head
+    page=get_page(url,stop=HEAD_END,verify=False)
+    tree=HTMLParser(page)
 
     return_dict={}
 
@@ -293,14 +358,17 @@ def scrape_AAAI(url):
 
     pattern=re.compile(r"https?:\/\/(?:www.)?aaai.org\/(\w*)\/")
 
+    # skip the doi redirects if the doi has been resolved before, this also lets us tell OCS and OJS apart for doi links
+    url=resolve_url(url)
+
     # check if the url is of AAAI and figure out if it is OCS or OJS
     match=re.search(pattern,url)
 
     if match:
         if match.group(1)=="ocs":
             #actual content of the website is inside a frame within the page
-            page=requests.get(url,headers=requests_headers)
-            tree=HTMLParser(page.text)
+            page=get_page(url)
+            tree=HTMLParser(page)
             if tree.css("frame"):
 
                 #extract the source of the frame, which contains the meta tags we want
@@ -353,9 +421,9 @@ def scrape_ACM(url):
     reutrn_dict={}
 
 
-    #get page and create a htmlparser object
-    page=requests.get(url,headers=requests_headers)
-    tree=HTMLParser(page.text)
+    #get page and create a htmlparser object, skipping the doi redirects if the doi has been resolved before
+    page=get_page(resolve_url(url))
+    tree=HTMLParser(page)
 
     #CREATE PDF FROM DOI LINK
     root_url = "https://dl.acm.org/doi/pdf/"
@@ -1,22 +1,17 @@
-from github import Github
-import re
+import argparse
 import gitlab
-from database_operations import  check_repo_exists, get_collection, insert_document,query_by_field_exists,update_collection_one
+from database_operations import  check_repo_exists, check_repos_exist, get_collection, insert_document, push_to_document,query_by_field_exists,update_collection_one
 from tqdm import tqdm
-import time
+from rate_limiting import throttle
+from link_matcher import repo_key
+from repo_keys import canonical_keys, resolve_keys
+from github_graphql import fetch_repositories
+from github_stats import collect_stats
+from github_pool import pool
+from github_refresh import refresh_repositories, METADATA_PROJECTION
+from gitlab_commits import collect_commits, GITLAB_URL, GITLAB_TOKEN
 
-sourcecode_pattern=re.compile(r"(?:(?:http|https):\/\/)?(?:www.)?(github|gitlab)\.[a-z]{2,6}(?:\/([-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
-
-github_pattern=re.compile(r"(?:(?:http|https):\/\/)?(?:www.)?(?:github)\.[a-z]{2,6}(?:\/([-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
-gitlab_pattern=re.compile(r"(?:(?:http|https):\/\/)?(?:www.)?(?:gitlab)\.[a-z]{2,6}(?:\/([-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
-bitbucket_pattern=re.compile(r"(?:(?:http|https):\/\/)?(?:www.)?(?:bitbucket)\.[a-z]{2,6}(?:\/([-a-zA-Z0-9@:%_\+~#?&\/\\=]*))")
-
-##regex code for extracting the id in case the link contains branch details
-id_pattern=re.compile(r"^([-a-zA-Z0-9@:%_\+~#?&=]*\/[-a-zA-Z0-9@:%_\+~#?&=]*)")
-
-
-github=Github("API_KEY")
-gl=gitlab.Gitlab("https://gitlab.com/", private_token="API_KEY")
+gl=gitlab.Gitlab(GITLAB_URL, private_token=GITLAB_TOKEN)
 
 
 def github_scraper(id):
@@ -27,10 +22,6 @@ def github_scraper(id):
     :return: Objectid of the record for this repo in the repository document
     """
 
-    #check rate limits and sleep untill this resets
-    while github.rate_limiting[0]<1:
-        time.sleep(20)
-
     #check if this repo has been scraped before by getting objectid from repo collection
     object_id=check_repo_exists(f"github/{id}")
 
@@ -38,8 +29,9 @@ def github_scraper(id):
         return object_id
     else:
         repo_dict={}
-        #initialize the repo for scraping
-        repo = github.get_repo(id)
+        #initialize the repo for scraping with the token that has the most budget left, this takes about four calls besides the statistics
+        member=pool.acquire(cost=4)
+        repo = member.client.get_repo(id)
 
         #adding elementary stats to the return dict
         repo_dict["key"]=f"github/{id}"
@@ -55,39 +47,70 @@ def github_scraper(id):
         else:
             repo_dict["OpenIssues"]=0
 
-        ## Scraping commits (new additions/deletions) on a week by week basis
-        commits=repo.get_stats_code_frequency()
-        commits_list=[]
+        # weekly commits and contributors, github may need a while to compute them. A repo is not stored without them
+        stats,incomplete=collect_stats([id],pool)
+        if id in incomplete:
+            raise Exception(f"statistics of {id}: {incomplete[id]}")
+        repo_dict.update(stats[id])
+        repo_dict["count"]=1
 
-        for commit in commits:
-            week={}
-            week["week"]=commit.week
-            week["additions"]=commit.additions
-            week["deletions"]=commit.deletions
+        #adapt the budget of the token to the rate limit github reported in the last response
+        pool.observe(member)
 
-            # for space efficiency, we will not add a week if there are no deletions or additions; i.e. a week not existing implies no commit activity happened in the repo
-            if week["additions"] or week["deletions"]:
-                commits_list.append(week)
+        # get collection and insert the document into the repositories collection, and return the id of the inserted entry
+        coll=get_collection(collection_name="repository")
 
-        repo_dict["commits"]=commits_list
+        return insert_document(repo_dict,coll)
 
-        ##getting contribution by users (github caps this to 100 users)
-        contributors=repo.get_stats_contributors()
-        contributors_list=[]
 
-        for contrib in contributors:
-            authors={}
-            authors["id"]=contrib.author.login
-            authors["contributions"]=contrib.total
-            contributors_list.append(authors)
+def github_batch_scraper(ids,stats=True):
+    """
+    github_scraper FOR MANY REPOS AT ONCE. THE REPOS THAT WERE SCRAPED BEFORE ARE LOOKED UP WITH ONE QUERY, AND THE METADATA OF THE NEW ONES IS FETCHED
+    WITH ONE GRAPHQL CALL PER 100 REPOS (SEE github_graphql.py) INSTEAD OF ABOUT SIX REST CALLS PER REPO
+    :param ids: Keys of the repos in the form of author_id/repo_id. A repo appearing several times counts that many times, like repeated github_scraper calls
+    :type ids: list of Strings
+    :param stats: Also scrape the weekly commits and the contributors, which takes two REST calls per new repo. They are requested for all the new repos
+                  up front and the ones github is still computing are polled later, see github_stats.py
+    :type stats: Boolean
+    :return: Dictionary of id to Objectid of the record for the repo in the repository document. Repos that could not be scraped, or whose statistics
+             did not become ready, are left out
+    """
+    coll=get_collection(collection_name="repository")
 
-        repo_dict["contributors"]=contributors_list
-        repo_dict["count"]=1
+    found=check_repos_exist([f"github/{id}" for id in ids],collection=coll)
+    result={id:found[f"github/{id}"] for id in ids if f"github/{id}" in found}
 
-        # get collection and insert the document into the repositories collection, and return the id of the inserted entry
-        coll=get_collection(collection_name="repository")
+    new=[id for id in ids if id not in result]
+    # graphql points are a separate budget and a batch of 100 repos costs about one, so a single token is plenty
+    repos={id:repo_dict for id,repo_dict in fetch_repositories(new,pool.tokens[0].token).items() if repo_dict is not None}
 
-        return insert_document(repo_dict,coll)
+    if stats:
+        all_stats,incomplete=collect_stats(repos,pool)
+        for id in incomplete:
+            del repos[id]
+        for id,repo_stats in all_stats.items():
+            repos[id].update(repo_stats)
+
+    for id,repo_dict in repos.items():
+        repo_dict["count"]=new.count(id)
+        result[id]=insert_document(repo_dict,coll)
+
+    return result
+
+
+def scrape_gitlab_commits(id,object_id,coll):
+    """
+    SCRAPE THE COMMITS OF A GITLAB PROJECT INTO ITS DOCUMENT FROM THE START, PAGE BY PAGE, AND MARK THEM COMPLETE
+    :param id: Key of the repo in the form of author_id/repo_id
+    :type id: String
+    :param object_id: Objectid of the document of the repo
+    :type object_id: bson.objectid object
+    :param coll: repository collection
+    :type coll: MongoClient.Collection object
+    """
+    update_collection_one({"commits":[],"commits_complete":False},object_id=object_id,collection=coll)
+    collect_commits(id,GITLAB_TOKEN,lambda commits:push_to_document(object_id,"commits",commits,collection=coll))
+    update_collection_one({"commits_complete":True},object_id=object_id,collection=coll)
 
 
 def gitlab_scraper(id):
@@ -102,10 +125,15 @@ def gitlab_scraper(id):
     object_id=check_repo_exists(f"gitlab/{id}")
 
     if object_id:
+        # the commits of a scrape that was killed half way are scraped again
+        coll=get_collection(collection_name="repository")
+        if coll.find_one({"_id":object_id,"commits_complete":False},{"_id":1}):
+            scrape_gitlab_commits(id,object_id,coll)
         return object_id
     else:
         repo_dict={}
 
+        throttle("gitlab.com")
         repo=gl.projects.get(id)
 
         repo_dict["key"]=f"gitlab/{id}"
@@ -125,27 +153,24 @@ def gitlab_scraper(id):
 
         repo_dict["contributors"]=repo.repository_contributors(all=True)
 
-        #list of commits
-        cmt_list=[]
-
-        commits=repo.commits.list()
-        for commit in commits:
-            cmt_dict={}
-            #getting more details including line additions and deleltions
-            cmt=repo.commits.get(commit.id)
-            cmt_dict["created_at"]=cmt.attributes.get("created_at")
-            cmt_dict["stats"]=cmt.attributes.get("stats")
-            cmt_list.append(cmt_dict)
-
-        repo_dict["commits"]=cmt_list
+        # the commits are added page by page as they come in (see gitlab_commits.py), commits_complete stays False if the process is killed half way
+        repo_dict["commits"]=[]
+        repo_dict["commits_complete"]=False
         repo_dict["count"] = 1
 
-    # get collection and insert the document into the repositories collection, and return the id of the inserted entry
-    coll = get_collection(collection_name="repository")
-
-    return insert_document(repo_dict, coll)
+        # get collection and insert the document into the repositories collection
+        coll = get_collection(collection_name="repository")
+        object_id=insert_document(repo_dict, coll)
 
+        # a scrape that fails leaves nothing behind, so that the project is scraped again the next time it is linked
+        try:
+            scrape_gitlab_commits(id,object_id,coll)
+        except:
+            coll.delete_one({"_id":object_id})
+            raise
 
+        # return the id of the inserted entry
+        return object_id
 
 
 def scraper_sourcecode(urls):
@@ -156,95 +181,117 @@ def scraper_sourcecode(urls):
     :return: list of OjbectIds of repos in the Repository table associated with this paper.
     """
 
-    return_list=[]
-
-    for url in urls:
-        # checking if the link is a github link
-        match=re.search(sourcecode_pattern,url)
-
-        # we have one of the three sites that we have an scraper api for
-        if match and match.group(1)=="github":
-            # get the id of the repo in the form author_id/repo_id, scrape if not scraped before and add an id of the document in repository collection to the entry in the papers collection.
-            try:
-                id=re.search(id_pattern,match.group(2))
-                scraped_repo_id=github_scraper(id.group(1))
-                return_list.append({"key":id.group(1),"id":scraped_repo_id})
-            # a problem in getting the repo, or invalid id simply return the empty list with no scraped data
-            except:
-                return_list.append({"link":url})
+    return scraper_sourcecode_many([urls])[0]
+
+
+def scraper_sourcecode_many(url_lists):
+    """
+    scraper_sourcecode FOR THE LINKS OF MANY PAPERS AT ONCE. ALL THE GITHUB REPOS ARE SCRAPED TOGETHER WITH github_batch_scraper
+    :param url_lists: sourcecode links of every paper
+    :type url_lists: list of lists of links
+    :return: list with the list of OjbectIds of repos for every paper, as returned by scraper_sourcecode
+    """
 
-        elif match and match.group(1)=="gitlab":
-            try:
-                id=re.search(id_pattern,match.group(2))
-                scraped_repo_id=gitlab_scraper(id.group(1))
-                return_list.append({"key":id.group(1),"id":scraped_repo_id})
-            # a problem in getting the repo, or invalid id simply return the empty list with no scraped data
-            except:
+    # key of the repository every link points into, in the form {SITE}/author_id/repo_id. The keys are resolved to the current name of the repository,
+    # so case variants and old names of the same repository are scraped once. None for links to repositories that don't exist
+    keys=canonical_keys(url_lists)
+
+    github_ids=[key.split("/",1)[1] for paper_keys in keys for key in paper_keys if key and key.startswith("github/")]
+    try:
+        github_repos=github_batch_scraper(github_ids)
+    # a problem in getting the repos, all the github links are returned with no scraped data
+    except:
+        github_repos={}
+
+    return_lists=[]
+
+    for urls,paper_keys in zip(url_lists,keys):
+        return_list=[]
+
+        for url,key in zip(urls,paper_keys):
+            site,_,id=key.partition("/") if key else (None,None,None)
+
+            # a repository link, but the repository is gone or private
+            if not key and repo_key(url):
                 return_list.append({"link":url})
+                continue
 
-        else:
-            # not any links list add an empty dict
-            return_list.append({})
+            # we have one of the sites that we have an scraper api for
+            if site=="github":
+                # add an id of the document in repository collection to the entry in the papers collection, invalid or private repos simply return the link with no scraped data
+                if id in github_repos:
+                    return_list.append({"key":id,"id":github_repos[id]})
+                else:
+                    return_list.append({"link":url})
+
+            elif site=="gitlab":
+                try:
+                    scraped_repo_id=gitlab_scraper(id)
+                    return_list.append({"key":id,"id":scraped_repo_id})
+                # a problem in getting the repo, or invalid id simply return the empty list with no scraped data
+                except:
+                    return_list.append({"link":url})
 
-    return return_list
+            else:
+                # not any links list add an empty dict
+                return_list.append({})
+
+        return_lists.append(return_list)
+
+    return return_lists
 
 if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Scrape the repositories linked by the papers, or refresh the scraped ones")
+    arg_parser.add_argument("--refresh",action="store_true",help="update the github repositories with conditional requests, writing only what changed")
+    args=arg_parser.parse_args()
 
-    """ INITIAL SCRAPING// COUNTS WERE NOT COMPLETED
-    c,count=query_by_field_exists("PDF_SourceCode",return_count=True)
-    for doc in tqdm(c,total=count):
-        if doc.get("PDF_SourceCode") and doc.get("Repository",9)==9:
-            update_dict={}
-            update_dict["id"]=doc.get("_id")
-            update_dict["Repository"]=scraper_sourcecode(doc.get("PDF_SourceCode"))
-            update_collection_one(update_dict)
-            """
-
-    """GETTING THE COUNTS+CLEANUP OF THE DATASET"""
-
-    c,count=query_by_field_exists("Repository",return_count=True)
-    for doc in tqdm(c,total=count):
-        if not doc.get('Finished'):
-            update_dict={}
-            update_dict["id"]=doc.get("_id")
-            update_dict["Finished"]=True
-            repo_list=[]
-            for repo in doc["Repository"]:
-                if repo:
-                    if repo.get("key"):
-                        if not check_repo_exists(repo_key=None, repo_id=repo.get("id")):
-                            print(f"No-repo found for key {repo.get('key')}")
-                        repo_list.append(repo)
-
-
-                    elif repo.get("link"):
-                        match = re.search(sourcecode_pattern, repo.get("link"))
-                        if match and match.group(1) == "github":
-                            try:
-                                id = re.search(id_pattern, match.group(2))
-                                scraped_repo_id = check_repo_exists(f"github/{id.group(1)}")
-                                if scraped_repo_id:
-                                    repo_list.append({"key":id.group(1),"id":scraped_repo_id})
-                                else:
-                                    repo_list.append(repo)
-                            except:
-                                repo_list.append(repo)
+    if args.refresh:
+        coll=get_collection(collection_name="repository")
+        query={"key":{"$regex":"^github/"}}
+        summary=refresh_repositories(coll.find(query,METADATA_PROJECTION),pool,coll,total=coll.count_documents(query))
+        print(dict(summary))
 
-                        elif match and match.group(1) == "gitlab":
-                            try:
-                                id = re.search(id_pattern, match.group(2))
-                                scraped_repo_id = gitlab_scraper(f"gitlab/{id.group(1)}")
+    else:
+        """ INITIAL SCRAPING// COUNTS WERE NOT COMPLETED. scraper_sourcecode_many DOES THE SAME FOR A WHOLE BATCH OF PAPERS
+        c,count=query_by_field_exists("PDF_SourceCode",return_count=True)
+        for doc in tqdm(c,total=count):
+            if doc.get("PDF_SourceCode") and doc.get("Repository",9)==9:
+                update_dict={}
+                update_dict["id"]=doc.get("_id")
+                update_dict["Repository"]=scraper_sourcecode(doc.get("PDF_SourceCode"))
+                update_collection_one(update_dict)
+                """
+
+        """GETTING THE COUNTS+CLEANUP OF THE DATASET"""
+
+        c,count=query_by_field_exists("Repository",return_count=True)
+        for doc in tqdm(c,total=count):
+            if not doc.get('Finished'):
+                update_dict={}
+                update_dict["id"]=doc.get("_id")
+                update_dict["Finished"]=True
+                repo_list=[]
+                for repo in doc["Repository"]:
+                    if repo:
+                        if repo.get("key"):
+                            if not check_repo_exists(repo_key=None, repo_id=repo.get("id")):
+                                print(f"No-repo found for key {repo.get('key')}")
+                            repo_list.append(repo)
+
+
+                        elif repo.get("link"):
+                            key=repo_key(repo.get("link"))
+                            # the current name of the repository (see repo_keys.py)
+                            key=resolve_keys([key])[key] if key else None
+                            if key and key.split("/")[0] in ("github","gitlab"):
+                                scraped_repo_id = check_repo_exists(key)
                                 if scraped_repo_id:
-                                    repo_list.append({"key": id.group(1), "id": scraped_repo_id})
+                                    repo_list.append({"key":key.split("/",1)[1],"id":scraped_repo_id})
                                 else:
                                     repo_list.append(repo)
-                            except:
+                            # links that don't resolve or are not hosted on github/gitlab are kept as they are
+                            else:
                                 repo_list.append(repo)
 
-            update_dict['Repository']=repo_list
-            update_collection_one(update_dict)
-
-
-
-
-
+                update_dict['Repository']=repo_list
+                update_collection_one(update_dict)
@@ -0,0 +1,231 @@
+"""CONTENT ADDRESSED CACHE OF THE TEXT EXTRACTED FROM THE PDFS, SO THAT A CHANGED LINK PATTERN CAN BE RE-RUN OVER THE WHOLE CORPUS WITHOUT DOWNLOADING
+AND PARSING THE PDFS AGAIN.
+
+Every extraction is stored as a gzipped JSON list of page texts under <cache dir>/<2 hex chars>/<key>.json.gz, where the key is made of the sha256 of the
+pdf, the version of the backend that extracted it and the pages that were extracted. `index.jsonl` in the cache directory maps every (paper, pdf link)
+to the key of its latest extraction; it is appended to by pdf_miner.extract_sourcecode(cache_dir=...).
+
+Usage (re-run the link matcher of pdf_miner.py, or the given patterns, over the cached text):
+    python text_cache.py rescan [--cache-dir TextCache] [--pattern REGEX ...] [--workers 8] [--write]
+"""
+import os
+import re
+import json
+import gzip
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from tqdm import tqdm
+from database_operations import get_collection
+from link_matcher import find_links
+
+CACHE_DIR="TextCache"
+INDEX_FILE="index.jsonl"
+
+
+def pdf_hash(pdf):
+    """
+    SHA256 OF A DOWNLOADED PDF
+    :param pdf: Content of the pdf in bytes or its path
+    :type pdf: bytes or string
+    :return: hex digest in string
+    """
+    if isinstance(pdf,bytes):
+        return hashlib.sha256(pdf).hexdigest()
+
+    digest=hashlib.sha256()
+    with open(pdf,"rb") as f:
+        for block in iter(lambda:f.read(1<<20),b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(digest,version,first_pages=None,last_pages=None):
+    """
+    KEY OF AN EXTRACTION IN THE CACHE
+    :param digest: sha256 of the pdf
+    :type digest: string
+    :param version: what extracted the text, e.g. the backend version from pdf_backends.backend_version
+    :type version: string
+    :param first_pages: Number of pages extracted from the start, None for all pages
+    :type first_pages: int
+    :param last_pages: Number of pages extracted from the end, None for all pages
+    :type last_pages: int
+    :return: key in string
+    """
+    pages="all" if first_pages is None and last_pages is None else "f{}l{}".format(first_pages or 0,last_pages or 0)
+    return "{}.{}.{}".format(digest,version,pages)
+
+
+def cache_path(key,cache_dir=CACHE_DIR):
+    """
+    PATH OF THE FILE STORING AN EXTRACTION. FILES ARE SPREAD OVER 256 DIRECTORIES BY THE FIRST CHARACTERS OF THE HASH
+    """
+    return os.path.join(cache_dir,key[:2],key+".json.gz")
+
+
+def load_pages(key,cache_dir=CACHE_DIR):
+    """
+    LOAD AN EXTRACTION FROM THE CACHE
+    :param key: key of the extraction
+    :type key: string
+    :param cache_dir: directory of the cache
+    :type cache_dir: string
+    :return: list of page texts, None if it is not cached
+    """
+    try:
+        with gzip.open(cache_path(key,cache_dir),"rt",encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def store_pages(key,pages,cache_dir=CACHE_DIR):
+    """
+    STORE AN EXTRACTION IN THE CACHE. THE FILE IS WRITTEN UNDER A TEMPORARY NAME AND MOVED INTO PLACE, SO CONCURRENT WRITERS NEVER SEE HALF A FILE
+    :param key: key of the extraction
+    :type key: string
+    :param pages: list of page texts
+    :type pages: list of strings
+    :param cache_dir: directory of the cache
+    :type cache_dir: string
+    """
+    path=cache_path(key,cache_dir)
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+
+    fd,tmp=tempfile.mkstemp(dir=os.path.dirname(path),suffix=".tmp")
+    with os.fdopen(fd,"wb") as raw, gzip.GzipFile(fileobj=raw,mode="wb") as f:
+        f.write(json.dumps(pages).encode("utf-8"))
+    os.replace(tmp,path)
+
+
+def append_index(f,doc_id,link,key,source):
+    """
+    RECORD WHICH EXTRACTION BELONGS TO A PDF OF A PAPER
+    :param f: index file opened for appending
+    :type f: file object
+    :param doc_id: _id of the paper
+    :type doc_id: bson.ObjectId or string
+    :param link: link of the pdf
+    :type link: string
+    :param key: key of the extraction
+    :type key: string
+    :param source: where the text came from, "annotation" or the name of the backend
+    :type source: string
+    """
+    f.write(json.dumps({"id":str(doc_id),"link":link,"key":key,"source":source})+"\n")
+    f.flush()
+
+
+def read_index(cache_dir=CACHE_DIR):
+    """
+    READ THE INDEX, KEEPING ONLY THE LATEST EXTRACTION OF EVERY PDF
+    :param cache_dir: directory of the cache
+    :type cache_dir: string
+    :return: Dictionary of paper id to list of index entries (one per pdf link)
+    """
+    latest={}
+    with open(os.path.join(cache_dir,INDEX_FILE)) as f:
+        for line in f:
+            if line.strip():
+                entry=json.loads(line)
+                latest[(entry["id"],entry["link"])]=entry
+
+    by_paper={}
+    for entry in latest.values():
+        by_paper.setdefault(entry["id"],[]).append(entry)
+    return by_paper
+
+
+def scan_papers(papers,patterns,cache_dir=CACHE_DIR):
+    """
+    APPLY THE PATTERNS TO THE CACHED TEXT OF A CHUNK OF PAPERS. RUNS IN THE RESCAN PROCESSES
+    :param papers: list of (paper id, list of index entries) tuples
+    :type papers: list
+    :param patterns: regex patterns in string, link_matcher.find_links (the matcher of pdf_miner.py) if empty
+    :type patterns: list of strings
+    :param cache_dir: directory of the cache
+    :type cache_dir: string
+    :return: list of (paper id, Dictionary of matched link to where it was found, number of pdfs missing from the cache) tuples
+    """
+    compiled=[re.compile(p) for p in patterns]
+
+    results=[]
+    for doc_id,entries in papers:
+        links={}
+        missing=0
+        for entry in entries:
+            pages=load_pages(entry["key"],cache_dir)
+            if pages is None:
+                missing+=1
+                continue
+            text="\n".join(pages)
+            if compiled:
+                found=[link for pattern in compiled for link in pattern.findall(text)]
+            else:
+                found=[link.url for link in find_links(text)]
+            for link in found:
+                # same rule as pdf_miner, a link found in an annotation of any pdf counts as annotation
+                if links.get(link)!="annotation":
+                    links[link]=entry["source"]
+        results.append((doc_id,links,missing))
+    return results
+
+
+def rescan(patterns,cache_dir=CACHE_DIR,workers=8,chunk_size=500,write=False):
+    """
+    RE-RUN LINK PATTERNS OVER ALL THE CACHED TEXT WITH A POOL OF PROCESSES, AND OPTIONALLY UPDATE PDF_SourceCode OF THE PAPERS
+    :param patterns: regex patterns in string, the link matcher of pdf_miner.py if empty
+    :type patterns: list of strings
+    :param cache_dir: directory of the cache
+    :type cache_dir: string
+    :param workers: Number of processes
+    :type workers: int
+    :param chunk_size: Number of papers per task
+    :type chunk_size: int
+    :param write: Write the new matches to the papers collection
+    :type write: Boolean
+    :return: Dictionary of paper id to Dictionary of matched link to where it was found
+    """
+    papers=list(read_index(cache_dir).items())
+    chunks=[papers[i:i+chunk_size] for i in range(0,len(papers),chunk_size)]
+
+    collection=get_collection() if write else None
+    matched={}
+    missing=0
+
+    with ProcessPoolExecutor(workers) as executor, tqdm(total=len(papers)) as pbar:
+        futures=[executor.submit(scan_papers,chunk,patterns,cache_dir) for chunk in chunks]
+        for future in futures:
+            results=future.result()
+            writes=[]
+            for doc_id,links,n_missing in results:
+                matched[doc_id]=links
+                missing+=n_missing
+                # papers with pdfs missing from the cache are left alone
+                if write and not n_missing:
+                    update_dict={"PDF_SourceCode":sorted(links)}
+                    update_dict["PDF_SourceCode_found_in"]=[{"link":link,"source":links[link]} for link in update_dict["PDF_SourceCode"]]
+                    writes.append(UpdateOne({"_id":ObjectId(doc_id) if ObjectId.is_valid(doc_id) else doc_id},{"$set":update_dict}))
+            if writes:
+                collection.bulk_write(writes,ordered=False)
+            pbar.update(len(results))
+
+    print(f"{sum(1 for links in matched.values() if links)} papers with links, {missing} pdfs missing from the cache")
+    return matched
+
+
+if __name__=="__main__":
+    arg_parser=argparse.ArgumentParser(description="Re-run link patterns over the cached pdf text")
+    commands=arg_parser.add_subparsers(dest="command",required=True)
+    rescan_parser=commands.add_parser("rescan")
+    rescan_parser.add_argument("--cache-dir",default=CACHE_DIR)
+    rescan_parser.add_argument("--pattern",action="append",help="regex to apply, the link matcher of pdf_miner.py if not given. Can be repeated")
+    rescan_parser.add_argument("--workers",type=int,default=os.cpu_count())
+    rescan_parser.add_argument("--write",action="store_true",help="update PDF_SourceCode of the papers")
+    args=arg_parser.parse_args()
+
+    rescan(args.pattern or [],args.cache_dir,args.workers,write=args.write)
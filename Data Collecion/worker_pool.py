@@ -0,0 +1,279 @@
+"""PROCESS POOL FOR WORK THAT CAN HANG OR BLOW UP, LIKE PARSING PDFS. USED BY pdf_miner.py INSTEAD OF concurrent.futures.ProcessPoolExecutor.
+
+With ProcessPoolExecutor a task that spins for minutes or eats gigabytes holds up everything behind it, and a worker killed by the OOM killer breaks the
+whole pool. Here every worker runs one task at a time under the eye of a supervisor thread: a task that runs past its timeout gets its worker killed and
+replaced and fails with WorkerTimeout, a task that runs out of the memory limit fails with WorkerMemoryExceeded, and a worker that dies fails its task
+with WorkerDied. The other tasks carry on. Workers are also recycled after a number of tasks or when their peak RSS crosses a threshold, so memory
+leaked or fragmented by one document does not pile up over the run.
+"""
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the memory limit and the rss threshold are not enforced there
+    resource=None
+
+
+class WorkerTimeout(Exception):
+    """THE TASK RAN LONGER THAN THE TIMEOUT OF THE POOL"""
+
+
+class WorkerMemoryExceeded(Exception):
+    """THE TASK RAN OUT OF THE MEMORY LIMIT OF ITS WORKER"""
+
+
+class WorkerDied(Exception):
+    """THE WORKER EXITED WHILE RUNNING THE TASK, E.G. A CRASH IN A C EXTENSION OR THE OOM KILLER"""
+
+
+def peak_rss():
+    """
+    PEAK RESIDENT MEMORY OF THE CURRENT PROCESS
+    :return: bytes in int, 0 if it is not known
+    """
+    if resource is None:
+        return 0
+    # reported in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def worker_main(conn,memory_limit):
+    """
+    LOOP OF A WORKER PROCESS. RUNS (FUNCTION, ARGS, KWARGS) TASKS FROM THE PIPE UNTILL IT GETS None, AND SENDS BACK (ERROR, RESULT, RUNTIME, PEAK RSS) TUPLES
+    :param conn: end of the pipe to the supervisor
+    :type conn: multiprocessing.connection.Connection
+    :param memory_limit: Address space limit of the process in bytes, None for no limit
+    :type memory_limit: int
+    """
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS,(memory_limit,memory_limit))
+
+    while True:
+        task=conn.recv()
+        if task is None:
+            return
+
+        fn,args,kwargs=task
+        start=time.perf_counter()
+        try:
+            result,error=fn(*args,**kwargs),None
+        except MemoryError:
+            result,error=None,WorkerMemoryExceeded("memory limit of {} MiB".format(memory_limit>>20 if memory_limit else "?"))
+        except Exception as e:
+            result,error=None,e
+        runtime=time.perf_counter()-start
+
+        try:
+            conn.send((error,result,runtime,peak_rss()))
+        except Exception as e:
+            # the result or the exception can't be pickled, send its description instead
+            conn.send((RuntimeError(repr(error if error is not None else e)),None,runtime,peak_rss()))
+
+
+class RecyclingPool:
+    """
+    POOL OF WORKER PROCESSES WITH A PER TASK TIMEOUT AND MEMORY LIMIT, AND RECYCLING OF WORKERS. submit() RETURNS A concurrent.futures.Future LIKE
+    ProcessPoolExecutor DOES; ONCE IT IS DONE ITS runtime ATTRIBUTE HOLDS THE SECONDS THE TASK RAN FOR IN ITS WORKER (WITHOUT THE TIME SPENT WAITING FOR ONE)
+    """
+
+    def __init__(self,workers,timeout=None,memory_limit=None,max_rss=None,max_tasks=None):
+        """
+        :param workers: Number of worker processes
+        :type workers: int
+        :param timeout: Seconds a task may run before its worker is killed, None for no limit
+        :type timeout: float
+        :param memory_limit: Address space limit of every worker in bytes, None for no limit. Tasks going over it fail with WorkerMemoryExceeded
+        :type memory_limit: int
+        :param max_rss: Peak RSS in bytes above which a worker is replaced after its task, None to never replace it for this
+        :type max_rss: int
+        :param max_tasks: Number of tasks after which a worker is replaced, None to never replace it for this
+        :type max_tasks: int
+        """
+        # workers are started while the downloader threads are running, which is not safe with fork
+        methods=multiprocessing.get_all_start_methods()
+        self.context=multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+        self.timeout=timeout
+        self.memory_limit=memory_limit
+        self.max_rss=max_rss
+        self.max_tasks=max_tasks
+
+        # workers that were replaced, by reason
+        self.recycled={"tasks":0,"rss":0,"memory":0,"timeout":0,"died":0}
+
+        self.tasks=deque()
+        self.lock=threading.Lock()
+        self.closed=False
+        self.wakeup_reader,self.wakeup_writer=self.context.Pipe(duplex=False)
+
+        self.workers=[self.start_worker() for _ in range(workers)]
+        self.supervisor=threading.Thread(target=self.supervise,daemon=True)
+        self.supervisor.start()
+
+    def start_worker(self):
+        """
+        START A NEW WORKER PROCESS
+        :return: Dictionary with the process, the pipe to it, the future of its task, the deadline of the task and the number of tasks it ran
+        """
+        conn,child_conn=self.context.Pipe()
+        process=self.context.Process(target=worker_main,args=(child_conn,self.memory_limit),daemon=True)
+        process.start()
+        child_conn.close()
+        return {"process":process,"conn":conn,"future":None,"started":None,"deadline":None,"done":0}
+
+    def stop_worker(self,worker,kill=False):
+        """
+        STOP A WORKER PROCESS, POLITELY UNLESS kill IS SET
+        """
+        if not kill:
+            try:
+                worker["conn"].send(None)
+                worker["process"].join(5)
+            except (OSError,ValueError):
+                pass
+        if worker["process"].is_alive():
+            worker["process"].kill()
+        worker["process"].join()
+        worker["conn"].close()
+
+    def replace_worker(self,i,reason,kill=False):
+        """
+        REPLACE THE i-TH WORKER WITH A NEW PROCESS
+        """
+        self.recycled[reason]+=1
+        self.stop_worker(self.workers[i],kill)
+        self.workers[i]=self.start_worker()
+
+    def submit(self,fn,*args,**kwargs):
+        """
+        SCHEDULE fn(*args, **kwargs) ON A WORKER. fn AND ITS ARGUMENTS MUST BE PICKLABLE
+        :return: concurrent.futures.Future
+        """
+        future=Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("cannot submit to a pool that was shut down")
+            self.tasks.append((future,fn,args,kwargs))
+            self.wakeup_writer.send_bytes(b"")
+        return future
+
+    def assign(self,i,task):
+        """
+        SEND A TASK TO THE IDLE i-TH WORKER
+        """
+        future,fn,args,kwargs=task
+        if not future.set_running_or_notify_cancel():
+            return
+
+        worker=self.workers[i]
+        worker["future"]=future
+        worker["started"]=time.monotonic()
+        worker["deadline"]=worker["started"]+self.timeout if self.timeout else None
+
+        try:
+            worker["conn"].send((fn,args,kwargs))
+        except (OSError,ValueError):
+            self.finish(i,WorkerDied("worker exited before it got the task"),None,0.0)
+            self.replace_worker(i,"died",kill=True)
+
+    def finish(self,i,error,result,runtime):
+        """
+        RESOLVE THE FUTURE OF THE TASK OF THE i-TH WORKER
+        """
+        worker=self.workers[i]
+        future=worker["future"]
+        worker["future"]=None
+        worker["deadline"]=None
+        worker["done"]+=1
+
+        future.runtime=runtime
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def collect(self,i):
+        """
+        HANDLE THE RESULT SENT BY THE i-TH WORKER, AND RECYCLE THE WORKER IF IT IS DUE
+        """
+        worker=self.workers[i]
+        try:
+            error,result,runtime,rss=worker["conn"].recv()
+        except (EOFError,OSError):
+            worker["process"].join(1)
+            self.finish(i,WorkerDied("exit code {}".format(worker["process"].exitcode)),None,time.monotonic()-worker["started"])
+            self.replace_worker(i,"died",kill=True)
+            return
+
+        self.finish(i,error,result,runtime)
+
+        if isinstance(error,WorkerMemoryExceeded):
+            self.replace_worker(i,"memory")
+        elif self.max_rss and rss>self.max_rss:
+            self.replace_worker(i,"rss")
+        elif self.max_tasks and worker["done"]>=self.max_tasks:
+            self.replace_worker(i,"tasks")
+
+    def supervise(self):
+        """
+        SUPERVISOR THREAD. HANDS THE TASKS TO IDLE WORKERS, COLLECTS THE RESULTS AND KILLS THE WORKERS OF TASKS THAT RAN PAST THEIR DEADLINE
+        """
+        while True:
+            with self.lock:
+                for i,worker in enumerate(self.workers):
+                    while worker["future"] is None and self.tasks:
+                        self.assign(i,self.tasks.popleft())
+                        worker=self.workers[i]
+
+                busy=[i for i,worker in enumerate(self.workers) if worker["future"] is not None]
+                if self.closed and not self.tasks and not busy:
+                    return
+
+            deadlines=[self.workers[i]["deadline"] for i in busy if self.workers[i]["deadline"]]
+            wait_time=max(0.0,min(deadlines)-time.monotonic()) if deadlines else None
+
+            handles=[self.wakeup_reader]
+            for i in busy:
+                handles+=[self.workers[i]["conn"],self.workers[i]["process"].sentinel]
+            ready=wait(handles,timeout=wait_time)
+
+            while self.wakeup_reader.poll():
+                self.wakeup_reader.recv_bytes()
+
+            for i in busy:
+                worker=self.workers[i]
+                # a result sent right before the worker exited is still collected
+                if worker["conn"] in ready or worker["process"].sentinel in ready:
+                    self.collect(i)
+                elif worker["deadline"] and time.monotonic()>=worker["deadline"]:
+                    self.finish(i,WorkerTimeout("no result after {}s".format(self.timeout)),None,time.monotonic()-worker["started"])
+                    self.replace_worker(i,"timeout",kill=True)
+
+    def shutdown(self,wait=True):
+        """
+        FINISH THE SUBMITTED TASKS AND STOP THE WORKERS
+        :param wait: Wait for the tasks to finish, like ProcessPoolExecutor.shutdown. The pool is always stopped once they are
+        :type wait: Boolean
+        """
+        with self.lock:
+            self.closed=True
+            self.wakeup_writer.send_bytes(b"")
+
+        if not wait:
+            return
+
+        self.supervisor.join()
+        for worker in self.workers:
+            self.stop_worker(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        self.shutdown()